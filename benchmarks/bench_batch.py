@@ -0,0 +1,144 @@
+"""
+Batch API translate round trip against a local server
+
+Generates a synthetic corpus, marks some of its files so that the requests
+for them fail in MockOpenAIServer, and translates the corpus with a batch
+submission and collection for OpenAIModel and AsyncOpenAIModel. The failed
+files are then submitted again with resume, with the failures turned off.
+Checks the outputs and the journal states after each step, and reports the
+wall time of each round trip.
+
+    python3 benchmarks/bench_batch.py --files 20 --fail 3
+"""
+
+import os
+import sys
+import time
+import tempfile
+import contextlib
+
+import click
+import toml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from code_scribe import lib
+from bench_lookup import SEED_PROMPT
+from mock_openai import MockOpenAIServer
+
+FAIL_MARKER = "scribe_fail_marker"
+
+
+def round_trip(model, mapping, resume, poll_interval):
+    """Submit and collect a batch, and return the journal counts and the time."""
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        lib.submit_translate_batch(mapping, "seed.toml", model, resume=resume)
+        counts = lib.collect_translate_batch(model, poll_interval=poll_interval)
+    return counts, time.perf_counter() - start
+
+
+def check_outputs(mapping, failing):
+    """Problems with the outputs and journal records of the files."""
+    records = lib.read_journal(lib.JOURNAL_NAME)
+    problems = []
+
+    for fsource, csource in zip(mapping[0], mapping[1]):
+        state = "failed" if fsource in failing else "done"
+        if records.get(fsource, {}).get("state") != state:
+            problems.append(f"{fsource} is not {state} in the journal")
+        if os.path.isfile(csource) != (state == "done"):
+            problems.append(
+                f"{csource} is {'missing' if state == 'done' else 'written'}"
+            )
+
+    return problems
+
+
+@click.command()
+@click.option("--files", default=20, show_default=True, help="Files in the corpus")
+@click.option("--fail", default=3, show_default=True, help="Files whose requests fail")
+@click.option(
+    "--batch-latency",
+    default=0.5,
+    show_default=True,
+    help="Seconds until the server completes a batch",
+)
+@click.option("--poll-interval", default=0.1, show_default=True)
+def main(files, fail, batch_latency, poll_interval):
+    """Benchmark and check batch submission, collection, and resubmission"""
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    problems = []
+
+    click.echo(f"{'backend':<20}{'step':<10}{'seconds':>10}{'done':>6}{'failed':>8}")
+
+    for name, backend in (
+        ("OpenAIModel", lib.OpenAIModel),
+        ("AsyncOpenAIModel", lib.AsyncOpenAIModel),
+    ):
+        server = MockOpenAIServer(
+            tokens_per_minute=10**9,
+            batch_latency=batch_latency,
+            fail_marker=FAIL_MARKER,
+        )
+        server.start()
+        os.environ["OPENAI_BASE_URL"] = server.url
+        model = backend("gpt-4o-mini")
+
+        with tempfile.TemporaryDirectory() as root_directory:
+            filelist = lib.generate_corpus(
+                root_directory, files=files, directories=4, modules=files
+            )
+
+            # Requests of files with a marker subroutine fail in the server
+            failing = set(filelist[:fail])
+            for fsource in failing:
+                with open(fsource, "a") as source_file:
+                    source_file.write(
+                        f"subroutine {FAIL_MARKER}()\nend subroutine {FAIL_MARKER}\n"
+                    )
+
+            for fsource in filelist:
+                lib.annotate_fortran_file(fsource)
+
+            os.chdir(root_directory)
+            with open("seed.toml", "w") as toml_file:
+                toml.dump({"chat": SEED_PROMPT}, toml_file)
+            mapping = lib.create_src_mapping(filelist)
+
+            for step, resume in (("submit", False), ("resume", True)):
+                counts, elapsed = round_trip(model, mapping, resume, poll_interval)
+                click.echo(
+                    f"{name:<20}{step:<10}{elapsed:>10.2f}"
+                    + f"{counts['done']:>6}{counts['failed']:>8}"
+                )
+                problems.extend(
+                    f"{name} {step}: {problem}"
+                    for problem in check_outputs(mapping, failing)
+                )
+
+                # A resumed submission only sends the files that failed
+                requests = list(server.batches.values())[-1]["request_counts"]
+                if requests["total"] != (fail if resume else files):
+                    problems.append(
+                        f"{name} {step}: {requests['total']} request(s) submitted"
+                    )
+
+                # Resubmitted files go through
+                server.fail_marker = None
+                failing = set()
+
+            os.chdir("/")
+
+        server.stop()
+
+    for problem in problems:
+        click.echo(problem)
+    if problems:
+        raise click.ClickException(f"{len(problems)} problem(s) found")
+
+    click.echo("Outputs and journal states are as expected")
+
+
+if __name__ == "__main__":
+    main()
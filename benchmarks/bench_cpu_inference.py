@@ -0,0 +1,155 @@
+"""
+CPU inference benchmark of local model options
+
+Loads a local checkpoint with each combination of weight configuration and
+torch thread count in a fresh interpreter, and translates a synthetic file
+with its draft. Reports the load time, the resident memory after loading,
+the peak resident memory, and generated tokens per second.
+
+    python3 benchmarks/bench_cpu_inference.py -m <checkpoint_dir> \
+        --configs float32,bfloat16,int8 --threads 4,16
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from code_scribe import lib
+from bench_lookup import SEED_PROMPT
+from bench_memory import max_resident_memory
+
+# Options of TFModel for each weight configuration
+CONFIGS = {
+    "float32": {},
+    "bfloat16": {"dtype": "bfloat16"},
+    "float16": {"dtype": "float16"},
+    "int8": {"quantize": True},
+}
+
+
+def resident_memory():
+    """Current resident memory of this process in megabytes."""
+    with open("/proc/self/status", "r") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def run_case(model, config, threads, max_new_tokens, subroutines):
+    """Load the model with a configuration and time a translation."""
+    with tempfile.TemporaryDirectory() as root_directory:
+        (fsource,) = lib.generate_corpus(
+            root_directory,
+            files=1,
+            directories=1,
+            modules=1,
+            subroutines=subroutines,
+        )
+        lib.annotate_fortran_file(fsource)
+        chat_template = lib.build_translate_prompt(
+            SEED_PROMPT, fsource, os.path.splitext(fsource)[0] + ".scribe"
+        )
+
+    start = time.perf_counter()
+    neural_model = lib.TFModel(
+        model, threads=threads, max_new_tokens=max_new_tokens, **CONFIGS[config]
+    )
+    load_seconds = time.perf_counter() - start
+    rss_mb = resident_memory()
+
+    start = time.perf_counter()
+    response = neural_model.chat(chat_template)
+    seconds = time.perf_counter() - start
+    tokens = neural_model.count_tokens(response)
+
+    return {
+        "config": config,
+        "threads": threads,
+        "load_seconds": load_seconds,
+        "rss_mb": rss_mb,
+        "peak_mb": max_resident_memory(),
+        "tokens": tokens,
+        "seconds": seconds,
+        "tokens_per_second": tokens / max(seconds, 1e-9),
+    }
+
+
+@click.command()
+@click.option("--model", "-m", required=True, help="Local checkpoint directory")
+@click.option(
+    "--configs",
+    default="float32,bfloat16,int8",
+    show_default=True,
+    help=f"Weight configurations out of {', '.join(CONFIGS)}",
+)
+@click.option(
+    "--threads", default=str(os.cpu_count()), help="Torch thread counts to compare"
+)
+@click.option(
+    "--max-new-tokens", default=128, show_default=True, help="Tokens per response"
+)
+@click.option(
+    "--subroutines", default=2, show_default=True, help="Subroutines in the file"
+)
+@click.option("--output", help="Append JSON reports to this file")
+@click.option("--case", hidden=True)
+def main(model, configs, threads, max_new_tokens, subroutines, output, case):
+    """Benchmark load time, memory, and throughput of local model options"""
+    if case:
+        config, case_threads = json.loads(case)
+        click.echo(
+            json.dumps(
+                run_case(model, config, case_threads, max_new_tokens, subroutines)
+            )
+        )
+        return
+
+    click.echo(
+        f"{'config':<10}{'threads':>8}{'load (s)':>10}{'rss (MB)':>10}"
+        + f"{'peak (MB)':>11}{'tokens/s':>10}"
+    )
+
+    for config in configs.split(","):
+        for count in [int(count) for count in threads.split(",")]:
+            # Each case runs in a new interpreter, since thread counts
+            # can be set only once and memory is never returned
+            stdout = subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--model",
+                    model,
+                    "--max-new-tokens",
+                    str(max_new_tokens),
+                    "--subroutines",
+                    str(subroutines),
+                    "--case",
+                    json.dumps([config, count]),
+                ],
+                check=True,
+                stdout=subprocess.PIPE,
+                text=True,
+            ).stdout
+            report = json.loads(stdout.strip().splitlines()[-1])
+
+            if output:
+                with open(output, "a") as json_file:
+                    json_file.write(json.dumps(report) + "\n")
+
+            click.echo(
+                f"{config:<10}{count:>8}{report['load_seconds']:>10.2f}"
+                + f"{report['rss_mb']:>10.1f}{report['peak_mb']:>11.1f}"
+                + f"{report['tokens_per_second']:>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Distributed translate benchmark with local processes as nodes
+
+Generates a synthetic corpus and starts several processes that translate
+it together through a work queue in a shared directory, with a FakeModel
+of fixed latency per request. One node can be killed part way through and
+one can be made slower than the others, to exercise the reassignment of
+files held by dead nodes and by stragglers. Reports the wall time, the
+speed up over the time one node would take, and the merged report.
+
+    python3 benchmarks/bench_distribute.py --nodes 4 --files 40 --kill 0 --straggler 1
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import tempfile
+import subprocess
+
+import click
+import toml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from code_scribe import lib
+from bench_lookup import SEED_PROMPT
+
+
+def run_node(root_directory, index, nodes, latency, lease_seconds, shard):
+    """Translate the corpus in root_directory as one node of the queue."""
+    os.chdir(root_directory)
+    with open("filelist.json", "r") as filelist:
+        mapping = lib.create_src_mapping(json.load(filelist))
+
+    lib.queue_translate(
+        mapping,
+        "seed.toml",
+        "queue",
+        lib.FakeModel(latency=latency),
+        shard=f"{index}/{nodes}" if shard else None,
+        lease_seconds=lease_seconds,
+        poll_interval=lease_seconds / 4,
+    )
+
+
+@click.command()
+@click.option("--nodes", default=4, show_default=True, help="Number of node processes")
+@click.option("--files", default=40, show_default=True, help="Files in the corpus")
+@click.option(
+    "--latency", default=0.2, show_default=True, help="Seconds per model request"
+)
+@click.option(
+    "--lease-seconds", default=2.0, show_default=True, help="Lease of each file"
+)
+@click.option("--kill", type=int, help="Node to kill after --kill-after seconds")
+@click.option("--kill-after", default=1.0, show_default=True)
+@click.option("--straggler", type=int, help="Node that is --slowdown times slower")
+@click.option("--slowdown", default=20.0, show_default=True)
+@click.option("--shard", is_flag=True, help="Claim the shard of each node first")
+@click.option("--node", hidden=True)
+def main(
+    nodes,
+    files,
+    latency,
+    lease_seconds,
+    kill,
+    kill_after,
+    straggler,
+    slowdown,
+    shard,
+    node,
+):
+    """Benchmark several processes translating one corpus through a work queue"""
+    if node:
+        root_directory, index, node_latency = json.loads(node)
+        run_node(root_directory, index, nodes, node_latency, lease_seconds, shard)
+        return
+
+    with tempfile.TemporaryDirectory() as root_directory:
+        filelist = lib.generate_corpus(
+            root_directory, files=files, directories=4, modules=files
+        )
+        for fsource in filelist:
+            lib.annotate_fortran_file(fsource)
+
+        with open(os.path.join(root_directory, "filelist.json"), "w") as json_file:
+            json.dump(filelist, json_file)
+        with open(os.path.join(root_directory, "seed.toml"), "w") as toml_file:
+            toml.dump({"chat": SEED_PROMPT}, toml_file)
+
+        start = time.perf_counter()
+        processes = [
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    __file__,
+                    "--nodes",
+                    str(nodes),
+                    "--lease-seconds",
+                    str(lease_seconds),
+                    "--node",
+                    json.dumps(
+                        [
+                            root_directory,
+                            index,
+                            latency * (slowdown if index == straggler else 1),
+                        ]
+                    ),
+                ]
+                + (["--shard"] if shard else []),
+                stdout=subprocess.DEVNULL,
+            )
+            for index in range(nodes)
+        ]
+
+        if kill is not None:
+            time.sleep(kill_after)
+            processes[kill].send_signal(signal.SIGKILL)
+
+        for process in processes:
+            process.wait()
+        elapsed = time.perf_counter() - start
+
+        os.chdir(root_directory)
+        with open(lib.REPORT_NAME, "r") as report_file:
+            report = json.load(report_file)
+        written = sum(
+            os.path.isfile(csource) for csource in lib.create_src_mapping(filelist)[1]
+        )
+        os.chdir("/")
+
+    summary = report["summary"]
+    click.echo(
+        f"{nodes} node(s), {files} file(s) in {elapsed:.2f}s, "
+        + f"{files * latency / elapsed:.2f}x the speed of one node"
+    )
+    click.echo(f"{'node':<28}{'done':>6}{'failed':>8}{'busy (s)':>10}")
+    for name, counts in sorted(report["nodes"].items()):
+        click.echo(
+            f"{name:<28}{counts['done']:>6}{counts['failed']:>8}"
+            + f"{counts['busy_seconds']:>10.2f}"
+        )
+    click.echo(
+        f"Written {written} of {files} file(s), {summary['done']} done, "
+        + f"{summary['failed']} failed, {summary['duplicates']} duplicate(s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
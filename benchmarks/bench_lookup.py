@@ -0,0 +1,102 @@
+"""
+Draft-guided decoding benchmark for local models
+
+Generates a synthetic corpus with drafts and translates a few files with a
+local checkpoint, first with plain greedy decoding and then with prompt
+lookup decoding for each of the given lookup lengths. Prompt lookup is also
+run on prompts without the draft to show how much of the speed up comes
+from it. Reports generated tokens per second of each configuration.
+
+    python3 benchmarks/bench_lookup.py -m <checkpoint_dir> --lookup 5,10,20
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from code_scribe import lib
+
+SEED_PROMPT = [
+    {
+        "role": "user",
+        "content": "Translate the following Fortran code to C++. Use the draft "
+        + "within <draft> as a starting point and return the C++ code within "
+        + "<csource> and a Fortran interface within <fsource>.",
+    }
+]
+
+
+@click.command()
+@click.option("--model", "-m", required=True, help="Local checkpoint directory")
+@click.option("--files", default=3, show_default=True, help="Files to translate")
+@click.option(
+    "--subroutines", default=2, show_default=True, help="Subroutines per file"
+)
+@click.option("--lookup", default="10", show_default=True, help="Prompt lookup lengths")
+@click.option(
+    "--max-new-tokens", default=256, show_default=True, help="Tokens per response"
+)
+def main(model, files, subroutines, lookup, max_new_tokens):
+    """Benchmark prompt lookup decoding from the draft for a local model"""
+    with tempfile.TemporaryDirectory() as root_directory:
+        filelist = lib.generate_corpus(
+            root_directory,
+            files=files,
+            directories=1,
+            modules=files,
+            subroutines=subroutines,
+        )
+        for fsource in filelist:
+            lib.annotate_fortran_file(fsource)
+
+        drafts = [os.path.splitext(fsource)[0] + ".scribe" for fsource in filelist]
+        prompts = {
+            "draft": [
+                lib.build_translate_prompt(SEED_PROMPT, fsource, cdraft)
+                for fsource, cdraft in zip(filelist, drafts)
+            ],
+            "no draft": [
+                lib.build_translate_prompt(SEED_PROMPT, fsource, "")
+                for fsource in filelist
+            ],
+        }
+
+    configurations = [("plain", 0, "draft"), ("plain", 0, "no draft")]
+    for length in [int(length) for length in lookup.split(",")]:
+        configurations += [
+            (f"lookup {length}", length, "draft"),
+            (f"lookup {length}", length, "no draft"),
+        ]
+
+    click.echo(
+        f"{'decoding':<16}{'prompt':<12}{'tokens':>8}{'seconds':>10}{'tokens/s':>10}"
+    )
+
+    neural_model = lib.TFModel(model)
+
+    # Warm up so that the first configuration does not pay for it
+    neural_model.max_new_tokens = 8
+    neural_model.chat(prompts["draft"][0])
+    neural_model.max_new_tokens = max_new_tokens
+
+    for name, length, prompt in configurations:
+        neural_model.prompt_lookup = length
+
+        start = time.perf_counter()
+        responses = [neural_model.chat(template) for template in prompts[prompt]]
+        elapsed = time.perf_counter() - start
+
+        tokens = sum(neural_model.count_tokens(response) for response in responses)
+        click.echo(
+            f"{name:<16}{prompt:<12}{tokens:>8}{elapsed:>10.2f}"
+            + f"{tokens / max(elapsed, 1e-9):>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Peak memory benchmark for reading large Fortran sources
+
+Writes a synthetic Fortran file of the requested size and reports the peak
+resident memory of fingerprinting, indexing, drafting, and building a
+translate prompt for it. Each case runs in a fresh interpreter, and the
+whole-file reads that these code paths used before are measured next to
+the streaming versions.
+
+    python3 benchmarks/bench_memory.py --size-mb 128
+"""
+
+import os
+import sys
+import copy
+import json
+import hashlib
+import resource
+import tempfile
+import subprocess
+
+import click
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+sys.path.insert(0, ROOT)
+
+from code_scribe import lib
+
+SEED_PROMPT = [{"role": "user", "content": "Translate the following code"}]
+
+
+def legacy_fingerprint(sfile):
+    with open(sfile, "rb") as source:
+        return hashlib.sha256(source.read()).hexdigest()
+
+
+def legacy_draft(sfile):
+    scan = lib.scan_fortran_file(sfile, draft=True)
+    with open(os.path.splitext(sfile)[0] + ".scribe", "w") as scribe_file:
+        scribe_file.write("\n".join(sorted(scan["headers"])) + "\n\n")
+        scribe_file.writelines(scan["content"])
+
+
+def legacy_translate_prompt(sfile):
+    chat_template = copy.deepcopy(SEED_PROMPT)
+
+    with open(sfile, "r") as source:
+        source_code = []
+        for line in source.readlines():
+            if not lib.is_comment(line.strip()):
+                source_code.append(line)
+
+        if source_code:
+            chat_template[-1]["content"] += (
+                "\n" + "<source>\n" + "".join(source_code) + "</source>"
+            )
+
+    return chat_template
+
+
+def streaming_draft(sfile):
+    scribe_filename = os.path.splitext(sfile)[0] + ".scribe"
+    if os.path.isfile(scribe_filename):
+        os.remove(scribe_filename)
+    lib.annotate_fortran_file(sfile)
+
+
+CASES = {
+    "baseline": lambda sfile: None,
+    "fingerprint-legacy": legacy_fingerprint,
+    "fingerprint": lib.file_fingerprint,
+    "index": lib.extract_fortran_info,
+    "meta": lib.extract_fortran_meta,
+    "draft-legacy": legacy_draft,
+    "draft": streaming_draft,
+    "prompt-legacy": legacy_translate_prompt,
+    "prompt": lambda sfile: lib.build_translate_prompt(SEED_PROMPT, sfile, os.devnull),
+}
+
+
+def write_source(sfile, size_mb):
+    """Write a Fortran file of about size_mb megabytes in a single module."""
+    subroutine = "\n".join(
+        [
+            "  subroutine sub_{0}(x, y, n)",
+            "    use mod_base",
+            "    integer :: n, i",
+            "    real(kind=dp) :: x(n), y(n)",
+            "    ! loop over the elements",
+            "    do i = 1, n",
+            "      y(i) = x(i)**2 + &",
+            "             x(i)**3",
+            "    end do",
+            "    call sub_base(x, y, n)",
+            "  end subroutine sub_{0}",
+            "",
+        ]
+    )
+
+    with open(sfile, "w") as source:
+        source.write("module mod_large\n  implicit none\ncontains\n")
+        isub = 0
+        while source.tell() < size_mb * 1024**2:
+            source.write(subroutine.format(isub))
+            isub += 1
+        source.write("end module mod_large\n")
+
+    return isub
+
+
+def max_resident_memory():
+    """Peak resident memory of this process in megabytes."""
+    # ru_maxrss carries over from the parent across exec on Linux, while
+    # VmHWM of /proc/self/status covers only the current program
+    if os.path.isfile("/proc/self/status"):
+        with open("/proc/self/status", "r") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024**2 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def peak_memory(case, sfile):
+    """Return the peak resident memory in megabytes of a case in a new interpreter."""
+    output = subprocess.run(
+        [sys.executable, __file__, "--case", case, sfile],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+    return json.loads(output)["maxrss_mb"]
+
+
+@click.command()
+@click.argument("sfile", required=False)
+@click.option("--size-mb", default=128, show_default=True, help="Source file size")
+@click.option("--case", type=click.Choice(list(CASES)), hidden=True)
+def main(sfile, size_mb, case):
+    """Benchmark peak memory of reading a large Fortran source"""
+    if case:
+        CASES[case](sfile)
+        click.echo(json.dumps({"maxrss_mb": max_resident_memory()}))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        sfile = os.path.join(directory, "large.F90")
+        subroutines = write_source(sfile, size_mb)
+
+        click.echo(
+            f"Source: {os.path.getsize(sfile) / 1024**2:.1f} MB, "
+            + f"{subroutines} subroutines"
+        )
+
+        baseline = peak_memory("baseline", sfile)
+        click.echo(f"Interpreter baseline: {baseline:.1f} MB")
+
+        for name in ("fingerprint", "index", "draft", "prompt", "meta"):
+            streaming = peak_memory(name, sfile) - baseline
+            if f"{name}-legacy" in CASES:
+                legacy = peak_memory(f"{name}-legacy", sfile) - baseline
+                click.echo(
+                    f"{name:>12}: {streaming:8.1f} MB (whole-file reads {legacy:8.1f} MB)"
+                )
+            else:
+                click.echo(f"{name:>12}: {streaming:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Throughput of the OpenAI backends against a rate limited local server
+
+Starts MockOpenAIServer with a tokens-per-minute limit and sends the same
+prompts through OpenAIModel and AsyncOpenAIModel with generate_responses.
+Reports the wall time, the tokens per minute admitted by the server as a
+fraction of its limit, and the number of rate limited requests.
+
+    python3 benchmarks/bench_openai.py --requests 200 --tokens-per-minute 120000
+"""
+
+import os
+import sys
+import time
+import contextlib
+
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from code_scribe import lib
+from mock_openai import MockOpenAIServer
+
+
+@click.command()
+@click.option("--requests", default=200, show_default=True, help="Number of prompts")
+@click.option(
+    "--tokens-per-minute",
+    default=120000,
+    show_default=True,
+    help="Rate limit of the server",
+)
+@click.option(
+    "--latency", default=0.5, show_default=True, help="Server latency per request"
+)
+@click.option(
+    "--prompt-tokens", default=400, show_default=True, help="Tokens per prompt"
+)
+@click.option(
+    "--max-tokens", default=200, show_default=True, help="max_tokens per request"
+)
+@click.option("--jobs", default=32, show_default=True, help="Number of parallel jobs")
+def main(requests, tokens_per_minute, latency, prompt_tokens, max_tokens, jobs):
+    """Benchmark the OpenAI backends against a rate limited local server"""
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+    chat_templates = [
+        [{"role": "user", "content": f"{index:08d} " + "x" * (4 * prompt_tokens - 9)}]
+        for index in range(requests)
+    ]
+
+    click.echo(
+        f"{'backend':<20}{'seconds':>10}{'tokens/min':>12}{'of limit':>10}"
+        + f"{'429s':>8}{'failed':>8}{'peak':>6}"
+    )
+
+    for name, backend in (
+        ("OpenAIModel", lib.OpenAIModel),
+        ("AsyncOpenAIModel", lib.AsyncOpenAIModel),
+    ):
+        server = MockOpenAIServer(tokens_per_minute=tokens_per_minute, latency=latency)
+        server.start()
+        os.environ["OPENAI_BASE_URL"] = server.url
+
+        model = backend("gpt-4o-mini")
+        model.max_tokens = max_tokens
+        failed = []
+
+        start = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            lib.generate_responses(
+                model,
+                chat_templates,
+                jobs=jobs,
+                on_error=lambda index, error: failed.append(index),
+            )
+        elapsed = time.perf_counter() - start
+
+        server.stop()
+        rate = server.tokens * 60.0 / elapsed
+        click.echo(
+            f"{name:<20}{elapsed:>10.2f}{rate:>12.0f}{rate / tokens_per_minute:>10.2f}"
+            + f"{server.rate_limited:>8}{len(failed):>8}{server.max_in_flight:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Pipeline benchmark over synthetic corpora of increasing size
+
+Runs lib.run_benchmarks, the same stages as 'code-scribe bench', for each
+corpus size and appends one JSON report per size to the output file, so
+that results of different releases can be compared.
+
+    python3 benchmarks/bench_pipeline.py --sizes 10,100,1000 --output bench.jsonl
+"""
+
+import os
+import sys
+import json
+import tempfile
+
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from code_scribe import lib
+
+
+@click.command()
+@click.option(
+    "--sizes", default="10,100,1000", show_default=True, help="Corpus sizes in files"
+)
+@click.option(
+    "--subroutines", default=10, show_default=True, help="Subroutines per file"
+)
+@click.option("--repeat", default=3, show_default=True, help="Timing repetitions")
+@click.option("--jobs", default=1, show_default=True, help="Number of parallel jobs")
+@click.option(
+    "--latency", default=0.0, show_default=True, help="Fake model latency per call"
+)
+@click.option("--output", help="Append JSON reports to this file")
+def main(sizes, subroutines, repeat, jobs, latency, output):
+    """Benchmark the pipeline on synthetic corpora of increasing size"""
+    stages = None
+
+    for files in [int(size) for size in sizes.split(",")]:
+        corpus = {
+            "files": files,
+            "directories": max(files // 10, 1),
+            "modules": files // 2,
+            "subroutines": subroutines,
+        }
+
+        with tempfile.TemporaryDirectory() as root_directory:
+            report = lib.run_benchmarks(
+                root_directory, corpus, repeat=repeat, jobs=jobs, latency=latency
+            )
+
+        if output:
+            with open(output, "a") as json_file:
+                json_file.write(json.dumps(report) + "\n")
+
+        if stages is None:
+            stages = list(report["seconds"])
+            click.echo(f"{'files':>8}" + "".join(f"{stage:>22}" for stage in stages))
+
+        click.echo(
+            f"{files:>8}"
+            + "".join(f"{report['seconds'][stage]:>21.4f}s" for stage in stages)
+        )
+
+
+if __name__ == "__main__":
+    main()
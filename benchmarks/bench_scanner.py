@@ -0,0 +1,342 @@
+"""
+Microbenchmark for the single-pass Fortran scanner
+
+Compares lib.scan_fortran_file against the previous per-line re.match
+cascades of extract_fortran_info, filter_file_indexes, extract_fortran_meta,
+and annotate_fortran_file, and checks that both produce identical results.
+
+    python3 benchmarks/bench_scanner.py --files 200 --subroutines 20
+"""
+
+import os
+import re
+import sys
+import time
+import tempfile
+
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from code_scribe import lib
+
+
+def legacy_fortran_info(filepath):
+    """Extracts module and subroutine/function names from a Fortran file."""
+    info = {"modules": [], "subroutines": [], "functions": []}
+
+    with open(filepath, "r") as file:
+        for line in file:
+            line = line.strip()
+            line = line.lower()
+            # Check for module declaration
+            if line.startswith("module "):
+                info["modules"].append(line.split()[1])  # Capture module name
+            # Check for subroutine declaration
+            elif line.startswith("subroutine "):
+                # Extract the subroutine name (first word after "subroutine")
+                match = re.match(r"subroutine\s+(\w+)", line)
+                if match:
+                    info["subroutines"].append(
+                        match.group(1)
+                    )  # Capture subroutine name
+            # Check for function declaration
+            elif line.startswith("function "):
+                # Extract the function name (first word after "function")
+                match = re.match(r"function\s+(\w+)", line)
+                if match:
+                    info["functions"].append(match.group(1))  # Capture function name
+
+    return info
+
+
+def legacy_fortran_meta(sfile):
+    """Extract function, subroutine, module names, variables, and argument lists from Fortran source."""
+    meta_info = []
+    current_construct = None
+    variables_declared = []
+    argument_list = []
+
+    with open(sfile, "r") as source:
+        for line in source.readlines():
+            stripped_line = line.strip()
+
+            # Check for subroutine, module, or function start
+            construct_match = re.match(
+                r"^\s*(subroutine|function|module)\s+(\w+)",
+                stripped_line,
+                re.IGNORECASE,
+            )
+            if construct_match:
+                # If we were already inside a construct, save the previous one
+                if current_construct:
+                    meta_info.append(
+                        {
+                            "name": current_construct["name"],
+                            "type": current_construct["type"],
+                            "variables_declared": variables_declared,
+                            "argument_list": argument_list,
+                        }
+                    )
+
+                # Start a new construct
+                current_construct = {
+                    "name": construct_match.group(2),
+                    "type": construct_match.group(1).lower(),
+                }
+                variables_declared = []  # Reset variables declared
+                argument_list = []  # Reset argument list
+
+                # If it's a function or subroutine, look for the argument list
+                if current_construct["type"] in ["function", "subroutine"]:
+                    args_match = re.search(r"\((.*?)\)", stripped_line)
+                    if args_match:
+                        arguments = [
+                            arg.strip() for arg in args_match.group(1).split(",")
+                        ]
+                        argument_list.extend(arguments)
+
+            # Extract variable declarations (e.g., integer, real, character, etc.)
+            var_match = re.match(
+                r"^\s*(integer|real|double\s*precision|character|logical)\s+([\w\s,]*)",
+                stripped_line,
+                re.IGNORECASE,
+            )
+            if var_match:
+                variables = [var.strip() for var in var_match.group(2).split(",")]
+                variables_declared.extend(variables)
+
+        # Save the last construct if it exists
+        if current_construct:
+            meta_info.append(
+                {
+                    "name": current_construct["name"],
+                    "type": current_construct["type"],
+                    "variables_declared": variables_declared,
+                    "argument_list": argument_list,
+                }
+            )
+
+    return meta_info
+
+
+def legacy_uses_calls(sfile):
+    """Legacy extraction of used modules and called subroutines."""
+    used_modules = set()
+    used_subroutines = set()
+
+    # Open and read the source file
+    with open(sfile, "r") as source:
+        for line in source.readlines():
+            stripped_line = line.strip()
+
+            # Check for 'use' statement to capture modules
+            module_match = re.match(r"^\s*use\s+(\w+)", stripped_line, re.IGNORECASE)
+            if module_match:
+                module_name = module_match.group(1).lower()
+                used_modules.add(module_name)
+
+            # Check for 'call' statement to capture subroutines
+            subroutine_match = re.match(
+                r"^\s*call\s+(\w+)", stripped_line, re.IGNORECASE
+            )
+            if subroutine_match:
+                subroutine_name = subroutine_match.group(1).lower()
+                used_subroutines.add(subroutine_name)
+
+    return used_modules, used_subroutines
+
+
+def legacy_draft(sfile):
+    """Legacy line-by-line draft conversion."""
+    header_includes = set(
+        ("#include <cmath>", "#include <complex>")
+    )  # Keep track of headers to avoid duplicates
+    content_lines = []  # Store lines of modified content
+    with open(sfile, "r") as source:
+        source_code = source.readlines()
+
+        for line in source_code:
+            stripped_line = line.strip()
+
+            # Skip lines that are comments starting with 'c', '!!', or '!'
+            if stripped_line.lower().startswith(("c", "!!", "!")) and (
+                not stripped_line.lower().startswith(("complex"))
+            ):
+                continue
+
+            # Replace 'use <module_name>' with '#include' and 'using namespace'
+            use_match = re.match(r"\buse\s+(\w+)", stripped_line, flags=re.IGNORECASE)
+            if use_match:
+                module_name = use_match.group(1)
+
+                # Add header include globally but only once
+                header_includes.add(f"#include <{module_name}.hpp>")
+
+                # Replace 'use' with 'using namespace' inline
+                content_lines.append(f"using namespace {module_name};\n")
+                continue
+
+            # Remove implict none statement
+            line = re.sub(r"implicit none", "", line)
+
+            # Handle variable declarations and conversions
+            line = re.sub(r"\binteger\b\s*", "int", line, flags=re.IGNORECASE)
+            line = re.sub(
+                r"\breal\s*(\(\s*kind\s*=\s*\w+\s*\)|\(\s*\w+\s*\)|)?\s*",
+                "double",
+                line,
+                flags=re.IGNORECASE,
+            )
+            line = re.sub(
+                r"\bcomplex\s*\(\s*dp\s*\)\s*",
+                "complex<double> ",
+                line,
+                flags=re.IGNORECASE,
+            )
+            line = re.sub(
+                r"\bcomplex\s*\(\s*integer\s*\)\s*",
+                "complex<int> ",
+                line,
+                flags=re.IGNORECASE,
+            )
+            line = re.sub(
+                r"\bcomplex\s*\(\s*logical\s*\)\s*",
+                "complex<bool> ",
+                line,
+                flags=re.IGNORECASE,
+            )
+            line = re.sub(r"(?<!std::)\s*::", "", line)
+
+            # Handle complex types in variable declarations, ensuring dimensionality is handled
+            line = re.sub(
+                r"\bcomplex<([^>]+)>\s*(\w+)\s*\((.*?)\)\s*",
+                r"FArray<std::complex<\1>> \2(\3)",
+                line,
+            )
+
+            line = re.sub(
+                r"\b(real|double|int|bool|complex<[^>]+>)\s*,?\s*dimension\s*\((.*?)\)\s*(\w+)\s*;",
+                r"FArray<\1> \3(\2)",
+                line,
+                flags=re.IGNORECASE,
+            )
+
+            line = re.sub(
+                r"\b(real|double|int|bool|complex<[^>]+>)\s*(\w+)\s*\((.*?)\)\s*;",
+                r"FArray<\1> \2(\3)",
+                line,
+                flags=re.IGNORECASE,
+            )
+
+            # Treat line continuation characters. Replace them with equivalent syntax in C++
+            line = re.sub(r"^\s*&", r"\\", line)
+            line = re.sub(r"\s*&\s*$", r" \\", line)
+
+            # Substitution x**y with pow(x,y)
+            line = re.sub(r"(\w+)\s*\*\*\s*(\d+)", r"pow(\1,\2)", line)
+
+            # Add a semicolon at the end of variable declarations
+            # if re.match(r"^(int|double|complex<[^>]+>)\s", line.strip()):
+            #    line = line.strip() + ";"
+
+            # Append the modified line to content_lines
+            content_lines.append(line.strip() + "\n")
+
+    return header_includes, content_lines
+
+
+def legacy_scan(sfile):
+    """Run all legacy extractors, reading the file once per extractor."""
+    return (
+        legacy_fortran_info(sfile),
+        legacy_uses_calls(sfile),
+        legacy_fortran_meta(sfile),
+        legacy_draft(sfile),
+    )
+
+
+def scanner_scan(sfile):
+    """Run the single-pass scanner and arrange results like legacy_scan."""
+    scan = lib.scan_fortran_file(sfile, draft=True)
+    return (
+        {key: scan[key] for key in ("modules", "subroutines", "functions")},
+        (scan["uses"], scan["calls"]),
+        scan["meta"],
+        (scan["headers"], scan["content"]),
+    )
+
+
+def write_corpus(directory, files, subroutines):
+    """Write a corpus of Fortran files with modules, subroutines and declarations."""
+    filelist = []
+
+    for ifile in range(files):
+        lines = [f"! File {ifile}", f"module mod_{ifile}", "  use iso_c_binding"]
+        lines += ["  implicit none", "  real(dp), dimension(10) :: table;", "contains"]
+
+        for isub in range(subroutines):
+            lines += [
+                f"  subroutine sub_{ifile}_{isub}(x, y, n)",
+                f"    use mod_{max(ifile - 1, 0)}",
+                "    integer :: n, i",
+                "    real(kind=dp) :: x(n), y(n)",
+                "    complex(dp) :: z",
+                "    logical :: flag",
+                "    ! loop over the elements",
+                "    do i = 1, n",
+                "      y(i) = x(i)**2 + &",
+                "             x(i)**3",
+                "    end do",
+                f"    call sub_{ifile}_{max(isub - 1, 0)}(x, y, n)",
+                f"  end subroutine sub_{ifile}_{isub}",
+            ]
+
+        lines += [f"end module mod_{ifile}"]
+
+        filename = os.path.join(directory, f"file_{ifile}.F90")
+        with open(filename, "w") as source:
+            source.write("\n".join(lines) + "\n")
+        filelist.append(filename)
+
+    return filelist
+
+
+def time_scans(scan, filelist, repeat):
+    """Return the best wall time of scanning all files over repeat runs."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for sfile in filelist:
+            scan(sfile)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@click.command()
+@click.option("--files", default=200, show_default=True, help="Number of files")
+@click.option(
+    "--subroutines", default=20, show_default=True, help="Subroutines per file"
+)
+@click.option("--repeat", default=3, show_default=True, help="Timing repetitions")
+def main(files, subroutines, repeat):
+    """Benchmark the single-pass scanner against the legacy extractors"""
+    with tempfile.TemporaryDirectory() as directory:
+        filelist = write_corpus(directory, files, subroutines)
+
+        for sfile in filelist:
+            if legacy_scan(sfile) != scanner_scan(sfile):
+                raise RuntimeError(f"Scanner output differs for {sfile}")
+
+        legacy = time_scans(legacy_scan, filelist, repeat)
+        scanner = time_scans(scanner_scan, filelist, repeat)
+
+    lines = files * (6 + 13 * subroutines + 1)
+    click.echo(f"Corpus: {files} files, {lines} lines")
+    click.echo(f"Legacy extractors: {legacy:.3f}s")
+    click.echo(f"Single-pass scanner: {scanner:.3f}s")
+    click.echo(f"Speedup: {legacy / scanner:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
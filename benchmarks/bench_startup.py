@@ -0,0 +1,69 @@
+"""
+Start up benchmark for the code-scribe command line
+
+Runs short code-scribe commands in fresh interpreters and reports
+the median and best wall time of each.
+
+    python3 benchmarks/bench_startup.py --runs 20
+"""
+
+import os
+import sys
+import time
+import statistics
+import subprocess
+
+import click
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+COMMANDS = [
+    ["--version"],
+    ["index", "--help"],
+    ["translate", "--help"],
+]
+
+
+def time_script(script, args, runs):
+    """Return wall times of running a Python script with args in new interpreters."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    timings = []
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", script, *args],
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def report(label, timings):
+    """Print the median and best time of a set of runs."""
+    click.echo(
+        f"{label}: median {statistics.median(timings) * 1000:.1f} ms, "
+        + f"best {min(timings) * 1000:.1f} ms"
+    )
+
+
+@click.command()
+@click.option("--runs", default=20, show_default=True, help="Runs per command")
+def main(runs):
+    """Benchmark start up time of code-scribe commands"""
+    report("python -c pass", time_script("pass", [], runs))
+
+    for args in COMMANDS:
+        report(
+            f"code-scribe {' '.join(args)}",
+            time_script(
+                "import code_scribe; code_scribe.cli.code_scribe()", args, runs
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint
+
+Serves /v1/chat/completions with a fixed latency and enforces a
+tokens-per-minute limit with a token bucket. Requests over the limit get
+a 429 response with the retry-after and x-ratelimit-* headers of the
+real API, and every request is counted against the limit with its
+estimated prompt tokens plus max_tokens, the same as the API does.
+
+The /v1/files and /v1/batches endpoints stand in for the Batch API.
+Batches complete batch_latency seconds after they are created, outside
+of the rate limit, and requests whose messages contain fail_marker get
+an error in the error file of the batch.
+
+Prompt caching is simulated the way the API reports it: prompts of at
+least 1024 tokens get cached_tokens for the longest prefix, in blocks of
+128 tokens, that an earlier request has already sent.
+
+    server = MockOpenAIServer(tokens_per_minute=60000, latency=0.5)
+    server.start()
+    os.environ["OPENAI_BASE_URL"] = server.url
+"""
+
+import json
+import time
+import email
+import hashlib
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockOpenAIServer:
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        tokens_per_minute=60000,
+        latency=0.5,
+        completion_tokens=64,
+        batch_latency=1.0,
+        fail_marker=None,
+    ):
+        self.tokens_per_minute = tokens_per_minute
+        self.latency = latency
+        self.completion_tokens = completion_tokens
+        self.batch_latency = batch_latency
+        self.fail_marker = fail_marker
+
+        self.files = {}
+        self.batches = {}
+        self.prefixes = set()
+
+        self.requests = 0
+        self.rate_limited = 0
+        self.tokens = 0
+        self.max_in_flight = 0
+
+        self._in_flight = 0
+        self._budget = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.url = f"http://{host}:{self.httpd.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _take(self, tokens):
+        """Take tokens from the bucket, or return the seconds until they are available."""
+        with self._lock:
+            now = time.monotonic()
+            self._budget = min(
+                float(self.tokens_per_minute),
+                self._budget + (now - self._updated) * self.tokens_per_minute / 60.0,
+            )
+            self._updated = now
+
+            if tokens > self._budget:
+                self.rate_limited += 1
+                return (tokens - self._budget) * 60.0 / self.tokens_per_minute
+
+            self._budget -= tokens
+            self.requests += 1
+            self.tokens += tokens
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            return 0.0
+
+    def _headers(self, wait=0.0):
+        return {
+            "x-ratelimit-limit-tokens": str(self.tokens_per_minute),
+            "x-ratelimit-remaining-tokens": str(max(int(self._budget), 0)),
+            "x-ratelimit-reset-tokens": f"{max(wait, 0.001) * 1000:.0f}ms",
+        }
+
+    def _response(self, body):
+        content = "".join(message["content"] for message in body["messages"])
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        return (
+            f"<csource>\n// {digest}\n</csource>\n"
+            + f"<fsource>\n! interface {digest[:16]}\n</fsource>"
+        )
+
+    def _cached_tokens(self, body):
+        text = json.dumps(body["messages"])
+        if len(text) < 4 * 1024:
+            return 0
+
+        ends = range(4 * 1024, len(text) + 1, 4 * 128)
+        digests = [
+            hashlib.sha256(text[:end].encode("utf-8")).hexdigest() for end in ends
+        ]
+
+        cached = 0
+        with self._lock:
+            for end, digest in zip(ends, digests):
+                if digest not in self.prefixes:
+                    break
+                cached = end
+            self.prefixes.update(digests)
+        return cached // 4
+
+    def _completion(self, body):
+        prompt_tokens = (
+            sum(len(message["content"]) for message in body["messages"]) // 4
+        )
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self._response(body)},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": prompt_tokens + self.completion_tokens,
+                "prompt_tokens_details": {
+                    "cached_tokens": min(self._cached_tokens(body), prompt_tokens)
+                },
+            },
+        }
+
+    def _add_file(self, content, purpose):
+        file_id = f"file-{len(self.files)}"
+        self.files[file_id] = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": f"{file_id}.jsonl",
+            "purpose": purpose,
+            "status": "processed",
+            "content": content,
+        }
+        return file_id
+
+    def _create_batch(self, body):
+        batch_id = f"batch-{len(self.batches)}"
+        requests = [
+            json.loads(line)
+            for line in self.files[body["input_file_id"]]["content"].splitlines()
+            if line.strip()
+        ]
+        batch = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body["endpoint"],
+            "completion_window": body["completion_window"],
+            "input_file_id": body["input_file_id"],
+            "status": "in_progress",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": len(requests), "completed": 0, "failed": 0},
+        }
+        self.batches[batch_id] = batch
+
+        def _complete():
+            time.sleep(self.batch_latency)
+            output, errors = [], []
+            for request in requests:
+                content = "".join(m["content"] for m in request["body"]["messages"])
+                if self.fail_marker and self.fail_marker in content:
+                    errors.append(
+                        {
+                            "custom_id": request["custom_id"],
+                            "response": {
+                                "status_code": 400,
+                                "body": {"error": {"message": "Invalid request"}},
+                            },
+                            "error": None,
+                        }
+                    )
+                else:
+                    output.append(
+                        {
+                            "custom_id": request["custom_id"],
+                            "response": {
+                                "status_code": 200,
+                                "body": self._completion(request["body"]),
+                            },
+                            "error": None,
+                        }
+                    )
+
+            with self._lock:
+                if output:
+                    batch["output_file_id"] = self._add_file(
+                        "".join(json.dumps(line) + "\n" for line in output),
+                        "batch_output",
+                    )
+                if errors:
+                    batch["error_file_id"] = self._add_file(
+                        "".join(json.dumps(line) + "\n" for line in errors),
+                        "batch_output",
+                    )
+                batch["request_counts"].update(
+                    completed=len(output), failed=len(errors)
+                )
+                batch["status"] = "completed"
+
+        threading.Thread(target=_complete, daemon=True).start()
+        return batch
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload, headers):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _file(self, file_id):
+                return {
+                    key: value
+                    for key, value in server.files[file_id].items()
+                    if key != "content"
+                }
+
+            def do_GET(self):
+                parts = self.path.strip("/").split("/")
+
+                if parts[1:2] == ["batches"] and parts[2] in server.batches:
+                    with server._lock:
+                        self._send(200, server.batches[parts[2]], {})
+
+                elif parts[1:2] == ["files"] and parts[2] in server.files:
+                    if parts[3:] == ["content"]:
+                        data = server.files[parts[2]]["content"].encode("utf-8")
+                        self.send_response(200)
+                        self.send_header("Content-Type", "application/jsonl")
+                        self.send_header("Content-Length", str(len(data)))
+                        self.end_headers()
+                        self.wfile.write(data)
+                    else:
+                        self._send(200, self._file(parts[2]), {})
+
+                else:
+                    self._send(404, {"error": {"message": "not found"}}, {})
+
+            def do_POST(self):
+                data = self.rfile.read(int(self.headers["Content-Length"]))
+
+                if self.path.endswith("/files"):
+                    # Multipart upload with a purpose field and a file field
+                    message = email.message_from_bytes(
+                        f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+                        + data
+                    )
+                    fields = {
+                        part.get_param("name", header="content-disposition"): part
+                        for part in message.get_payload()
+                    }
+                    file_id = server._add_file(
+                        fields["file"].get_payload(decode=True).decode("utf-8"),
+                        fields["purpose"].get_payload(),
+                    )
+                    self._send(200, self._file(file_id), {})
+                    return
+
+                body = json.loads(data)
+
+                if self.path.endswith("/batches"):
+                    self._send(200, server._create_batch(body), {})
+                    return
+
+                if not self.path.endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": "not found"}}, {})
+                    return
+
+                prompt_tokens = (
+                    sum(len(message["content"]) for message in body["messages"]) // 4
+                )
+                tokens = prompt_tokens + body.get("max_tokens", 4096)
+
+                wait = server._take(tokens)
+                if wait:
+                    self._send(
+                        429,
+                        {
+                            "error": {
+                                "message": "Rate limit reached",
+                                "type": "tokens",
+                                "code": "rate_limit_exceeded",
+                            }
+                        },
+                        dict(server._headers(wait), **{"retry-after": f"{wait:.3f}"}),
+                    )
+                    return
+
+                try:
+                    time.sleep(server.latency)
+                    self._send(200, server._completion(body), server._headers())
+                finally:
+                    with server._lock:
+                        server._in_flight -= 1
+
+        return Handler
@@ -1,5 +1,14 @@
 """Initialize CodeScribe"""
 
-from . import api
-from . import cli
-from . import lib
+import importlib
+
+# Subpackages are loaded on first access to keep start up time of the
+# command line low, code_scribe.api, code_scribe.cli, and code_scribe.lib
+# remain available as attributes
+__all__ = ["api", "cli", "lib"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
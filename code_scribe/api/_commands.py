@@ -4,38 +4,245 @@ import os
 from code_scribe import lib
 
 
-def index(root_dir):
+def model_load_options(**model_options):
+    """Options of the model that are set, applied when the model is loaded."""
+    return {name: value for name, value in model_options.items() if value}
+
+
+def index(
+    root_dir,
+    incremental=False,
+    jobs=1,
+    database=False,
+    profile=None,
+    defines=(),
+    include_dirs=(),
+    cpp=False,
+):
     """
-    API command for creating an index for directory tree
+    API command for creating an index for directory tree. Includes and
+    preprocessor conditionals are resolved when defines, include_dirs,
+    or cpp are given.
     """
-    lib.create_scribe_yaml(root_dir)
+    preprocess = (
+        lib.preprocess_options(defines, include_dirs, cpp)
+        if (defines or include_dirs or cpp)
+        else None
+    )
+
+    with lib.profiling(profile), lib.span("index"):
+        parsed = lib.create_scribe_yaml(
+            root_dir,
+            incremental=incremental,
+            jobs=jobs,
+            database=database,
+            preprocess=preprocess,
+        )
+
+    if incremental:
+        return f"Project structure saved to scribe.yaml. Parsed {parsed} changed files."
+
     return f"Project structure saved to scribe.yaml."
 
 
-def draft(fortran_files):
+def draft(fortran_files, jobs=1, profile=None):
     """
     API command for creating a draft files
     """
     file_index = {}  # lib.create_file_indexes()
 
-    for sfile in fortran_files:
-        message = lib.annotate_fortran_file(sfile, file_index)
-        print(message)
+    with lib.profiling(profile):
+        with lib.span("draft", files=len(fortran_files), jobs=jobs):
+            messages = lib.parallel_map(
+                lib.annotate_fortran_file,
+                fortran_files,
+                [file_index] * len(fortran_files),
+                jobs=jobs,
+            )
 
+        for message in messages:
+            print(message)
 
-def translate(filelist, seed_prompt, model, save_prompts=False):
+
+def translate(
+    filelist,
+    seed_prompt,
+    model,
+    save_prompts=False,
+    jobs=1,
+    batch_size=1,
+    cache_dir=None,
+    no_cache=False,
+    stream=False,
+    server=None,
+    schedule=False,
+    resume=False,
+    chunk=False,
+    profile=None,
+    batch_submit=False,
+    batch_collect=False,
+    poll_interval=30.0,
+    shard=None,
+    queue=None,
+    lease_seconds=600.0,
+    **model_options,
+):
     """
-    API command for creating a draft files
+    API command for creating a draft files. Returns the number of files
+    in each state of the journal, or None if nothing was translated.
     """
+    counts = None
     mapping = lib.create_src_mapping(filelist)
-    lib.prompt_translate(mapping, seed_prompt, model=model, save_prompts=save_prompts)
+    model = lib.ServerModel(server) if server else model
+    cache = lib.ResponseCache(cache_dir) if (model and not no_cache) else None
+    options = model_load_options(**model_options)
 
+    with lib.profiling(profile), lib.span("translate"):
+        if model and options:
+            with lib.span("load_model"):
+                model = lib.load_model(model, **options)
 
-def inspect(filelist, query_prompt, model, save_prompts=False):
+        if batch_submit:
+            lib.submit_translate_batch(
+                mapping, seed_prompt, model, cache=cache, resume=resume, chunk=chunk
+            )
+
+        elif batch_collect:
+            counts = lib.collect_translate_batch(
+                model, cache=cache, poll_interval=poll_interval
+            )
+
+        elif queue:
+            counts = lib.queue_translate(
+                mapping,
+                seed_prompt,
+                queue,
+                model,
+                shard=shard,
+                jobs=jobs,
+                batch_size=batch_size,
+                lease_seconds=lease_seconds,
+                poll_interval=poll_interval,
+                cache=cache,
+                stream=stream,
+                chunk=chunk,
+            )
+
+        elif shard:
+            counts = lib.shard_translate(
+                mapping,
+                seed_prompt,
+                shard,
+                model=model,
+                jobs=jobs,
+                batch_size=batch_size,
+                cache=cache,
+                stream=stream,
+                resume=resume,
+                chunk=chunk,
+            )
+
+        else:
+            counts = lib.prompt_translate(
+                mapping,
+                seed_prompt,
+                model=model,
+                save_prompts=save_prompts,
+                jobs=jobs,
+                batch_size=batch_size,
+                cache=cache,
+                stream=stream,
+                schedule=schedule,
+                resume=resume,
+                chunk=chunk,
+            )
+
+    return counts
+
+
+def inspect(
+    filelist,
+    query_prompt,
+    model,
+    save_prompts=False,
+    cache_dir=None,
+    no_cache=False,
+    stream=False,
+    server=None,
+    profile=None,
+    **model_options,
+):
     """
     API command for creating a draft files
     """
-    file_index = {}  # lib.create_file_indexes()
-    lib.prompt_inspect(
-        filelist, query_prompt, file_index, model=model, save_prompts=save_prompts
-    )
+    model = lib.ServerModel(server) if server else model
+    options = model_load_options(**model_options)
+    db_path = lib.find_scribe_db()
+    file_index = lib.ScribeDB(db_path) if db_path else {}
+
+    # A database found above the working directory may index another tree
+    if file_index and not file_index.covers(filelist):
+        print(f"Not using {db_path}, the files are outside of {file_index.root}")
+        file_index.close()
+        file_index = {}
+    cache = lib.ResponseCache(cache_dir) if (model and not no_cache) else None
+
+    with lib.profiling(profile), lib.span("inspect"):
+        if model and options:
+            with lib.span("load_model"):
+                model = lib.load_model(model, **options)
+
+        lib.prompt_inspect(
+            filelist,
+            query_prompt,
+            file_index,
+            model=model,
+            save_prompts=save_prompts,
+            cache=cache,
+            stream=stream,
+        )
+
+
+def serve(model, host, port, batch_size=8, **model_options):
+    """
+    API command for serving a model to translate and inspect
+    """
+    options = model_load_options(**model_options)
+    if options:
+        model = lib.load_model(model, **options)
+
+    lib.serve_model(model, host=host, port=port, batch_size=batch_size)
+
+
+def bench(
+    corpus,
+    output=None,
+    root_dir=None,
+    repeat=3,
+    jobs=1,
+    batch_size=1,
+    latency=0.0,
+    tokens_per_second=None,
+):
+    """
+    API command for benchmarking the pipeline on a synthetic corpus
+    """
+    import json
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report = lib.run_benchmarks(
+            root_dir or tmp_dir,
+            corpus,
+            repeat=repeat,
+            jobs=jobs,
+            batch_size=batch_size,
+            latency=latency,
+            tokens_per_second=tokens_per_second,
+        )
+
+    if output:
+        with open(output, "w") as json_file:
+            json.dump(report, json_file, indent=4)
+
+    return report
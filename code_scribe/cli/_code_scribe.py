@@ -1,12 +1,10 @@
 """Command line interface for Jobrunner"""
 
-# Standard libraries
-import subprocess
-import pkg_resources
-
 # Feature libraries
 import click
 
+from code_scribe.__meta__ import __version__
+
 
 @click.group(name="code-scribe", invoke_without_command=True)
 @click.pass_context
@@ -17,11 +15,7 @@ def code_scribe(ctx, version):
     Software development tool for converting code from Fortran to C++
     """
     if ctx.invoked_subcommand is None and not version:
-        subprocess.run(
-            "export PATH=~/.local/bin:/usr/local/bin:$PATH && code-scribe --help",
-            shell=True,
-            check=True,
-        )
+        click.echo(ctx.get_help())
 
     if version:
-        click.echo(pkg_resources.require("CodeScribe")[0].version)
+        click.echo(__version__)
@@ -13,7 +13,50 @@ from code_scribe import lib
 
 @code_scribe.command(name="index")
 @click.argument("root-dir", required=True)
-def index(root_dir):
+@click.option(
+    "--incremental",
+    "-i",
+    is_flag=True,
+    help="Only parse files that changed since the last index",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of processes used for parsing files",
+)
+@click.option(
+    "--database",
+    "-d",
+    is_flag=True,
+    help="Also create a consolidated scribe.db index at the project root",
+)
+@click.option(
+    "--profile",
+    help="Print time spent in each stage and write a Chrome trace to this JSON file",
+)
+@click.option(
+    "--include-dir",
+    "-I",
+    "include_dirs",
+    multiple=True,
+    help="Directory searched for include files after that of the including file",
+)
+@click.option(
+    "--define",
+    "-D",
+    "defines",
+    multiple=True,
+    help="Preprocessor macro as NAME or NAME=VALUE, implies --cpp",
+)
+@click.option(
+    "--cpp",
+    is_flag=True,
+    help="Keep only the active branches of #if, #ifdef and #ifndef blocks",
+)
+def index(root_dir, incremental, jobs, database, profile, include_dirs, defines, cpp):
     """
     \b
     Index Fortran files along a project directory tree
@@ -25,13 +68,34 @@ def index(root_dir):
     and functions
     \b
     """
-    message = api.index(os.path.abspath(root_dir))
+    message = api.index(
+        os.path.abspath(root_dir),
+        incremental,
+        jobs,
+        database,
+        profile,
+        defines,
+        include_dirs,
+        cpp,
+    )
     click.echo(message)
 
 
 @code_scribe.command(name="draft")
 @click.argument("fortran-files", nargs=-1, required=True)
-def draft(fortran_files):
+@click.option(
+    "--jobs",
+    "-j",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of processes used for parsing files",
+)
+@click.option(
+    "--profile",
+    help="Print time spent in each stage and write a Chrome trace to this JSON file",
+)
+def draft(fortran_files, jobs, profile):
     """
     \b
     Perform a draft conversion from Fortran to C++
@@ -42,7 +106,7 @@ def draft(fortran_files):
     prepare a list of files for generative AI use
     \b
     """
-    api.draft(fortran_files)
+    api.draft(fortran_files, jobs, profile)
 
 
 @code_scribe.command(name="translate")
@@ -65,7 +129,143 @@ def draft(fortran_files):
     help="Save file specific prompts to json file",
     mutually_exclusive=["model"],
 )
-def translate(fortran_files, seed_prompt, model, save_prompts):
+@click.option(
+    "--jobs",
+    "-j",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of model requests to keep in flight",
+)
+@click.option(
+    "--batch-size",
+    "-b",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of prompts grouped into a single generation call",
+)
+@click.option(
+    "--cache-dir",
+    default=None,
+    help="Directory for cached model responses [default: ~/.cache/code-scribe]",
+)
+@click.option(
+    "--no-cache", is_flag=True, help="Do not read or write cached model responses"
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    help="Write output sections to disk as they are generated",
+)
+@click.option(
+    "--server",
+    help="Address of a model served with 'code-scribe serve', e.g. 127.0.0.1:8470",
+)
+@click.option(
+    "--schedule",
+    is_flag=True,
+    help="Translate files in dependency order and include generated code of dependencies in prompts",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Retry only files that failed or did not finish in the journal of the previous run",
+)
+@click.option(
+    "--chunk",
+    is_flag=True,
+    help="Translate files one module, subroutine, and function at a time",
+)
+@click.option(
+    "--profile",
+    help="Print time spent in each stage and write a Chrome trace to this JSON file",
+)
+@click.option(
+    "--batch-submit",
+    is_flag=True,
+    cls=lib.MutuallyExclusiveOption,
+    help="Submit prompts of all files as an OpenAI batch and return",
+    mutually_exclusive=[
+        "batch_collect",
+        "save_prompts",
+        "server",
+        "schedule",
+        "stream",
+        "shard",
+        "queue",
+    ],
+)
+@click.option(
+    "--batch-collect",
+    is_flag=True,
+    cls=lib.MutuallyExclusiveOption,
+    help="Wait for the submitted OpenAI batch and write its outputs",
+    mutually_exclusive=[
+        "batch_submit",
+        "save_prompts",
+        "server",
+        "schedule",
+        "stream",
+        "shard",
+        "queue",
+    ],
+)
+@click.option(
+    "--poll-interval",
+    default=30.0,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Seconds between status checks of --batch-collect or --queue",
+)
+@click.option(
+    "--shard",
+    cls=lib.MutuallyExclusiveOption,
+    help="Translate only shard i/N of the files, e.g. 0/4, or claim it first with --queue",
+    mutually_exclusive=["batch_submit", "batch_collect", "save_prompts", "schedule"],
+)
+@click.option(
+    "--queue",
+    cls=lib.MutuallyExclusiveOption,
+    help="Directory on a shared filesystem to pull files from together with other nodes",
+    mutually_exclusive=["batch_submit", "batch_collect", "save_prompts", "schedule"],
+)
+@click.option(
+    "--lease-seconds",
+    default=600.0,
+    show_default=True,
+    type=click.FloatRange(min=0, min_open=True),
+    help="Seconds after which files of a silent or straggling node are reassigned",
+)
+@click.option(
+    "--requests-per-minute",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Maximum request rate of an API model, e.g. -m openai",
+)
+@lib.local_model_options
+def translate(
+    fortran_files,
+    seed_prompt,
+    model,
+    save_prompts,
+    jobs,
+    batch_size,
+    cache_dir,
+    no_cache,
+    stream,
+    server,
+    schedule,
+    resume,
+    chunk,
+    profile,
+    batch_submit,
+    batch_collect,
+    poll_interval,
+    shard,
+    queue,
+    lease_seconds,
+    **model_options,
+):
     """
     \b
     Perform a generative AI conversion of Fortran files
@@ -77,11 +277,35 @@ def translate(fortran_files, seed_prompt, model, save_prompts):
     interface
     \b
     """
-    if (not model) and (not save_prompts):
+    if (not model) and (not server) and (not save_prompts):
         raise click.UsageError(
-            "Please provide either the '--model/-m' or '--save-prompts/-p' option"
+            "Please provide either the '--model/-m', '--server' or '--save-prompts/-p' option"
         )
-    api.translate(fortran_files, seed_prompt, model, save_prompts)
+    counts = api.translate(
+        fortran_files,
+        seed_prompt,
+        model,
+        save_prompts,
+        jobs,
+        batch_size,
+        cache_dir,
+        no_cache,
+        stream,
+        server,
+        schedule,
+        resume,
+        chunk,
+        profile,
+        batch_submit,
+        batch_collect,
+        poll_interval,
+        shard,
+        queue,
+        lease_seconds,
+        **model_options,
+    )
+    if counts and counts["failed"]:
+        raise click.ClickException(f"{counts['failed']} file(s) failed to translate")
 
 
 @code_scribe.command(name="inspect")
@@ -102,7 +326,41 @@ def translate(fortran_files, seed_prompt, model, save_prompts):
     help="Save file specific prompts to json file",
     mutually_exclusive=["model"],
 )
-def inspect(fortran_files, query_prompt, model, save_prompts):
+@click.option(
+    "--cache-dir",
+    default=None,
+    help="Directory for cached model responses [default: ~/.cache/code-scribe]",
+)
+@click.option(
+    "--no-cache", is_flag=True, help="Do not read or write cached model responses"
+)
+@click.option("--stream", is_flag=True, help="Print the answer as it is generated")
+@click.option(
+    "--server",
+    help="Address of a model served with 'code-scribe serve', e.g. 127.0.0.1:8470",
+)
+@click.option(
+    "--profile",
+    help="Print time spent in each stage and write a Chrome trace to this JSON file",
+)
+@click.option(
+    "--requests-per-minute",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Maximum request rate of an API model, e.g. -m openai",
+)
+@lib.local_model_options
+def inspect(
+    fortran_files,
+    query_prompt,
+    model,
+    save_prompts,
+    cache_dir,
+    no_cache,
+    stream,
+    server,
+    profile,
+    **model_options,
+):
     """
     \b
     Perform a generative AI inspection on Fortran files
@@ -114,9 +372,170 @@ def inspect(fortran_files, query_prompt, model, save_prompts):
     on the the combination of files
     \b
     """
-    if (not model) and (not save_prompts):
+    if (not model) and (not server) and (not save_prompts):
         raise click.UsageError(
-            "Please provide either the '--model/-m' or '--save-prompts/-p' option"
+            "Please provide either the '--model/-m', '--server' or '--save-prompts/-p' option"
         )
 
-    api.inspect(fortran_files, query_prompt, model, save_prompts)
+    api.inspect(
+        fortran_files,
+        query_prompt,
+        model,
+        save_prompts,
+        cache_dir,
+        no_cache,
+        stream,
+        server,
+        profile,
+        **model_options,
+    )
+
+
+@code_scribe.command(name="serve")
+@click.option("--model", "-m", required=True, help="Gen AI model name or path")
+@click.option("--host", default="127.0.0.1", show_default=True, help="Host address")
+@click.option("--port", default=8470, show_default=True, help="Port number")
+@click.option(
+    "--batch-size",
+    "-b",
+    default=8,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of queued requests grouped into one generation call",
+)
+@lib.local_model_options
+def serve(model, host, port, batch_size, **model_options):
+    """
+    \b
+    Serve a generative AI model for translate and inspect
+    \b
+
+    \b
+    This command loads a model once and keeps it resident to
+    answer chat requests over HTTP. Use the '--server' option
+    of translate and inspect to send requests to it
+    \b
+    """
+    api.serve(model, host, port, batch_size, **model_options)
+
+
+@code_scribe.command(name="bench")
+@click.option("--files", default=100, show_default=True, help="Number of files")
+@click.option(
+    "--directories", default=10, show_default=True, help="Number of directories"
+)
+@click.option(
+    "--modules",
+    default=50,
+    show_default=True,
+    help="Number of files that wrap their subroutines in a module",
+)
+@click.option(
+    "--subroutines", default=10, show_default=True, help="Subroutines per file"
+)
+@click.option(
+    "--body-lines",
+    default=10,
+    show_default=True,
+    help="Executable lines per subroutine",
+)
+@click.option(
+    "--use-density",
+    default=0.5,
+    show_default=True,
+    help="Probability that a subroutine uses a module",
+)
+@click.option(
+    "--call-density",
+    default=1.0,
+    show_default=True,
+    help="Average number of calls per subroutine",
+)
+@click.option("--seed", default=0, show_default=True, help="Seed of the corpus")
+@click.option("--repeat", default=3, show_default=True, help="Timing repetitions")
+@click.option(
+    "--jobs",
+    "-j",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of parallel jobs for index, draft, and translate",
+)
+@click.option(
+    "--batch-size",
+    "-b",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of prompts per generation call of the fake model",
+)
+@click.option(
+    "--latency",
+    default=0.0,
+    show_default=True,
+    help="Seconds of latency per call of the fake model",
+)
+@click.option(
+    "--tokens-per-second",
+    type=float,
+    help="Generation speed of the fake model",
+)
+@click.option("--output", "-o", help="Write the results to a JSON file")
+@click.option(
+    "--root-dir",
+    help="Directory for the synthetic corpus, a temporary directory by default",
+)
+def bench(
+    files,
+    directories,
+    modules,
+    subroutines,
+    body_lines,
+    use_density,
+    call_density,
+    seed,
+    repeat,
+    jobs,
+    batch_size,
+    latency,
+    tokens_per_second,
+    output,
+    root_dir,
+):
+    """
+    \b
+    Benchmark code-scribe on a synthetic Fortran corpus
+    \b
+
+    \b
+    This command generates a synthetic source tree and times
+    index, draft, prompt assembly, and translate and inspect
+    against a deterministic fake model. Results are printed
+    as JSON to track performance across releases
+    \b
+    """
+    import json
+
+    corpus = {
+        "files": files,
+        "directories": directories,
+        "modules": modules,
+        "subroutines": subroutines,
+        "body_lines": body_lines,
+        "use_density": use_density,
+        "call_density": call_density,
+        "seed": seed,
+    }
+
+    report = api.bench(
+        corpus,
+        output,
+        root_dir,
+        repeat,
+        jobs,
+        batch_size,
+        latency,
+        tokens_per_second,
+    )
+
+    click.echo(json.dumps(report, indent=4))
@@ -1,5 +1,46 @@
 """library intialization"""
 
-from ._filetools import *
-from ._llm import *
-from ._click import *
+import importlib
+
+# Submodules are imported on first access of one of their names rather
+# than star-imported here, so that commands only pay for what they use.
+# Names resolve in this order, which matches the former star imports.
+_SUBMODULES = (
+    "_click",
+    "_scanner",
+    "_filetools",
+    "_concurrency",
+    "_cache",
+    "_database",
+    "_index",
+    "_llm",
+    "_prompts",
+    "_server",
+    "_scheduler",
+    "_journal",
+    "_bench",
+    "_profile",
+    "_batch",
+    "_distribute",
+    "_preprocess",
+)
+
+
+def __getattr__(name):
+    if not name.startswith("_"):
+        for submodule in _SUBMODULES:
+            module = importlib.import_module(f"{__name__}.{submodule}")
+            if hasattr(module, name):
+                value = getattr(module, name)
+                globals()[name] = value
+                return value
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    names = set(globals())
+    for submodule in _SUBMODULES:
+        module = importlib.import_module(f"{__name__}.{submodule}")
+        names.update(name for name in dir(module) if not name.startswith("_"))
+    return sorted(names)
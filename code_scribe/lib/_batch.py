@@ -0,0 +1,246 @@
+import os
+import json
+import time
+
+from code_scribe import lib
+
+BATCH_NAME = "scribe.batch.json"
+
+# Batch statuses after which no more results will arrive
+BATCH_FINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+
+def submit_translate_batch(
+    mapping,
+    seed_prompt,
+    model,
+    cache=None,
+    resume=False,
+    chunk=False,
+    batch_path=BATCH_NAME,
+):
+    """
+    Render the translate prompts of files that are not translated yet into
+    a Batch API input file and submit it. Prompts with a cached response are
+    left out of the batch. The batch id and the chunks of each file are saved
+    to batch_path, for collect_translate_batch to write the outputs.
+    """
+    if os.path.isfile(batch_path):
+        with open(batch_path, "r") as batch_file:
+            batch_id = json.load(batch_file)["batch"]
+        raise ValueError(
+            f"Batch {batch_id} in {batch_path} has not been collected, "
+            + "run translate with --batch-collect first"
+        )
+
+    import toml
+
+    with lib.span("load_model"):
+        neural_model = lib.load_model(model)
+
+    if not hasattr(neural_model, "submit_batch"):
+        raise ValueError(f"{model} does not support batch submission")
+
+    with lib.span("load_seed_prompt"):
+        chat_template = toml.load(seed_prompt)["chat"]
+
+    if hasattr(neural_model, "set_prompt_prefix"):
+        neural_model.set_prompt_prefix(chat_template)
+
+    # The journal is opened once the batch is submitted, so that a failed
+    # submission leaves the journal of the previous run as it was
+    records = (
+        lib.read_journal(lib.JOURNAL_NAME)
+        if resume and os.path.isfile(lib.JOURNAL_NAME)
+        else None
+    )
+    input_path = os.path.splitext(batch_path)[0] + ".jsonl"
+    files = []
+    requests = 0
+
+    with open(input_path, "w") as input_file:
+        for fsource, csource, finterface, cdraft, _ in zip(*mapping):
+            if lib.is_translated(fsource, csource, records):
+                continue
+
+            file_templates = lib.build_file_prompts(
+                chat_template, fsource, cdraft, chunk=chunk
+            )
+            keys = [
+                cache.key(neural_model, template) if cache else None
+                for template in file_templates
+            ]
+
+            custom_ids = []
+            for key, template in zip(keys, file_templates):
+                if cache and cache.get(key) is not None:
+                    custom_ids.append(None)
+                    continue
+
+                custom_ids.append(f"request-{requests}")
+                input_file.write(
+                    json.dumps(neural_model.batch_request(custom_ids[-1], template))
+                    + "\n"
+                )
+                requests += 1
+
+            files.append(
+                {
+                    "file": fsource,
+                    "csource": csource,
+                    "finterface": finterface,
+                    "requests": custom_ids,
+                    "keys": keys,
+                    "prompt_tokens": sum(
+                        lib.count_tokens(
+                            neural_model,
+                            "".join(message["content"] for message in template),
+                        )
+                        for template in file_templates
+                    ),
+                }
+            )
+
+    if not files:
+        os.remove(input_path)
+        print("All files are translated, nothing to submit")
+        return
+
+    batch_id = None
+    if requests:
+        with lib.span("submit_batch", requests=requests):
+            batch_id = neural_model.submit_batch(input_path)
+
+    with lib.JobJournal(resume=resume) as journal:
+        for record in files:
+            journal.record(record["file"], "in-flight", batch=batch_id)
+
+    with open(batch_path, "w") as batch_file:
+        json.dump(
+            {
+                "batch": batch_id,
+                "model": model if isinstance(model, str) else neural_model.model_id,
+                "submitted": time.time(),
+                "files": files,
+            },
+            batch_file,
+            indent=2,
+        )
+
+    if batch_id:
+        print(
+            f"Submitted batch {batch_id} with {requests} request(s) for "
+            + f"{len(files)} file(s), saved to {batch_path}"
+        )
+    else:
+        print(f"Responses of {len(files)} file(s) are cached, saved to {batch_path}")
+    print("Run translate with --batch-collect to write the outputs")
+
+
+def collect_translate_batch(
+    model=None, cache=None, poll_interval=30.0, batch_path=BATCH_NAME
+):
+    """
+    Wait for the batch saved in batch_path to finish, polling every
+    poll_interval seconds, and write the outputs of its files. Files with a
+    failed request are recorded as failed in the journal and are submitted
+    again by a resumed run. Returns the number of files in each state of
+    the journal.
+    """
+    if not os.path.isfile(batch_path):
+        raise FileNotFoundError(
+            f"{batch_path} not found, run translate with --batch-submit first"
+        )
+
+    with open(batch_path, "r") as batch_file:
+        state = json.load(batch_file)
+
+    with lib.span("load_model"):
+        neural_model = lib.load_model(model or state["model"])
+
+    responses = {}
+    errors = {}
+    status = "not submitted"
+
+    if state["batch"]:
+        with lib.span("wait_batch"):
+            while True:
+                batch = neural_model.retrieve_batch(state["batch"])
+                counts = batch.request_counts
+                print(
+                    f"Batch {batch.id}: {batch.status}"
+                    + (
+                        f", {counts.completed} completed, {counts.failed} failed "
+                        + f"of {counts.total} request(s)"
+                        if counts
+                        else ""
+                    )
+                )
+
+                status = batch.status
+                if status in BATCH_FINAL_STATES:
+                    break
+                time.sleep(poll_interval)
+
+        with lib.span("download_batch"):
+            for custom_id, response, error in neural_model.batch_results(batch):
+                if response is None:
+                    errors[custom_id] = error
+                else:
+                    responses[custom_id] = response
+
+    journal = lib.JobJournal(resume=True)
+    elapsed = time.time() - state["submitted"]
+
+    for record in state["files"]:
+        results = []
+        for custom_id, key in zip(record["requests"], record["keys"]):
+            if custom_id is None:
+                results.append(cache.get(key) if cache else None)
+            else:
+                results.append(responses.get(custom_id))
+                if cache and key and results[-1] is not None:
+                    cache.put(key, results[-1])
+
+        if any(result is None for result in results):
+            error = next(
+                (
+                    errors[custom_id]
+                    for custom_id in record["requests"]
+                    if custom_id in errors
+                ),
+                f"no response in batch with status {status}",
+            )
+            journal.record(
+                record["file"], "failed", latency=elapsed, error=f"Batch: {error}"
+            )
+            continue
+
+        result = lib.stitch_translations(results) if len(results) > 1 else results[0]
+        lib.write_translation(result, record["csource"], record["finterface"])
+
+        journal.record(
+            record["file"],
+            "done",
+            latency=elapsed,
+            prompt_tokens=record["prompt_tokens"],
+            generated_tokens=sum(
+                lib.count_tokens(neural_model, text) for text in results
+            ),
+            cached=not any(record["requests"]),
+        )
+
+    journal.close()
+    os.remove(batch_path)
+
+    if hasattr(neural_model, "prefix_stats"):
+        neural_model.prefix_stats.report()
+
+    counts = journal.summary()
+    print(
+        f"Journal {journal.journal_path}: {counts['done']} done, "
+        + f"{counts['failed']} failed"
+    )
+    if counts["failed"]:
+        print("Run translate with --batch-submit --resume to resubmit failed files")
+    return counts
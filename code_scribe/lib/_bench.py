@@ -0,0 +1,324 @@
+import os
+import time
+import random
+import hashlib
+import platform
+import threading
+import contextlib
+
+from code_scribe import lib
+
+
+class FakeModel:
+    """
+    Deterministic model backend for benchmarks. Responses are derived from
+    a hash of the prompt, and every call sleeps for latency seconds plus
+    the time to generate output_tokens at tokens_per_second.
+    """
+
+    def __init__(
+        self,
+        latency=0.0,
+        tokens_per_second=None,
+        output_tokens=64,
+        context_length=8192,
+    ):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.context_length = context_length
+        self.max_tokens = output_tokens
+        self.calls = 0
+
+        self._lock = threading.Lock()
+
+    def _generation_time(self, count):
+        if not self.tokens_per_second:
+            return 0.0
+        return count * self.output_tokens / self.tokens_per_second
+
+    def _response(self, chat_template):
+        digest = hashlib.sha256(
+            "".join(message["content"] for message in chat_template).encode("utf-8")
+        ).hexdigest()
+
+        words = " ".join(digest[i % 64 : i % 64 + 8] for i in range(self.output_tokens))
+        return (
+            f"<csource>\n// {words}\n</csource>\n"
+            + f"<fsource>\n! interface {digest[:16]}\n</fsource>"
+        )
+
+    def chat(self, chat_template):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency + self._generation_time(1))
+        return self._response(chat_template)
+
+    def chat_batch(self, chat_templates):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency + self._generation_time(len(chat_templates)))
+        return [self._response(template) for template in chat_templates]
+
+    def stream(self, chat_template):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+
+        words = self._response(chat_template).split(" ")
+        for iword, word in enumerate(words):
+            time.sleep(self._generation_time(1) / len(words))
+            yield word if iword == len(words) - 1 else word + " "
+
+    def count_tokens(self, text):
+        return len(text.split())
+
+    def signature(self):
+        return {
+            "backend": "FakeModel",
+            "output_tokens": self.output_tokens,
+        }
+
+
+def generate_corpus(
+    root_directory,
+    files=100,
+    directories=10,
+    modules=50,
+    subroutines=10,
+    body_lines=10,
+    use_density=0.5,
+    call_density=1.0,
+    seed=0,
+):
+    """
+    Write a synthetic Fortran source tree for benchmarks.
+
+    Args:
+        files: Number of source files.
+        directories: Number of directories to spread files over, the root
+                     and directories - 1 subdirectories.
+        modules: Number of files that wrap their subroutines in a module.
+        subroutines: Subroutines per file.
+        body_lines: Executable lines per subroutine.
+        use_density: Probability that a subroutine uses an earlier module.
+        call_density: Average number of calls per subroutine.
+        seed: Seed of the random generator, the same seed gives the same tree.
+
+    Returns:
+        list: Paths of the generated files.
+    """
+    rng = random.Random(seed)
+    filelist = []
+    module_names = []
+    subroutine_names = []
+
+    for ifile in range(files):
+        # The root holds the first share of files, since create_file_indexes
+        # reads the root entry from its scribe.yaml
+        idirectory = ifile % max(directories, 1)
+        directory = (
+            os.path.join(root_directory, f"dir_{idirectory}")
+            if idirectory
+            else root_directory
+        )
+        os.makedirs(directory, exist_ok=True)
+
+        is_module = ifile < modules
+        indent = "  " if is_module else ""
+        lines = [f"! Synthetic source file {ifile}"]
+
+        if is_module:
+            lines += [f"module mod_{ifile}", "  implicit none", "contains"]
+
+        for isub in range(subroutines):
+            name = f"sub_{ifile}_{isub}"
+            lines += [f"{indent}subroutine {name}(x, y, n)"]
+
+            if module_names and rng.random() < use_density:
+                lines += [f"{indent}  use {rng.choice(module_names)}"]
+
+            lines += [
+                f"{indent}  integer :: n, i",
+                f"{indent}  real(kind=dp) :: x(n), y(n)",
+                f"{indent}  ! loop over the elements",
+                f"{indent}  do i = 1, n",
+            ]
+            lines += [
+                f"{indent}    y(i) = x(i)**{iline % 3 + 2} + {iline}.0 * y(i)"
+                for iline in range(body_lines)
+            ]
+            lines += [f"{indent}  end do"]
+
+            calls = int(call_density) + (rng.random() < call_density % 1)
+            for _ in range(calls if subroutine_names else 0):
+                lines += [f"{indent}  call {rng.choice(subroutine_names)}(x, y, n)"]
+
+            lines += [f"{indent}end subroutine {name}"]
+            subroutine_names.append(name)
+
+        if is_module:
+            lines += [f"end module mod_{ifile}"]
+            module_names.append(f"mod_{ifile}")
+
+        filename = os.path.join(directory, f"file_{ifile}.F90")
+        with open(filename, "w") as source:
+            source.write("\n".join(lines) + "\n")
+        filelist.append(filename)
+
+    return filelist
+
+
+def _best_time(func, repeat, setup=None):
+    """Best wall time of func over repeat runs, calling setup before each."""
+    timings = []
+    for _ in range(max(repeat, 1)):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_benchmarks(
+    root_directory,
+    corpus={},
+    repeat=3,
+    jobs=1,
+    batch_size=1,
+    latency=0.0,
+    tokens_per_second=None,
+):
+    """
+    Generate a synthetic corpus in root_directory and time each stage of the
+    pipeline on it, with translate and inspect run against a FakeModel.
+
+    Args:
+        corpus: Keyword arguments for generate_corpus.
+
+    Returns:
+        dict: Environment, corpus shape, and results with the best wall time
+              of each stage in seconds, suitable for JSON output.
+    """
+    from code_scribe.__meta__ import __version__
+
+    root_directory = os.path.abspath(root_directory)
+    seed_prompt = [{"role": "user", "content": "Translate the following code"}]
+    results = {}
+
+    start = time.perf_counter()
+    filelist = generate_corpus(root_directory, **corpus)
+    results["generate_corpus"] = time.perf_counter() - start
+
+    lines = 0
+    for sfile in filelist:
+        with open(sfile, "r") as source:
+            lines += sum(1 for _ in source)
+
+    def _clean(*extensions):
+        def _setup():
+            for sfile in filelist:
+                for extension in extensions:
+                    output = os.path.splitext(sfile)[0] + extension
+                    if os.path.isfile(output):
+                        os.remove(output)
+
+        return _setup
+
+    cwd = os.getcwd()
+    os.chdir(root_directory)
+
+    try:
+        # Progress output of the commands is discarded while timing
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+
+            results["index"] = _best_time(
+                lambda: lib.create_scribe_yaml(root_directory, jobs=jobs), repeat
+            )
+
+            file_index = lib.create_file_indexes()
+            results["create_file_indexes"] = _best_time(lib.create_file_indexes, repeat)
+
+            results["filter_file_indexes"] = _best_time(
+                lambda: [
+                    lib.filter_file_indexes(sfile, file_index) for sfile in filelist
+                ],
+                repeat,
+            )
+
+            results["draft"] = _best_time(
+                lambda: lib.parallel_map(
+                    lib.annotate_fortran_file, filelist, jobs=jobs
+                ),
+                repeat,
+                setup=_clean(".scribe"),
+            )
+
+            results["translate_prompts"] = _best_time(
+                lambda: [
+                    lib.build_translate_prompt(
+                        seed_prompt, sfile, os.path.splitext(sfile)[0] + ".scribe"
+                    )
+                    for sfile in filelist
+                ],
+                repeat,
+            )
+
+            fake_model = FakeModel(latency, tokens_per_second)
+
+            results["inspect_prompts"] = _best_time(
+                lambda: lib.build_inspect_prompts(
+                    filelist, "What does this code do?", file_index, fake_model
+                ),
+                repeat,
+            )
+
+            import toml
+
+            seed_path = os.path.join(root_directory, "seed_prompt.toml")
+            with open(seed_path, "w") as seed_file:
+                toml.dump({"chat": seed_prompt}, seed_file)
+
+            results["translate"] = _best_time(
+                lambda: lib.prompt_translate(
+                    lib.create_src_mapping(filelist),
+                    seed_path,
+                    model=fake_model,
+                    jobs=jobs,
+                    batch_size=batch_size,
+                ),
+                repeat,
+                setup=_clean(".cpp", "_fi.f90"),
+            )
+
+            results["inspect"] = _best_time(
+                lambda: lib.prompt_inspect(
+                    filelist, "What does this code do?", file_index, model=fake_model
+                ),
+                repeat,
+            )
+
+    finally:
+        os.chdir(cwd)
+
+    return {
+        "code_scribe": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "corpus": dict(corpus, lines=lines),
+        "settings": {
+            "repeat": repeat,
+            "jobs": jobs,
+            "batch_size": batch_size,
+            "latency": latency,
+            "tokens_per_second": tokens_per_second,
+        },
+        "seconds": results,
+        "files_per_second": {
+            stage: len(filelist) / max(seconds, 1e-9)
+            for stage, seconds in results.items()
+            if stage not in ("generate_corpus", "create_file_indexes")
+        },
+    }
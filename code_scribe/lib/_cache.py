@@ -0,0 +1,137 @@
+import os
+import json
+import hashlib
+import threading
+
+
+def default_cache_dir():
+    """Default location of the response cache."""
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_home, "code-scribe")
+
+
+def model_signature(neural_model):
+    """
+    Return a dictionary identifying the backend, model, and sampling
+    parameters of a neural model for use in cache keys.
+    """
+    if hasattr(neural_model, "signature"):
+        return neural_model.signature()
+
+    return {"backend": type(neural_model).__name__}
+
+
+class ResponseCache:
+    """
+    On-disk cache of model responses keyed by a hash of the model
+    signature and the fully rendered chat template. Entries are evicted
+    in least recently used order once the cache exceeds max_bytes, down to
+    low_water times max_bytes, so that the cache is scanned only once in
+    a while rather than on every put of a full cache.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=1024**3, low_water=0.9):
+        self.cache_dir = os.path.abspath(cache_dir or default_cache_dir())
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._size = sum(os.path.getsize(path) for path in self._entries())
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.endswith(".txt"):
+                    yield os.path.join(dirpath, filename)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".txt")
+
+    def key(self, neural_model, chat_template):
+        """Hash of the model signature and chat template."""
+        payload = json.dumps(
+            [model_signature(neural_model), chat_template], sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the cached response for key, or None on a miss."""
+        path = self._path(key)
+
+        try:
+            with open(path, "r") as entry:
+                response = entry.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        # Refresh modification time to mark the entry as recently used
+        os.utime(path)
+        self.hits += 1
+        return response
+
+    def put(self, key, response):
+        """Store a response and evict old entries if the cache is full."""
+        import tempfile
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as entry:
+            entry.write(response)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._size += os.path.getsize(path)
+            if self._size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """Remove least recently used entries down to the low water mark."""
+        entries = sorted(self._entries(), key=os.path.getmtime)
+        self._size = sum(os.path.getsize(path) for path in entries)
+
+        for path in entries:
+            if self._size <= self.max_bytes * self.low_water:
+                break
+            self._size -= os.path.getsize(path)
+            os.remove(path)
+
+
+class PrefixCacheStats:
+    """
+    Count prompt tokens served from a prefix cache, the KV cache of the seed
+    prompt of a local model or prompt caching of an API, for a run report.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.hits = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+        self._lock = threading.Lock()
+
+    def record(self, prompt_tokens, cached_tokens=0):
+        """Record a request with prompt_tokens, of which cached_tokens hit the cache."""
+        with self._lock:
+            self.requests += 1
+            self.hits += cached_tokens > 0
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+
+    def report(self):
+        """Print the hit rate and the number of prompt tokens that were reused."""
+        if not self.requests:
+            return
+
+        print(
+            f"Prefix cache: {self.hits} of {self.requests} requests hit "
+            + f"({self.hits / self.requests:.0%}), {self.cached_tokens} of "
+            + f"{self.prompt_tokens} prompt tokens reused"
+        )
@@ -1,4 +1,4 @@
-from click import command, option, Option, UsageError
+from click import command, option, Option, UsageError, Choice, IntRange
 
 
 class MutuallyExclusiveOption(Option):
@@ -21,3 +21,45 @@ class MutuallyExclusiveOption(Option):
             )
 
         return super(MutuallyExclusiveOption, self).handle_parse_result(ctx, opts, args)
+
+
+def local_model_options(func):
+    """Add the options of local models loaded from a checkpoint to a command."""
+    options = [
+        option(
+            "--dtype",
+            type=Choice(["float32", "bfloat16", "float16"]),
+            help="Data type of the weights of a local model [default: float32]",
+        ),
+        option(
+            "--quantize",
+            is_flag=True,
+            help="Quantize linear layers of a local model to int8 for CPU inference",
+        ),
+        option(
+            "--threads",
+            type=IntRange(min=1),
+            help="Number of torch threads within an operation of a local model",
+        ),
+        option(
+            "--interop-threads",
+            type=IntRange(min=1),
+            help="Number of torch threads across operations of a local model",
+        ),
+        option(
+            "--max-new-tokens",
+            type=IntRange(min=1),
+            help="Maximum number of tokens generated per response by a local model [default: 4096]",
+        ),
+        option(
+            "--prompt-lookup",
+            default=0,
+            show_default=True,
+            type=IntRange(min=0),
+            help="Tokens proposed from the draft per step of a local model, 0 to disable",
+        ),
+    ]
+
+    for decorator in reversed(options):
+        func = decorator(func)
+    return func
@@ -0,0 +1,265 @@
+import re
+import time
+import random
+import functools
+import threading
+import collections
+
+from code_scribe import lib
+
+
+class RateLimiter:
+    """
+    Bound the number of in-flight requests and the request rate
+    for a model backend. Used as a context manager around each call.
+    """
+
+    def __init__(self, max_concurrency=None, requests_per_minute=None):
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+
+        self._semaphore = (
+            threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        )
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        """Block until the next request is allowed by the rate limit."""
+        if not self.requests_per_minute:
+            return
+
+        interval = 60.0 / self.requests_per_minute
+
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + interval
+
+        if slot > now:
+            time.sleep(slot - now)
+
+    def __enter__(self):
+        if self._semaphore:
+            self._semaphore.acquire()
+        self.wait()
+        return self
+
+    def __exit__(self, *exc):
+        if self._semaphore:
+            self._semaphore.release()
+        return False
+
+
+RESET_UNITS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+
+def parse_reset(value):
+    """
+    Seconds in a rate limit header, either a number like "1.5" or
+    a duration like "6m0s" or "20ms". Returns None if value is not set.
+    """
+    if value is None:
+        return None
+
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if not parts:
+        return None
+
+    return sum(float(number) * RESET_UNITS[unit] for number, unit in parts)
+
+
+class AdaptiveLimiter:
+    """
+    Adapt the number of in-flight requests of an asyncio backend to the
+    rate limits of the server. Concurrency grows by one request after a
+    window of successful responses and is halved on a rate limit error,
+    which then pauses all new requests for the retry-after period.
+
+    Requests are sent right away while the x-ratelimit-remaining-tokens
+    header of the last response leaves room for their estimated tokens,
+    and are then paced to stay under tokens_per_minute. When it is not set,
+    the limit is taken from the x-ratelimit-limit-tokens header.
+    Must be used from a single event loop.
+    """
+
+    def __init__(
+        self, max_concurrency=64, initial_concurrency=4, tokens_per_minute=None
+    ):
+        self.max_concurrency = max_concurrency
+        self.concurrency = max(1, min(initial_concurrency, max_concurrency))
+        self.tokens_per_minute = tokens_per_minute
+        self.in_flight = 0
+        self.rate_limited = 0
+
+        self._successes = 0
+        self._resume_at = 0.0
+        self._next_slot = 0.0
+        self._remaining = None
+        self._waiters = collections.deque()
+
+    async def acquire(self, tokens=0):
+        """Wait for a free slot and for the token budget of a request."""
+        import asyncio
+
+        if self.in_flight < self.concurrency and not self._waiters:
+            self.in_flight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self.release()
+                raise
+
+        now = time.monotonic()
+        start = max(now, self._resume_at)
+
+        if self._remaining is not None and self._remaining >= tokens:
+            self._remaining -= tokens
+        elif self.tokens_per_minute:
+            start = max(start, self._next_slot)
+            self._next_slot = start + 60.0 * tokens / self.tokens_per_minute
+
+        if start > now:
+            try:
+                await asyncio.sleep(start - now)
+            except asyncio.CancelledError:
+                self.release()
+                raise
+
+    def release(self):
+        """Free the slot of a finished request."""
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self.concurrency:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def on_success(self, headers, tokens=0):
+        """Grow concurrency and honor the remaining budget in response headers."""
+        self._successes += 1
+        if self._successes >= self.concurrency:
+            self._successes = 0
+            self.concurrency = min(self.concurrency + 1, self.max_concurrency)
+            self._wake()
+
+        if not self.tokens_per_minute and headers.get("x-ratelimit-limit-tokens"):
+            self.tokens_per_minute = float(headers["x-ratelimit-limit-tokens"])
+        if headers.get("x-ratelimit-remaining-tokens") is not None:
+            self._remaining = float(headers["x-ratelimit-remaining-tokens"])
+            self._next_slot = time.monotonic()
+
+        now = time.monotonic()
+        for remaining, reset, needed in (
+            ("x-ratelimit-remaining-requests", "x-ratelimit-reset-requests", 1),
+            ("x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens", tokens),
+        ):
+            if headers.get(remaining) is None:
+                continue
+            if float(headers[remaining]) < needed:
+                delay = parse_reset(headers.get(reset)) or 1.0
+                self._resume_at = max(self._resume_at, now + delay)
+
+    def on_rate_limit(self, headers):
+        """Halve concurrency and pause new requests after a rate limit error."""
+        self.rate_limited += 1
+        self._successes = 0
+        self.concurrency = max(1, self.concurrency // 2)
+        self._remaining = None
+
+        delay = (
+            parse_reset(headers.get("retry-after-ms")) / 1000.0
+            if headers.get("retry-after-ms")
+            else parse_reset(headers.get("retry-after"))
+        )
+        if delay is None:
+            delay = parse_reset(headers.get("x-ratelimit-reset-tokens")) or 1.0
+
+        # Jitter keeps paused requests from resuming all at once
+        self._resume_at = max(
+            self._resume_at, time.monotonic() + delay * random.uniform(1.0, 1.2)
+        )
+        return delay
+
+
+def retry_call(
+    func,
+    *args,
+    retries=3,
+    backoff=1.0,
+    max_backoff=60.0,
+    retry_on=(Exception,),
+    **kwargs,
+):
+    """
+    Call func(*args, **kwargs) and retry on exceptions of the retry_on
+    types with exponential backoff and jitter. Other exceptions are raised
+    right away, and the last exception once all retries are exhausted.
+    """
+    attempt = 0
+
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except retry_on:
+            if attempt >= retries:
+                raise
+
+            delay = min(max_backoff, backoff * (2**attempt))
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            attempt += 1
+
+
+def parallel_map(func, *iterables, jobs=1):
+    """
+    Apply func to items of iterables over a pool of jobs processes and
+    return the results as a list in input order. Runs serially for jobs <= 1.
+    """
+    if jobs <= 1:
+        return list(map(func, *iterables))
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    items = [list(iterable) for iterable in iterables]
+    chunksize = max(1, len(items[0]) // (jobs * 4)) if items else 1
+    profiler = lib.get_profiler()
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        if not hasattr(profiler, "merge"):
+            return list(executor.map(func, *items, chunksize=chunksize))
+
+        # Spans of the workers are recorded by profilers of their own and
+        # merged into the active profiler along with the results
+        results = []
+        for result, events, usage in executor.map(
+            functools.partial(_profiled_call, func, profiler.origin),
+            *items,
+            chunksize=chunksize,
+        ):
+            profiler.merge(events, usage)
+            results.append(result)
+        return results
+
+
+def _profiled_call(func, origin, *args):
+    """Call func in a worker with a profiler, and return its spans with the result."""
+    previous = lib.get_profiler()
+    profiler = lib.Profiler(origin)
+    lib.set_profiler(profiler)
+
+    try:
+        return func(*args), profiler.events, profiler.usage
+    finally:
+        lib.set_profiler(previous)
@@ -0,0 +1,182 @@
+import os
+import json
+
+DATABASE_NAME = "scribe.db"
+
+CONSTRUCT_TYPES = {
+    "modules": "module",
+    "subroutines": "subroutine",
+    "functions": "function",
+}
+
+
+def create_scribe_db(root_directory, manifest, preprocess=None):
+    """
+    Create a consolidated scribe.db at the root directory from an index
+    manifest. The database is written to a temporary file and moved into
+    place so that readers never see a partially written index. Preprocess
+    options the index was created with are kept in the meta table.
+    """
+    import sqlite3
+
+    db_path = os.path.join(root_directory, DATABASE_NAME)
+    tmp_path = db_path + ".tmp"
+
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    connection = sqlite3.connect(tmp_path)
+
+    with connection:
+        connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        connection.execute(
+            "CREATE TABLE constructs (name TEXT, type TEXT, file TEXT, directory TEXT)"
+        )
+        connection.execute(
+            "INSERT INTO meta VALUES ('root', ?)", (os.path.abspath(root_directory),)
+        )
+
+        if preprocess is not None:
+            connection.execute(
+                "INSERT INTO meta VALUES ('preprocess', ?)", (json.dumps(preprocess),)
+            )
+
+        connection.executemany(
+            "INSERT INTO constructs VALUES (?, ?, ?, ?)",
+            (
+                (name, construct_type, relpath, os.path.dirname(relpath))
+                for relpath, entry in manifest.items()
+                for key, construct_type in CONSTRUCT_TYPES.items()
+                for name in entry["info"].get(key, [])
+            ),
+        )
+
+        connection.execute("CREATE INDEX construct_name ON constructs (name)")
+        connection.execute("CREATE INDEX construct_file ON constructs (file)")
+        connection.execute("CREATE INDEX construct_type ON constructs (type)")
+
+    connection.close()
+    os.replace(tmp_path, db_path)
+
+
+def find_scribe_db(directory=None):
+    """
+    Search for scribe.db in the given directory, or the current
+    working directory, and its parents. Returns None if not found.
+    """
+    directory = os.path.abspath(directory or os.getcwd())
+
+    while True:
+        db_path = os.path.join(directory, DATABASE_NAME)
+        if os.path.isfile(db_path):
+            return db_path
+
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+class ScribeDB:
+    """
+    Read-only view of a consolidated scribe.db index. Lookups are served
+    by SQLite indexes without loading the whole tree into memory.
+    """
+
+    def __init__(self, db_path):
+        import sqlite3
+
+        self.db_path = os.path.abspath(db_path)
+        self.connection = sqlite3.connect(
+            f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False
+        )
+        (self.root,) = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'root'"
+        ).fetchone()
+
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'preprocess'"
+        ).fetchone()
+        self.preprocess = json.loads(row[0]) if row else None
+
+    def _path(self, relpath):
+        return os.path.join(self.root, relpath)
+
+    def definitions(self, name, construct_type=None):
+        """Return (type, file path) pairs that define a construct name."""
+        query = "SELECT type, file FROM constructs WHERE name = ?"
+        params = [name.lower()]
+
+        if construct_type:
+            query += " AND type = ?"
+            params.append(construct_type)
+
+        rows = self.connection.execute(query + " ORDER BY rowid", params)
+        return [(ctype, self._path(relpath)) for ctype, relpath in rows]
+
+    def query(self, name):
+        """Return file paths that define a construct name."""
+        rows = self.connection.execute(
+            "SELECT file FROM constructs WHERE name = ? ORDER BY rowid",
+            (name.lower(),),
+        )
+        return [self._path(relpath) for (relpath,) in rows]
+
+    def lookup(self, names):
+        """Return a dictionary of construct name to file paths for a set of names."""
+        names = list({name.lower() for name in names})
+        matches = {}
+
+        # Stay below the SQLite limit on host parameters per statement
+        for start in range(0, len(names), 500):
+            chunk = names[start : start + 500]
+            rows = self.connection.execute(
+                "SELECT name, file FROM constructs WHERE name IN "
+                + f"({', '.join('?' * len(chunk))}) ORDER BY rowid",
+                chunk,
+            )
+            for name, relpath in rows:
+                matches.setdefault(name, []).append(self._path(relpath))
+
+        return matches
+
+    def constructs(self, file=None, construct_type=None):
+        """Return (name, type, file path) rows filtered by file and/or type."""
+        query = "SELECT name, type, file FROM constructs"
+        conditions = []
+        params = []
+
+        if file:
+            conditions.append("file = ?")
+            params.append(os.path.relpath(os.path.abspath(file), self.root))
+
+        if construct_type:
+            conditions.append("type = ?")
+            params.append(construct_type)
+
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        rows = self.connection.execute(query + " ORDER BY rowid", params)
+        return [(name, ctype, self._path(relpath)) for name, ctype, relpath in rows]
+
+    def items(self):
+        """Iterate over (construct name, file path) pairs."""
+        rows = self.connection.execute(
+            "SELECT name, file FROM constructs ORDER BY rowid"
+        )
+        for name, relpath in rows:
+            yield name, self._path(relpath)
+
+    def covers(self, files):
+        """Check that files are within the root directory of the index."""
+        root = os.path.abspath(self.root)
+        return all(
+            os.path.commonpath([root, os.path.abspath(file)]) == root for file in files
+        )
+
+    def __bool__(self):
+        return True
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,392 @@
+import os
+import json
+import time
+import socket
+import hashlib
+import threading
+
+from code_scribe import lib
+
+
+def parse_shard(shard):
+    """Parse a shard of the form i/N into a zero based index and a count."""
+    try:
+        index, count = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {shard}, expected i/N such as 0/4")
+
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard {shard}, expected 0 <= i < N")
+
+    return index, count
+
+
+def shard_name(shard):
+    """Node name of a shard, used to name its journal."""
+    index, count = parse_shard(shard)
+    return f"shard-{index}-of-{count}"
+
+
+def shard_mapping(mapping, shard):
+    """
+    Subset of a source mapping that belongs to a shard i/N, which is every
+    N-th file starting from the i-th. Every node must be given the same
+    file list in the same order.
+    """
+    index, count = parse_shard(shard)
+    return tuple(list(column[index::count]) for column in mapping)
+
+
+class WorkQueue:
+    """
+    Queue of files to translate on a filesystem shared by several nodes.
+
+    A node claims a file by creating its lease file in queue_dir/leases with
+    O_EXCL, so that exactly one node gets it, and renews the lease while it
+    works by touching it from a heartbeat thread. Finished files get a
+    marker in queue_dir/done and failed attempts one in queue_dir/failed.
+
+    A lease that is not renewed for lease_seconds belongs to a node that
+    died and is claimed by the next node that asks for work. A node with
+    nothing left to claim also takes over leases claimed more than
+    lease_seconds ago, so that files held by a straggler are translated
+    again by an idle node, and whichever finishes first is kept.
+    """
+
+    def __init__(self, queue_dir, node, lease_seconds=600.0, max_attempts=3):
+        self.queue_dir = queue_dir
+        self.node = node
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.leases = {}
+
+        for subdir in ("leases", "done", "failed", "nodes"):
+            os.makedirs(os.path.join(queue_dir, subdir), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._renew, daemon=True)
+        self._heartbeat.start()
+
+    def _key(self, fsource):
+        return hashlib.sha1(os.path.normpath(fsource).encode("utf-8")).hexdigest()
+
+    def _path(self, subdir, fsource, suffix=""):
+        return os.path.join(
+            self.queue_dir, subdir, self._key(fsource) + suffix + ".json"
+        )
+
+    def _keys(self, subdir):
+        # Temporary and tombstone files do not end in .json
+        return [
+            name.split(".")[0]
+            for name in os.listdir(os.path.join(self.queue_dir, subdir))
+            if name.endswith(".json")
+        ]
+
+    def _scan(self):
+        """Keys of done and leased files, and failed attempts per key."""
+        failures = {}
+        for key in self._keys("failed"):
+            failures[key] = failures.get(key, 0) + 1
+
+        return set(self._keys("done")), set(self._keys("leases")), failures
+
+    def _stale(self, fsource, steal):
+        """Stat of the lease of a file if it can be taken over, else None."""
+        path = self._path("leases", fsource)
+        try:
+            stat = os.stat(path)
+            with open(path, "r") as lease_file:
+                lease = json.load(lease_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            # Released in the meantime, or still being written
+            return None
+
+        now = time.time()
+        if now - stat.st_mtime > self.lease_seconds:
+            return stat
+
+        if (
+            steal
+            and lease["node"] != self.node
+            and now - lease["claimed"] > self.lease_seconds
+        ):
+            return stat
+
+        return None
+
+    def _acquire(self, fsource, stale=None):
+        """Create the lease of a file, taking over a stale lease if given."""
+        path = self._path("leases", fsource)
+
+        if stale is not None:
+            # Only one node can move the stale lease out of the way, and it
+            # puts the lease back if it was renewed after the stat
+            tombstone = f"{path}.{self.node}"
+            try:
+                os.rename(path, tombstone)
+            except FileNotFoundError:
+                return False
+
+            current = os.stat(tombstone)
+            if (current.st_ino, current.st_mtime) != (stale.st_ino, stale.st_mtime):
+                try:
+                    os.link(tombstone, path)
+                except FileExistsError:
+                    pass
+                os.remove(tombstone)
+                return False
+
+            os.remove(tombstone)
+
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+
+        with os.fdopen(fd, "w") as lease_file:
+            json.dump(
+                {"file": fsource, "node": self.node, "claimed": time.time()},
+                lease_file,
+            )
+
+        with self._lock:
+            self.leases[fsource] = path
+        return True
+
+    def claim(self, files, count, steal=False):
+        """
+        Claim up to count files, in order, that are not done, not leased by
+        a live node, and have failed fewer than max_attempts times. With
+        steal=True leases held by stragglers are taken over as well.
+        """
+        done, leased, failures = self._scan()
+        claimed = []
+
+        for fsource in files:
+            if len(claimed) >= count:
+                break
+
+            key = self._key(fsource)
+            if (
+                key in done
+                or failures.get(key, 0) >= self.max_attempts
+                or fsource in self.leases
+            ):
+                continue
+
+            stale = None
+            if key in leased:
+                stale = self._stale(fsource, steal)
+                if stale is None:
+                    continue
+
+            if self._acquire(fsource, stale):
+                claimed.append(fsource)
+
+        return claimed
+
+    def pending(self, files):
+        """Files that are neither done nor out of attempts."""
+        done, _, failures = self._scan()
+        return [
+            fsource
+            for fsource in files
+            if self._key(fsource) not in done
+            and failures.get(self._key(fsource), 0) < self.max_attempts
+        ]
+
+    def complete(self, fsource, record=None):
+        """Mark a file done and release its lease. The first node to finish wins."""
+        path = self._path("done", fsource)
+        tmp_path = f"{path}.{self.node}.tmp"
+
+        with open(tmp_path, "w") as done_file:
+            json.dump({"file": fsource, "node": self.node, **(record or {})}, done_file)
+
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+
+        self.release(fsource)
+
+    def fail(self, fsource, error=None):
+        """Record a failed attempt of a file and release its lease."""
+        path = self._path("failed", fsource, f".{self.node}.{time.time_ns()}")
+        with open(path, "w") as failed_file:
+            json.dump({"file": fsource, "node": self.node, "error": error}, failed_file)
+
+        self.release(fsource)
+
+    def release(self, fsource):
+        """Remove the lease of a file if it is still held by this node."""
+        with self._lock:
+            path = self.leases.pop(fsource, None)
+
+        if path is None:
+            return
+
+        try:
+            with open(path, "r") as lease_file:
+                if json.load(lease_file)["node"] == self.node:
+                    os.remove(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    def join(self, journal_path):
+        """
+        Register the journal of this node, to be merged into the report of
+        the queue. Returns True if the node had joined the queue before.
+        """
+        path = os.path.join(self.queue_dir, "nodes", self.node + ".json")
+        joined = os.path.isfile(path)
+
+        lib.atomic_write(
+            path,
+            json.dumps({"node": self.node, "journal": os.path.abspath(journal_path)}),
+        )
+        return joined
+
+    def journals(self):
+        """Journals of the nodes that joined the queue."""
+        nodes_dir = os.path.join(self.queue_dir, "nodes")
+        journal_paths = []
+
+        for name in sorted(os.listdir(nodes_dir)):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(nodes_dir, name), "r") as node_file:
+                journal_path = json.load(node_file)["journal"]
+            if os.path.isfile(journal_path):
+                journal_paths.append(journal_path)
+
+        return journal_paths
+
+    def _renew(self):
+        while not self._stop.wait(self.lease_seconds / 4):
+            with self._lock:
+                paths = list(self.leases.values())
+            for path in paths:
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        self._stop.set()
+        self._heartbeat.join()
+        for fsource in list(self.leases):
+            self.release(fsource)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def shard_translate(mapping, seed_prompt, shard, **options):
+    """
+    Translate the files of one shard i/N of the mapping with its own
+    journal, and merge the journals of the N shards into one report.
+    Returns the number of files of the shard in each state.
+    """
+    counts = lib.prompt_translate(
+        shard_mapping(mapping, shard),
+        seed_prompt,
+        journal_path=lib.node_journal(shard_name(shard)),
+        **options,
+    )
+    _, count = parse_shard(shard)
+    journal_paths = [lib.node_journal(shard_name(f"{i}/{count}")) for i in range(count)]
+    lib.merge_journals([path for path in journal_paths if os.path.isfile(path)])
+    return counts
+
+
+def queue_translate(
+    mapping,
+    seed_prompt,
+    queue_dir,
+    model,
+    shard=None,
+    jobs=1,
+    batch_size=1,
+    lease_seconds=600.0,
+    poll_interval=30.0,
+    **options,
+):
+    """
+    Translate files pulled from a WorkQueue in queue_dir, together with
+    other nodes running the same command on the same file list. Files are
+    claimed jobs * batch_size at a time, those of shard i/N first when
+    given. The node waits for leases of other nodes, polling every
+    poll_interval seconds, until every file is done or out of attempts,
+    and then merges the journals of the nodes of the queue into one
+    report, whose summary is returned. The seed prompt is loaded once for
+    all rounds of claims.
+    """
+    import toml
+
+    node = shard_name(shard) if shard else f"{socket.gethostname()}-{os.getpid()}"
+    journal_path = lib.node_journal(node)
+
+    with lib.span("load_model"):
+        neural_model = lib.load_model(model)
+
+    with lib.span("load_seed_prompt"):
+        chat_template = toml.load(seed_prompt)["chat"]
+
+    tasks = {task[0]: task for task in zip(*mapping)}
+    files = list(mapping[0])
+    if shard:
+        own = shard_mapping(mapping, shard)[0]
+        others = set(files) - set(own)
+        files = own + [fsource for fsource in files if fsource in others]
+
+    print(f"Node {node} pulling {len(files)} file(s) from {queue_dir}")
+
+    with WorkQueue(queue_dir, node, lease_seconds=lease_seconds) as work_queue:
+        # A journal of this node from another queue is started over
+        resume = work_queue.join(journal_path)
+
+        while True:
+            with lib.span("claim"):
+                claimed = work_queue.claim(files, max(jobs * batch_size, 1))
+                if not claimed and work_queue.pending(files):
+                    claimed = work_queue.claim(
+                        files, max(jobs * batch_size, 1), steal=True
+                    )
+
+            if not claimed:
+                if not work_queue.pending(files):
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            lib.prompt_translate(
+                tuple(list(column) for column in zip(*map(tasks.get, claimed))),
+                chat_template,
+                model=neural_model,
+                jobs=jobs,
+                batch_size=batch_size,
+                resume=resume,
+                journal_path=journal_path,
+                **options,
+            )
+            resume = True
+
+            records = lib.read_journal(journal_path)
+            for fsource in claimed:
+                record = records.get(fsource)
+                if os.path.isfile(tasks[fsource][1]) and (
+                    record is None or record["state"] == "done"
+                ):
+                    work_queue.complete(fsource, record)
+                else:
+                    work_queue.fail(fsource, record.get("error") if record else None)
+
+    return lib.merge_journals(work_queue.journals())["summary"]
@@ -1,41 +1,153 @@
-import re
 import os
-import yaml
+import json
+import hashlib
+import socket
 
 from code_scribe import lib
 
 
-def extract_fortran_info(filepath):
-    """Extracts module and subroutine/function names from a Fortran file."""
-    info = {"modules": [], "subroutines": [], "functions": []}
-
-    with open(filepath, "r") as file:
-        for line in file:
-            line = line.strip()
-            line = line.lower()
-            # Check for module declaration
-            if line.startswith("module "):
-                info["modules"].append(line.split()[1])  # Capture module name
-            # Check for subroutine declaration
-            elif line.startswith("subroutine "):
-                # Extract the subroutine name (first word after "subroutine")
-                match = re.match(r"subroutine\s+(\w+)", line)
-                if match:
-                    info["subroutines"].append(
-                        match.group(1)
-                    )  # Capture subroutine name
-            # Check for function declaration
-            elif line.startswith("function "):
-                # Extract the function name (first word after "function")
-                match = re.match(r"function\s+(\w+)", line)
-                if match:
-                    info["functions"].append(match.group(1))  # Capture function name
+def extract_fortran_info(filepath, preprocess=None):
+    """
+    Extracts module and subroutine/function names from a Fortran file. With
+    preprocess options of lib.expand_fortran_file, constructs of included
+    files and of active preprocessor branches are extracted as well, and
+    the included files are listed under "includes".
+    """
+    includes = []
+    if preprocess is not None:
+        filepath, includes = lib.expand_fortran_file(filepath, **preprocess)
+
+    scan = lib.scan_fortran_file(filepath, meta=False)
+    info = {key: scan[key] for key in ("modules", "subroutines", "functions")}
+
+    if includes:
+        info["includes"] = includes
 
     return info
 
 
-def create_scribe_yaml(root_directory):
-    """Traverses the directory and creates scribe.yaml files for Fortran files."""
+MANIFEST_NAME = "scribe.manifest.json"
+
+
+def join_lines(lines, chunk_lines=4096):
+    """
+    Join an iterable of lines into a list of strings of up to chunk_lines
+    lines each. This keeps a large file in a few string objects instead
+    of one object per line.
+    """
+    chunks = []
+    buffer = []
+
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) == chunk_lines:
+            chunks.append("".join(buffer))
+            buffer.clear()
+
+    if buffer:
+        chunks.append("".join(buffer))
+
+    return chunks
+
+
+def atomic_write(filepath, content):
+    """
+    Write content to a file through a temporary file and a rename, so
+    that the file is either left untouched or completely written. The
+    temporary file is named after the host and process, so that nodes
+    writing the same file at once do not clobber each other.
+    """
+    tmp_path = f"{filepath}.{socket.gethostname()}-{os.getpid()}.tmp"
+
+    try:
+        with open(tmp_path, "w") as tmp_file:
+            tmp_file.write(content)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def file_fingerprint(filepath):
+    """Return the size, modification time, and content hash of a file."""
+    stat = os.stat(filepath)
+    digest = hashlib.sha256()
+
+    with open(filepath, "rb") as source:
+        for chunk in iter(lambda: source.read(1024**2), b""):
+            digest.update(chunk)
+
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": digest.hexdigest(),
+    }
+
+
+def load_index_manifest(root_directory, preprocess=None):
+    """Load the index manifest from the root directory if it exists."""
+    manifest_path = os.path.join(root_directory, MANIFEST_NAME)
+
+    if not os.path.isfile(manifest_path):
+        return {}
+
+    with open(manifest_path, "r") as manifest_file:
+        manifest = json.load(manifest_file)
+
+    # A manifest created for a different root cannot be reused
+    if manifest.get("root") != root_directory:
+        return {}
+
+    # So can one created with different preprocessing options
+    if manifest.get("preprocess") != preprocess:
+        return {}
+
+    return manifest.get("files", {})
+
+
+def save_index_manifest(root_directory, files, preprocess=None):
+    """Save the index manifest to the root directory."""
+    manifest_path = os.path.join(root_directory, MANIFEST_NAME)
+    manifest = {"root": root_directory, "files": files}
+
+    if preprocess is not None:
+        manifest["preprocess"] = preprocess
+
+    with open(manifest_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+
+
+def create_scribe_yaml(
+    root_directory, incremental=False, jobs=1, database=False, preprocess=None
+):
+    """
+    Traverses the directory and creates scribe.yaml files for Fortran files.
+
+    A manifest of file size, modification time, and content hash is saved
+    at the root directory, where the hash is left out of a full run. With incremental=True only files that changed
+    since the last run are parsed, and only scribe.yaml files of directories
+    with added, modified, or deleted files are rewritten. Files are parsed
+    over a pool of jobs processes. With database=True a consolidated
+    scribe.db is also created at the root directory, and an existing one
+    is always rewritten so that it never falls behind the index.
+
+    With preprocess options of lib.expand_fortran_file, includes and
+    preprocessor conditionals are resolved before parsing. The options are
+    saved with the index, and a file is parsed again when one of the files
+    it includes changes.
+
+    Returns:
+        int: The number of parsed files.
+    """
+    import yaml
+
+    previous = load_index_manifest(root_directory, preprocess) if incremental else {}
+    manifest = {}
+    directories = []
+    modified = set()
+    unparsed = []
+
     for dirpath, _, filenames in os.walk(root_directory):
         scribe_data = {
             "root": root_directory,
@@ -43,23 +155,106 @@ def create_scribe_yaml(root_directory):
             "files": {},
         }
 
+        if preprocess is not None:
+            scribe_data["preprocess"] = preprocess
+
         for filename in filenames:
             if filename.endswith((".f", ".f90", ".F90")):
                 filepath = os.path.join(dirpath, filename)
-                fortran_info = extract_fortran_info(filepath)
+                relpath = os.path.relpath(filepath, root_directory)
+                entry = previous.pop(relpath, None)
+                stat = os.stat(filepath)
+
+                if entry and not lib.files_unchanged(entry.get("includes", {})):
+                    entry = None
+
+                # Hash only when size or modification time differ, and
+                # parse only when the content has actually changed
+                if not (
+                    entry
+                    and entry["size"] == stat.st_size
+                    and entry["mtime_ns"] == stat.st_mtime_ns
+                ):
+                    if incremental:
+                        with lib.span("fingerprint"):
+                            fingerprint = file_fingerprint(filepath)
+                    else:
+                        # Every file is parsed anyway, so the content is only
+                        # hashed by a later incremental run if its stat changes
+                        fingerprint = {
+                            "size": stat.st_size,
+                            "mtime_ns": stat.st_mtime_ns,
+                            "sha256": None,
+                        }
+
+                    if entry and entry["sha256"] == fingerprint["sha256"]:
+                        entry.update(fingerprint)
+                    else:
+                        entry = dict(fingerprint, info=None)
+                        unparsed.append((filepath, entry, scribe_data, filename))
+                        modified.add(dirpath)
+
+                manifest[relpath] = entry
 
                 # Add extracted information to the scribe_data
-                scribe_data["files"][filename] = fortran_info
+                scribe_data["files"][filename] = entry["info"]
+
+        directories.append((dirpath, scribe_data))
+
+        if not incremental or (
+            scribe_data["files"]
+            and not os.path.isfile(os.path.join(dirpath, "scribe.yaml"))
+        ):
+            modified.add(dirpath)
+
+    # Parse new and changed files, and merge results in the order of the walk
+    with lib.span("parse", files=len(unparsed), jobs=jobs):
+        fortran_infos = lib.parallel_map(
+            extract_fortran_info,
+            [item[0] for item in unparsed],
+            [preprocess] * len(unparsed),
+            jobs=jobs,
+        )
+
+    for (_, entry, scribe_data, filename), fortran_info in zip(unparsed, fortran_infos):
+        entry["info"] = fortran_info
+        scribe_data["files"][filename] = fortran_info
+
+        if "includes" in fortran_info:
+            entry["includes"] = lib.file_stats(fortran_info["includes"])
+
+    # Files left in the previous manifest have been deleted
+    for relpath in previous:
+        modified.add(os.path.dirname(os.path.join(root_directory, relpath)))
+
+    for dirpath, scribe_data in directories:
+        if dirpath not in modified:
+            continue
+
+        yaml_path = os.path.join(dirpath, "scribe.yaml")
 
         # Only write to scribe.yaml if there are Fortran files in the directory
         if scribe_data["files"]:
-            yaml_path = os.path.join(dirpath, "scribe.yaml")
-            with open(yaml_path, "w") as yaml_file:
+            with lib.span("write_yaml"), open(yaml_path, "w") as yaml_file:
                 yaml.dump(scribe_data, yaml_file, default_flow_style=False)
 
+        elif incremental and os.path.isfile(yaml_path):
+            os.remove(yaml_path)
+
+    with lib.span("write_manifest"):
+        save_index_manifest(root_directory, manifest, preprocess)
+
+    if database or os.path.isfile(os.path.join(root_directory, lib.DATABASE_NAME)):
+        with lib.span("write_database"):
+            lib.create_scribe_db(root_directory, manifest, preprocess)
+
+    return len(unparsed)
+
 
 def load_scribe_yaml(file_path):
     """Load the content of a scribe.yaml file."""
+    import yaml
+
     with open(file_path, "r") as yaml_file:
         return yaml.safe_load(yaml_file)
 
@@ -68,6 +263,9 @@ def create_file_indexes():
     """
     Create a combined index for files, subroutines, functions,
     and modules from all scribe.yaml files in the directory tree.
+
+    Returns:
+        FileIndex: Index that maps each construct name to all of its definitions.
     """
 
     # Start with the current working directory
@@ -85,7 +283,8 @@ def create_file_indexes():
     if not root_directory:
         raise ValueError(f"No 'root' entry found in {yaml_path}")
 
-    file_index = {}
+    file_index = lib.FileIndex()
+    file_index.preprocess = scribe_data.get("preprocess")
 
     # Traverse the directory tree starting from the root directory
     for dirpath, _, filenames in os.walk(root_directory):
@@ -98,59 +297,43 @@ def create_file_indexes():
                 for file, info in scribe_data["files"].items():
                     file_path = os.path.join(dirpath, file)  # Full file path
 
-                    # Extract modules, subroutines, and functions
-                    modules = info.get("modules", [])
-                    subroutines = info.get("subroutines", [])
-                    functions = info.get("functions", [])
-
-                    # Add modules to combined index
-                    for mod in modules:
-                        file_index[mod] = file_path
-                    # Add subroutines to combined index
-                    for sub in subroutines:
-                        file_index[sub] = file_path
-                    # Add functions to combined index
-                    for func in functions:
-                        file_index[func] = file_path
+                    # Add modules, subroutines, and functions to combined index
+                    for key, construct_type in lib.CONSTRUCT_TYPES.items():
+                        for name in info.get(key, []):
+                            file_index.add(name, construct_type, file_path)
 
     return file_index
 
 
-def filter_file_indexes(sfile, file_index):
+def filter_file_indexes(sfile, file_index, preprocess=None):
     """
     Extract modules and subroutines used in the given Fortran source file,
     and return a subset of the file_index that corresponds to these.
 
     Args:
         sfile (str): The Fortran source file to analyze.
-        file_index (dict): The complete item index list to filter from.
+        file_index (FileIndex, ScribeDB, or dict): The complete item index list to filter from.
+        preprocess (dict): Options of lib.expand_fortran_file, by default those
+                           the index was created with.
 
     Returns:
         dict: A subset of the file_index containing only the used modules and subroutines.
+              Values are lists of all defining file paths for FileIndex and ScribeDB.
     """
-    used_modules = set()
-    used_subroutines = set()
-
-    # Open and read the source file
-    with open(sfile, "r") as source:
-        for line in source.readlines():
-            stripped_line = line.strip()
-
-            # Check for 'use' statement to capture modules
-            module_match = re.match(r"^\s*use\s+(\w+)", stripped_line, re.IGNORECASE)
-            if module_match:
-                module_name = module_match.group(1).lower()
-                used_modules.add(module_name)
-
-            # Check for 'call' statement to capture subroutines
-            subroutine_match = re.match(
-                r"^\s*call\s+(\w+)", stripped_line, re.IGNORECASE
-            )
-            if subroutine_match:
-                subroutine_name = subroutine_match.group(1).lower()
-                used_subroutines.add(subroutine_name)
+    if preprocess is None:
+        preprocess = getattr(file_index, "preprocess", None)
+
+    if preprocess is not None:
+        sfile, _ = lib.expand_fortran_file(sfile, **preprocess)
+
+    scan = lib.scan_fortran_file(sfile, meta=False)
+    used_modules = scan["uses"]
+    used_subroutines = scan["calls"]
 
     # Filter the file_index to return only the modules and subroutines used in this file
+    if isinstance(file_index, (lib.FileIndex, lib.ScribeDB)):
+        return file_index.lookup(used_modules | used_subroutines)
+
     filtered_file_index = {
         name: path
         for name, path in file_index.items()
@@ -163,6 +346,9 @@ def filter_file_indexes(sfile, file_index):
 def query_construct(name, file_index):
     """Query the file path of a module, subroutine, or function."""
 
+    if isinstance(file_index, (lib.FileIndex, lib.ScribeDB)):
+        return file_index.query(name) or None
+
     # Find all matches for the given name
     matches = [
         file_path for construct, file_path in file_index.items() if name == construct
@@ -171,74 +357,21 @@ def query_construct(name, file_index):
     return matches if matches else None
 
 
+def query_constructs(names, file_index):
+    """
+    Query the file paths of several modules, subroutines, or functions
+    at once. Returns a dictionary of name to file paths for names found.
+    """
+
+    if isinstance(file_index, (lib.FileIndex, lib.ScribeDB)):
+        return file_index.lookup(names)
+
+    return {name: [file_index[name]] for name in names if name in file_index}
+
+
 def extract_fortran_meta(sfile):
     """Extract function, subroutine, module names, variables, and argument lists from Fortran source."""
-    meta_info = []
-    current_construct = None
-    variables_declared = []
-    argument_list = []
-
-    with open(sfile, "r") as source:
-        for line in source.readlines():
-            stripped_line = line.strip()
-
-            # Check for subroutine, module, or function start
-            construct_match = re.match(
-                r"^\s*(subroutine|function|module)\s+(\w+)",
-                stripped_line,
-                re.IGNORECASE,
-            )
-            if construct_match:
-                # If we were already inside a construct, save the previous one
-                if current_construct:
-                    meta_info.append(
-                        {
-                            "name": current_construct["name"],
-                            "type": current_construct["type"],
-                            "variables_declared": variables_declared,
-                            "argument_list": argument_list,
-                        }
-                    )
-
-                # Start a new construct
-                current_construct = {
-                    "name": construct_match.group(2),
-                    "type": construct_match.group(1).lower(),
-                }
-                variables_declared = []  # Reset variables declared
-                argument_list = []  # Reset argument list
-
-                # If it's a function or subroutine, look for the argument list
-                if current_construct["type"] in ["function", "subroutine"]:
-                    args_match = re.search(r"\((.*?)\)", stripped_line)
-                    if args_match:
-                        arguments = [
-                            arg.strip() for arg in args_match.group(1).split(",")
-                        ]
-                        argument_list.extend(arguments)
-
-            # Extract variable declarations (e.g., integer, real, character, etc.)
-            var_match = re.match(
-                r"^\s*(integer|real|double\s*precision|character|logical)\s+([\w\s,]*)",
-                stripped_line,
-                re.IGNORECASE,
-            )
-            if var_match:
-                variables = [var.strip() for var in var_match.group(2).split(",")]
-                variables_declared.extend(variables)
-
-        # Save the last construct if it exists
-        if current_construct:
-            meta_info.append(
-                {
-                    "name": current_construct["name"],
-                    "type": current_construct["type"],
-                    "variables_declared": variables_declared,
-                    "argument_list": argument_list,
-                }
-            )
-
-    return meta_info
+    return lib.scan_fortran_file(sfile)["meta"]
 
 
 def annotate_fortran_file(sfile, *args):
@@ -252,10 +385,6 @@ def annotate_fortran_file(sfile, *args):
     if os.path.isfile(scribe_filename):
         return f"Skipping! File exists {scribe_filename}..."
 
-    header_includes = set(
-        ("#include <cmath>", "#include <complex>")
-    )  # Keep track of headers to avoid duplicates
-    content_lines = []  # Store lines of modified content
     prompt_lines = []
 
     prompt_lines.append(
@@ -272,108 +401,29 @@ def annotate_fortran_file(sfile, *args):
         + "Include [&] in capture clause to use variables by reference"
     )
 
-    with open(sfile, "r") as source:
-        source_code = source.readlines()
-
-        for line in source_code:
-            stripped_line = line.strip()
-
-            # Skip lines that are comments starting with 'c', '!!', or '!'
-            if stripped_line.lower().startswith(("c", "!!", "!")) and (
-                not stripped_line.lower().startswith(("complex"))
-            ):
-                continue
-
-            # Replace 'use <module_name>' with '#include' and 'using namespace'
-            use_match = re.match(r"\buse\s+(\w+)", stripped_line, flags=re.IGNORECASE)
-            if use_match:
-                module_name = use_match.group(1)
-
-                # Add header include globally but only once
-                header_includes.add(f"#include <{module_name}.hpp>")
-
-                # Replace 'use' with 'using namespace' inline
-                content_lines.append(f"using namespace {module_name};\n")
-                continue
-
-            # Remove implict none statement
-            line = re.sub(r"implicit none", "", line)
-
-            # Handle variable declarations and conversions
-            line = re.sub(r"\binteger\b\s*", "int", line, flags=re.IGNORECASE)
-            line = re.sub(
-                r"\breal\s*(\(\s*kind\s*=\s*\w+\s*\)|\(\s*\w+\s*\)|)?\s*",
-                "double",
-                line,
-                flags=re.IGNORECASE,
-            )
-            line = re.sub(
-                r"\bcomplex\s*\(\s*dp\s*\)\s*",
-                "complex<double> ",
-                line,
-                flags=re.IGNORECASE,
-            )
-            line = re.sub(
-                r"\bcomplex\s*\(\s*integer\s*\)\s*",
-                "complex<int> ",
-                line,
-                flags=re.IGNORECASE,
-            )
-            line = re.sub(
-                r"\bcomplex\s*\(\s*logical\s*\)\s*",
-                "complex<bool> ",
-                line,
-                flags=re.IGNORECASE,
-            )
-            line = re.sub(r"(?<!std::)\s*::", "", line)
-
-            # Handle complex types in variable declarations, ensuring dimensionality is handled
-            line = re.sub(
-                r"\bcomplex<([^>]+)>\s*(\w+)\s*\((.*?)\)\s*",
-                r"FArray<std::complex<\1>> \2(\3)",
-                line,
-            )
-
-            line = re.sub(
-                r"\b(real|double|int|bool|complex<[^>]+>)\s*,?\s*dimension\s*\((.*?)\)\s*(\w+)\s*;",
-                r"FArray<\1> \3(\2)",
-                line,
-                flags=re.IGNORECASE,
-            )
-
-            line = re.sub(
-                r"\b(real|double|int|bool|complex<[^>]+>)\s*(\w+)\s*\((.*?)\)\s*;",
-                r"FArray<\1> \2(\3)",
-                line,
-                flags=re.IGNORECASE,
-            )
-
-            # Treat line continuation characters. Replace them with equivalent syntax in C++
-            line = re.sub(r"^\s*&", r"\\", line)
-            line = re.sub(r"\s*&\s*$", r" \\", line)
-
-            # Substitution x**y with pow(x,y)
-            line = re.sub(r"(\w+)\s*\*\*\s*(\d+)", r"pow(\1,\2)", line)
-
-            # Add a semicolon at the end of variable declarations
-            # if re.match(r"^(int|double|complex<[^>]+>)\s", line.strip()):
-            #    line = line.strip() + ";"
-
-            # Append the modified line to content_lines
-            content_lines.append(line.strip() + "\n")
-
-    # Write the output to the .scribe file
-    with open(scribe_filename, "w") as scribe_file:
-
-        scribe_file.write("\n".join(prompt_lines))
-        scribe_file.write("\n\n")
-
-        # First, write all the includes at the top
-        if header_includes:
-            scribe_file.write("\n".join(sorted(header_includes)) + "\n\n")
-
-        # Then, write the rest of the modified content
-        scribe_file.writelines(content_lines)
+    import shutil
+    import tempfile
+
+    # Converted lines are spooled to a temporary file, since the includes
+    # that go on top are only known once the whole file has been scanned
+    with tempfile.TemporaryFile("w+") as content_file:
+        with lib.span("draft_scan", file=sfile):
+            scan = lib.scan_fortran_file(sfile, draft_file=content_file, meta=False)
+        header_includes = scan["headers"]
+
+        # Write the output to the .scribe file
+        with lib.span("write_draft"), open(scribe_filename, "w") as scribe_file:
+
+            scribe_file.write("\n".join(prompt_lines))
+            scribe_file.write("\n\n")
+
+            # First, write all the includes at the top
+            if header_includes:
+                scribe_file.write("\n".join(sorted(header_includes)) + "\n\n")
+
+            # Then, write the rest of the modified content
+            content_file.seek(0)
+            shutil.copyfileobj(content_file, scribe_file)
 
     return f"Generated draft file for LLM consumption {scribe_filename}"
 
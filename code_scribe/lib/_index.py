@@ -0,0 +1,52 @@
+class FileIndex:
+    """
+    In-memory index of modules, subroutines, and functions. Each
+    case-folded construct name maps to all of its definitions, so
+    constructs repeated along the directory tree are preserved.
+    """
+
+    def __init__(self):
+        self._definitions = {}
+        self.preprocess = None
+
+    def add(self, name, construct_type, file_path):
+        """Add a definition of a construct."""
+        self._definitions.setdefault(name.lower(), []).append(
+            (construct_type, file_path)
+        )
+
+    def definitions(self, name, construct_type=None):
+        """Return (type, file path) pairs that define a construct name."""
+        definitions = self._definitions.get(name.lower(), [])
+
+        if construct_type:
+            return [item for item in definitions if item[0] == construct_type]
+
+        return list(definitions)
+
+    def query(self, name):
+        """Return file paths that define a construct name."""
+        return [file_path for _, file_path in self._definitions.get(name.lower(), [])]
+
+    def lookup(self, names):
+        """Return a dictionary of construct name to file paths for a set of names."""
+        matches = {}
+
+        for name in names:
+            definitions = self._definitions.get(name.lower())
+            if definitions:
+                matches[name.lower()] = [file_path for _, file_path in definitions]
+
+        return matches
+
+    def items(self):
+        """Iterate over (construct name, file path) pairs."""
+        for name, definitions in self._definitions.items():
+            for _, file_path in definitions:
+                yield name, file_path
+
+    def __contains__(self, name):
+        return name.lower() in self._definitions
+
+    def __len__(self):
+        return len(self._definitions)
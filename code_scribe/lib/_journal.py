@@ -0,0 +1,153 @@
+import os
+import glob
+import json
+import time
+import threading
+
+from code_scribe import lib
+
+JOURNAL_NAME = "scribe.journal.jsonl"
+
+REPORT_NAME = "scribe.report.json"
+
+JOB_STATES = ("pending", "in-flight", "done", "failed")
+
+
+class JobJournal:
+    """
+    Write-ahead journal of the state of each file in a translate run.
+
+    Every state change is appended as a JSON line and flushed to disk before
+    the run moves on, so a run that dies keeps its bookkeeping. The last
+    record of a file holds its current state along with the latency, token
+    counts, and error of its last attempt.
+    """
+
+    def __init__(self, journal_path=JOURNAL_NAME, resume=False):
+        self.journal_path = journal_path
+        self.records = {}
+
+        self._lock = threading.Lock()
+
+        if resume and os.path.isfile(journal_path):
+            self.records = read_journal(journal_path)
+
+        self._journal = open(journal_path, "a" if resume else "w")
+
+    def state(self, fsource):
+        """Last recorded state of a file, or None if it has no record."""
+        record = self.records.get(fsource)
+        return record["state"] if record else None
+
+    def record(self, fsource, state, **fields):
+        """Append a state change for a file and flush it to disk."""
+        if state not in JOB_STATES:
+            raise ValueError(f"Unknown job state {state}, expected one of {JOB_STATES}")
+
+        record = {"file": fsource, "state": state, "time": time.time(), **fields}
+
+        with self._lock:
+            self.records[fsource] = record
+            self._journal.write(json.dumps(record) + "\n")
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+    def summary(self):
+        """Number of files in each state."""
+        counts = {state: 0 for state in JOB_STATES}
+        for record in self.records.values():
+            counts[record["state"]] += 1
+        return counts
+
+    def close(self):
+        self._journal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_journal(journal_path):
+    """Last record of each file in a journal."""
+    records = {}
+    with open(journal_path, "r") as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line is incomplete if a run died mid-write
+                continue
+            records[record["file"]] = record
+    return records
+
+
+def node_journal(node):
+    """Journal path of one node of a distributed translate run."""
+    return f"{os.path.splitext(JOURNAL_NAME)[0]}.{node}.jsonl"
+
+
+def merge_journals(journal_paths=None, report_path=REPORT_NAME):
+    """
+    Merge the journals of the nodes of a distributed run into one report.
+    A file is done if any node finished it, and otherwise takes the state
+    of its latest record. Files finished by more than one node, because a
+    straggler was reassigned, are counted as duplicates.
+    """
+    if journal_paths is None:
+        journal_paths = sorted(glob.glob(node_journal("*")))
+
+    prefix = os.path.splitext(JOURNAL_NAME)[0] + "."
+    files = {}
+    finished = {}
+    nodes = {}
+
+    for journal_path in journal_paths:
+        name = os.path.basename(journal_path)
+        node = name[len(prefix) : -len(".jsonl")] if name.startswith(prefix) else name
+        counts = nodes[node] = {
+            "done": 0,
+            "failed": 0,
+            "incomplete": 0,
+            "generated_tokens": 0,
+            "busy_seconds": 0.0,
+        }
+
+        for fsource, record in read_journal(journal_path).items():
+            record = dict(record, node=node)
+            state = record["state"] if record["state"] in counts else "incomplete"
+            counts[state] += 1
+            counts["generated_tokens"] += record.get("generated_tokens", 0)
+            counts["busy_seconds"] += record.get("latency", 0.0)
+
+            if state == "done":
+                finished[fsource] = finished.get(fsource, 0) + 1
+
+            # A done record wins over any other, then the latest one
+            current = files.get(fsource)
+            if current is None or (state == "done", record["time"]) > (
+                current["state"] == "done",
+                current["time"],
+            ):
+                files[fsource] = record
+
+    summary = {state: 0 for state in ("done", "failed", "incomplete")}
+    for record in files.values():
+        summary[record["state"] if record["state"] in summary else "incomplete"] += 1
+    summary["duplicates"] = sum(count > 1 for count in finished.values())
+
+    report = {"summary": summary, "nodes": nodes, "files": files}
+    lib.atomic_write(report_path, json.dumps(report, indent=2))
+
+    for node, counts in nodes.items():
+        print(
+            f"Node {node}: {counts['done']} done, {counts['failed']} failed, "
+            + f"{counts['incomplete']} incomplete, {counts['busy_seconds']:.1f}s busy"
+        )
+    print(
+        f"Report {report_path}: {summary['done']} done, {summary['failed']} failed, "
+        + f"{summary['incomplete']} incomplete of {len(files)} file(s) "
+        + f"from {len(nodes)} node(s), {summary['duplicates']} duplicate(s)"
+    )
+    return report
@@ -2,18 +2,22 @@
 
 # Import libraries
 import re
-import os, sys, toml, importlib, json
+import os, sys, importlib, json, copy, time, queue, random, threading
+import types, hashlib, contextlib
 
 from typing import Optional
-from alive_progress import alive_bar
 
 from code_scribe import lib
 
+# toml, alive_progress, asyncio, and concurrent.futures are imported where
+# they are used to keep start up time of the command line low
+
 
 class LlamaModel:
     def __init__(self, model):
 
         llama = importlib.import_module("llama")
+        self.model_id = os.path.abspath(model)
 
         self.pipeline = llama.Llama.build(
             ckpt_dir=model,
@@ -22,10 +26,15 @@ class LlamaModel:
             max_batch_size=8,
         )
 
+        self.context_length = 4096
         self.max_gen_len = None
         self.temperature = 0.5
         self.top_p = 0.95
 
+        # Local model, requests are processed one at a time
+        self.limiter = lib.RateLimiter(max_concurrency=1)
+        self.max_retries = 0
+
     def chat(self, chat_template):
         results = self.pipeline.chat_completion(
             [chat_template],
@@ -36,14 +45,84 @@ class LlamaModel:
         print(results)
         return results[0]["generation"]["content"]
 
+    def chat_batch(self, chat_templates):
+        results = self.pipeline.chat_completion(
+            chat_templates,
+            max_gen_len=self.max_gen_len,
+            temperature=self.temperature,
+            top_p=self.top_p,
+        )
+        return [result["generation"]["content"] for result in results]
+
+    def count_tokens(self, text):
+        return len(self.pipeline.tokenizer.encode(text, bos=False, eos=False))
+
+    def signature(self):
+        return {
+            "backend": "llama",
+            "model": self.model_id,
+            "max_gen_len": self.max_gen_len,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+        }
+
+
+# USD per million prompt, cached prompt, and completion tokens of OpenAI
+# models, used for cost accounting from the usage reported with each response
+OPENAI_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+}
+
+# Requests of the Batch API are billed at half the price
+BATCH_DISCOUNT = 0.5
+
 
 class OpenAIModel:
-    def __init__(self):
+    def __init__(self, model_id="gpt-4o", requests_per_minute=None):
         openai = importlib.import_module("openai")
-        self.pipeline = openai.OpenAI()
+        self._setup(openai, model_id)
+
+        # Retries are ours, so that they do not stack on those of the client
+        self.pipeline = openai.OpenAI(max_retries=0)
+
+        # Remote model, concurrency is bounded by the caller and
+        # transient API errors are retried with backoff, while errors
+        # like a bad request or an invalid key are raised right away
+        self.limiter = lib.RateLimiter(requests_per_minute=requests_per_minute)
+        self.max_retries = 3
+
+    def _setup(self, openai, model_id):
+        """Settings shared by the synchronous and asynchronous backends."""
+        self.model_id = model_id
+        self.context_length = 128000
         self.outputs = 1
         self.max_tokens = 4096
 
+        self.prices = OPENAI_PRICES.get(model_id)
+        self.reports_usage = True
+
+        # Requests that share the seed prompt carry the same cache key, which
+        # routes them to the same prompt cache of the API
+        self.prompt_cache_key = None
+        self.prefix_stats = lib.PrefixCacheStats()
+
+        # Use the tiktoken tokenizer for token counts when it is installed
+        try:
+            tiktoken = importlib.import_module("tiktoken")
+            self.tokenizer = tiktoken.encoding_for_model(self.model_id)
+        except (ImportError, KeyError):
+            self.tokenizer = None
+
+        self.retry_errors = (
+            openai.RateLimitError,
+            openai.APITimeoutError,
+            openai.APIConnectionError,
+            openai.InternalServerError,
+        )
+
     def chat(self, chat_template):
         # We use the Chat Completion endpoint for chat like inputs
         response = self.pipeline.chat.completions.create(
@@ -52,36 +131,475 @@ class OpenAIModel:
             # gpt-4, gpt-4-0314, gpt-4-32k, gpt-4-32k-0314,
             # gpt-3.5-turbo, gpt-3.5-turbo-0301
             # model="gpt-3.5-turbo",
-            model="gpt-4o",
+            model=self.model_id,
             messages=chat_template,
             # max_tokens generated by the AI model
             # maximu value can be 4096 tokens for "gpt-3.5-turbo"
             max_tokens=self.max_tokens,
             # number of output variations to be generated by AI model
             n=self.outputs,
+            **self.request_options(),
         )
 
+        self.record_usage(response.usage)
         return response.choices[0].message.content
 
+    def stream(self, chat_template):
+        response = self.pipeline.chat.completions.create(
+            model=self.model_id,
+            messages=chat_template,
+            max_tokens=self.max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+            **self.request_options(),
+        )
+
+        for chunk in response:
+            if chunk.usage:
+                self.record_usage(chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def set_prompt_prefix(self, chat_template):
+        """Derive the prompt cache key of requests from the seed chat template."""
+        payload = json.dumps([self.model_id, chat_template], sort_keys=True)
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        self.prompt_cache_key = f"code-scribe-{digest[:16]}"
+
+    def request_options(self):
+        """Optional parameters of chat completion requests."""
+        if self.prompt_cache_key:
+            return {"prompt_cache_key": self.prompt_cache_key}
+        return {}
+
+    def record_usage(self, usage, discount=1.0):
+        """
+        Record token usage and cost of a response with the active profiler,
+        and the prompt tokens that were served from the prompt cache.
+        """
+        if usage is None:
+            return
+
+        details = getattr(usage, "prompt_tokens_details", None) or {}
+        cached_tokens = (
+            details.get("cached_tokens")
+            if isinstance(details, dict)
+            else details.cached_tokens
+        ) or 0
+        self.prefix_stats.record(usage.prompt_tokens, cached_tokens)
+
+        cost = (
+            (
+                (usage.prompt_tokens - cached_tokens) * self.prices[0]
+                + cached_tokens * self.prices[1]
+                + usage.completion_tokens * self.prices[2]
+            )
+            * discount
+            / 1e6
+            if self.prices
+            else None
+        )
+        lib.record_usage(
+            self.model_id, usage.prompt_tokens, usage.completion_tokens, cost
+        )
+
+    def batch_request(self, custom_id, chat_template):
+        """Line of a Batch API input file for a chat template."""
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.model_id,
+                "messages": chat_template,
+                "max_tokens": self.max_tokens,
+                "n": self.outputs,
+                **self.request_options(),
+            },
+        }
+
+    def submit_batch(self, input_path):
+        """Upload a Batch API input file, start the batch, and return its id."""
+        with open(input_path, "rb") as input_file:
+            upload = self.pipeline.files.create(file=input_file, purpose="batch")
+
+        batch = self.pipeline.batches.create(
+            input_file_id=upload.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    def retrieve_batch(self, batch_id):
+        return self.pipeline.batches.retrieve(batch_id)
+
+    def batch_results(self, batch):
+        """
+        Yield custom_id, response, and error of each request of a finished
+        batch. The response is None for requests that failed.
+        """
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+
+            for line in self._file_text(file_id).splitlines():
+                if not line.strip():
+                    continue
+
+                result = json.loads(line)
+                response = result.get("response") or {}
+
+                if response.get("status_code") == 200:
+                    body = response["body"]
+                    if body.get("usage"):
+                        self.record_usage(
+                            types.SimpleNamespace(**body["usage"]),
+                            discount=BATCH_DISCOUNT,
+                        )
+                    content = body["choices"][0]["message"]["content"]
+                    yield result["custom_id"], content, None
+                else:
+                    error = result.get("error") or response.get("body", {}).get("error")
+                    if isinstance(error, dict):
+                        error = error.get("message", error)
+                    yield result["custom_id"], None, error
+
+    def _file_text(self, file_id):
+        return self.pipeline.files.content(file_id).text
+
+    def count_tokens(self, text):
+        if self.tokenizer:
+            return len(self.tokenizer.encode(text))
+        return len(text) // 4
+
+    def signature(self):
+        return {
+            "backend": "openai",
+            "model": self.model_id,
+            "max_tokens": self.max_tokens,
+            "n": self.outputs,
+        }
+
+
+class AsyncOpenAIModel(OpenAIModel):
+    """
+    OpenAI backend on a single AsyncOpenAI client, whose connection pool
+    is shared by all requests. Requests run on an event loop in a background
+    thread, so calls from any number of jobs, and every prompt of a batch,
+    are in flight together. Concurrency adapts to the rate limits reported
+    by the API, and failed requests are retried with jittered backoff.
+    """
+
+    def __init__(
+        self,
+        model_id="gpt-4o",
+        max_concurrency=64,
+        tokens_per_minute=None,
+        timeout=120.0,
+        max_retries=6,
+        requests_per_minute=None,
+    ):
+        import asyncio
+
+        openai = importlib.import_module("openai")
+        self._setup(openai, model_id)
+
+        self.timeout = timeout
+        self.request_retries = max_retries
+        self.rate_limiter = lib.AdaptiveLimiter(
+            max_concurrency=max_concurrency, tokens_per_minute=tokens_per_minute
+        )
+
+        self._rate_limit_error = openai.RateLimitError
+
+        # Requests are paced and retried on the event loop
+        self.limiter = lib.RateLimiter(requests_per_minute=requests_per_minute)
+        self.max_retries = 0
+
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+
+        # The base URL is read from OPENAI_BASE_URL, and retries are ours
+        self.pipeline = openai.AsyncOpenAI(timeout=timeout, max_retries=0)
+
+    def _run(self, coroutine):
+        import asyncio
+
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _submit_batch(self, input_path):
+        with open(input_path, "rb") as input_file:
+            upload = await self.pipeline.files.create(file=input_file, purpose="batch")
+
+        batch = await self.pipeline.batches.create(
+            input_file_id=upload.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    def submit_batch(self, input_path):
+        return self._run(self._submit_batch(input_path))
+
+    def retrieve_batch(self, batch_id):
+        return self._run(self.pipeline.batches.retrieve(batch_id))
+
+    def _file_text(self, file_id):
+        return self._run(self.pipeline.files.content(file_id)).text
+
+    @contextlib.asynccontextmanager
+    async def _completion(self, chat_template, **kwargs):
+        """
+        Create a completion and hold a slot of the rate limiter until the
+        enclosed block is done with it. Requests are counted against the
+        token budget with max_tokens, the same as the API does.
+        """
+        import asyncio
+
+        tokens = (
+            self.count_tokens("".join(message["content"] for message in chat_template))
+            + self.max_tokens
+        )
+        attempt = 0
+
+        while True:
+            await self.rate_limiter.acquire(tokens)
+            try:
+                raw = await self.pipeline.chat.completions.with_raw_response.create(
+                    model=self.model_id,
+                    messages=chat_template,
+                    max_tokens=self.max_tokens,
+                    timeout=self.timeout,
+                    **self.request_options(),
+                    **kwargs,
+                )
+                break
+            except self.retry_errors as error:
+                self.rate_limiter.release()
+                if isinstance(error, self._rate_limit_error):
+                    self.rate_limiter.on_rate_limit(error.response.headers)
+                if attempt >= self.request_retries:
+                    raise
+            except BaseException:
+                self.rate_limiter.release()
+                raise
+
+            await asyncio.sleep(min(60.0, 2.0**attempt) * random.uniform(0.5, 1.0))
+            attempt += 1
+
+        self.rate_limiter.on_success(raw.headers, tokens)
+        try:
+            yield raw.parse()
+        finally:
+            self.rate_limiter.release()
+
+    async def _chat(self, chat_template):
+        async with self._completion(chat_template, n=self.outputs) as response:
+            self.record_usage(response.usage)
+            return response.choices[0].message.content
+
+    async def _chat_batch(self, chat_templates):
+        import asyncio
+
+        return await asyncio.gather(
+            *[self._chat(template) for template in chat_templates],
+            return_exceptions=True,
+        )
+
+    def chat(self, chat_template):
+        return self._run(self._chat(chat_template))
+
+    def chat_batch(self, chat_templates):
+        return self._run(self._chat_batch(chat_templates))
+
+    def stream(self, chat_template):
+        import asyncio
+
+        chunks = queue.Queue()
+
+        async def _stream():
+            try:
+                async with self._completion(
+                    chat_template,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                ) as response:
+                    async for chunk in response:
+                        if chunk.usage:
+                            self.record_usage(chunk.usage)
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            chunks.put(chunk.choices[0].delta.content)
+                chunks.put(None)
+            except Exception as error:
+                chunks.put(error)
+
+        asyncio.run_coroutine_threadsafe(_stream(), self._loop)
+
+        while True:
+            text = chunks.get()
+            if text is None:
+                return
+            if isinstance(text, Exception):
+                raise text
+            yield text
+
 
 class TFModel:
-    def __init__(self, checkpoint_dir):
+    def __init__(
+        self,
+        checkpoint_dir,
+        prompt_lookup=0,
+        dtype=None,
+        quantize=False,
+        threads=None,
+        interop_threads=None,
+        max_new_tokens=4096,
+    ):
         transformers = importlib.import_module("transformers")
         torch = importlib.import_module("torch")
+        self.model_id = os.path.abspath(checkpoint_dir)
+        self.dtype = dtype
+        self.quantize = quantize
+
+        if quantize and dtype not in (None, "float32"):
+            raise ValueError(
+                f"Dynamic int8 quantization needs float32 weights, not {dtype}"
+            )
+
+        # Thread counts only take effect before the first parallel region
+        if interop_threads:
+            torch.set_num_interop_threads(interop_threads)
+        if threads:
+            torch.set_num_threads(threads)
 
         self.tokenizer = transformers.AutoTokenizer.from_pretrained(checkpoint_dir)
         self.pipeline = transformers.pipeline(
             "text-generation",
             model=checkpoint_dir,
-            # torch_dtype=torch.float16,
+            torch_dtype=getattr(torch, dtype) if dtype else None,
             device=-1,
         )
 
-        self.max_new_tokens = 4096
+        # Weights of linear layers are stored in int8 and activations are
+        # quantized on the fly, which needs no calibration data
+        if quantize:
+            self.pipeline.model = torch.ao.quantization.quantize_dynamic(
+                self.pipeline.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+
+        # Left padding keeps prompts aligned for batched generation
+        self.pipeline.tokenizer.padding_side = "left"
+        if self.pipeline.tokenizer.pad_token is None:
+            self.pipeline.tokenizer.pad_token = self.pipeline.tokenizer.eos_token
+
+        self.max_new_tokens = max_new_tokens
         self.batch_size = 8
         self.max_length = None
 
+        # Prompt lookup decoding proposes up to prompt_lookup tokens that
+        # continue an n-gram of the prompt, mostly from the draft, and the
+        # model accepts those that match its own greedy choice in one pass
+        self.prompt_lookup = prompt_lookup
+        self.context_length = getattr(
+            self.pipeline.model.config,
+            "max_position_embeddings",
+            self.tokenizer.model_max_length,
+        )
+
+        # KV cache of the seed prompt, reused by every prompt built from it
+        self.prefix_ids = None
+        self.prefix_cache = None
+        self.prefix_text = None
+        self.prefix_stats = lib.PrefixCacheStats()
+
+        # Local model, requests are processed one at a time
+        self.limiter = lib.RateLimiter(max_concurrency=1)
+        self.max_retries = 0
+
+    def set_prompt_prefix(self, chat_template):
+        """
+        Compute the KV cache of the seed chat template once. Prompts that
+        start with the rendered seed then only run the model over the tokens
+        of the source and draft that follow it.
+        """
+        transformers = importlib.import_module("transformers")
+        torch = importlib.import_module("torch")
+
+        # The prefix ends where per-file content is appended to the last
+        # message, which is found with a marker in the rendered template
+        marker = "\x00code-scribe-prefix\x00"
+        template = copy.deepcopy(chat_template)
+        template[-1]["content"] += marker
+        rendered = self.tokenizer.apply_chat_template(template, tokenize=False)
+        prefix = rendered[: rendered.index(marker)]
+
+        # The KV cache is kept while the seed is the same, such as over the
+        # rounds of claims of a distributed run
+        if self.prefix_cache is not None and prefix == self.prefix_text:
+            return
+        self.prefix_text = prefix
+
+        # The last token can merge with the text that follows it
+        self.prefix_ids = self.tokenizer(
+            prefix, add_special_tokens=False, return_tensors="pt"
+        ).input_ids[:, :-1]
+
+        with torch.no_grad():
+            self.prefix_cache = self.pipeline.model(
+                self.prefix_ids.to(self.pipeline.model.device),
+                past_key_values=transformers.DynamicCache(),
+                use_cache=True,
+            ).past_key_values
+
+    def _generate(self, chat_template, streamer=None):
+        """
+        Generate a response with the model, reusing a copy of the prefix
+        KV cache when the tokens of the prompt start with the prefix.
+        """
+        torch = importlib.import_module("torch")
+
+        input_ids = self.tokenizer.apply_chat_template(
+            chat_template,
+            add_generation_prompt=True,
+            return_tensors="pt",
+            return_dict=True,
+        )["input_ids"]
+        length = self.prefix_ids.shape[1]
+
+        cache = None
+        if input_ids.shape[1] > length and torch.equal(
+            input_ids[0, :length], self.prefix_ids[0]
+        ):
+            cache = copy.deepcopy(self.prefix_cache)
+        self.prefix_stats.record(input_ids.shape[1], length if cache else 0)
+
+        input_ids = input_ids.to(self.pipeline.model.device)
+        with torch.no_grad():
+            output = self.pipeline.model.generate(
+                input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=cache,
+                max_new_tokens=self.max_new_tokens,
+                max_length=self.max_length,
+                eos_token_id=self.tokenizer.eos_token_id,
+                pad_token_id=50256,
+                streamer=streamer,
+                **self.generate_options(),
+            )
+
+        return self.tokenizer.decode(
+            output[0, input_ids.shape[1] :], skip_special_tokens=True
+        )
+
+    def generate_options(self):
+        """Optional keyword arguments of generate."""
+        if self.prompt_lookup:
+            return {"prompt_lookup_num_tokens": self.prompt_lookup}
+        return {}
+
     def chat(self, chat_template):
+        if self.prefix_cache is not None:
+            return self._generate(chat_template)
 
         results = self.pipeline(
             chat_template,
@@ -93,184 +611,1078 @@ class TFModel:
             # do_sample=True,
             eos_token_id=self.tokenizer.eos_token_id,
             pad_token_id=50256,
+            **self.generate_options(),
         )
 
         return results[0]["generated_text"][-1]["content"]
 
+    def chat_batch(self, chat_templates):
+
+        # Prompt lookup decoding only supports one prompt at a time
+        if self.prompt_lookup:
+            return [self.chat(template) for template in chat_templates]
 
-def prompt_translate(mapping, seed_prompt, model=None, save_prompts=False):
+        results = self.pipeline(
+            chat_templates,
+            max_new_tokens=self.max_new_tokens,
+            max_length=self.max_length,
+            batch_size=self.batch_size,
+            eos_token_id=self.tokenizer.eos_token_id,
+            pad_token_id=50256,
+        )
+
+        return [result[0]["generated_text"][-1]["content"] for result in results]
+
+    def stream(self, chat_template):
+        transformers = importlib.import_module("transformers")
+        streamer = transformers.TextIteratorStreamer(
+            self.tokenizer, skip_prompt=True, skip_special_tokens=True
+        )
+
+        errors = []
+
+        def _generate():
+            try:
+                if self.prefix_cache is not None:
+                    self._generate(chat_template, streamer)
+                else:
+                    self.pipeline(
+                        chat_template,
+                        max_new_tokens=self.max_new_tokens,
+                        max_length=self.max_length,
+                        eos_token_id=self.tokenizer.eos_token_id,
+                        pad_token_id=50256,
+                        streamer=streamer,
+                        **self.generate_options(),
+                    )
+            except BaseException as error:
+                # End the stream, or the loop below waits for text forever
+                errors.append(error)
+                streamer.end()
+
+        # Generation runs in a separate thread and hands
+        # decoded text to the streamer as tokens are produced
+        thread = threading.Thread(target=_generate)
+        thread.start()
+
+        for text in streamer:
+            yield text
+
+        thread.join()
+
+        if errors:
+            raise errors[0]
+
+    def count_tokens(self, text):
+        return len(self.tokenizer.encode(text))
+
+    def signature(self):
+        signature = {
+            "backend": "transformers",
+            "model": self.model_id,
+            "max_new_tokens": self.max_new_tokens,
+            "max_length": self.max_length,
+        }
+
+        # Reduced precision changes responses, full precision keeps the
+        # signature of earlier releases so that their cache stays valid
+        if self.dtype not in (None, "float32"):
+            signature["dtype"] = self.dtype
+        if self.quantize:
+            signature["quantize"] = "int8"
+
+        return signature
+
+
+# Options that apply to API models, all other options are for local models
+REMOTE_OPTIONS = ("requests_per_minute",)
+
+
+def load_model(model, **options):
     """
-    perform translation using prompts and the supplied model.
+    Create a neural model from a model name or checkpoint path. Objects
+    that already provide a chat method, like a local stub, are returned as is.
+    Options are passed to local models loaded from a checkpoint path, and
+    REMOTE_OPTIONS to API models.
     """
+    if hasattr(model, "chat"):
+        return model
 
-    neural_model = None
+    remote = [name for name in options if name in REMOTE_OPTIONS]
+    local = [name for name in options if name not in REMOTE_OPTIONS]
 
-    if model:
-        print("Starting neural conversion process")
+    if os.path.exists(model):
+        if remote:
+            raise ValueError(
+                f"Options {', '.join(remote)} are only available for API models"
+            )
+        return TFModel(model, **options)
 
-        if os.path.exists(model):
-            neural_model = TFModel(model)
+    elif local:
+        raise ValueError(
+            f"Options {', '.join(local)} are only available for local models"
+        )
 
-        elif model.lower() == "openai":
-            neural_model = OpenAIModel()
+    elif model.lower().split(":")[0] == "openai":
+        return OpenAIModel(*model.split(":", 1)[1:], **options)
 
-        else:
-            raise ValueError(f"{model} not available")
+    elif model.lower().split(":")[0] == "openai-async":
+        return AsyncOpenAIModel(*model.split(":", 1)[1:], **options)
 
-    if save_prompts:
-        print("Saving custom prompts per file")
+    else:
+        raise ValueError(f"{model} not available")
 
-    chat_template = toml.load(seed_prompt)["chat"]
 
-    with alive_bar(len(mapping[0]), bar="blocks") as bar:
+def model_chat(neural_model, chat_template):
+    """
+    Send a chat template to the model respecting its rate limit and retry policy.
+    """
+    limiter = getattr(neural_model, "limiter", None) or lib.RateLimiter()
+    retries = getattr(neural_model, "max_retries", 0)
+    retry_on = getattr(neural_model, "retry_errors", (Exception,))
 
-        for fsource, csource, finterface, cdraft, promptfile in zip(
-            mapping[0], mapping[1], mapping[2], mapping[3], mapping[4]
-        ):
+    def _chat():
+        with limiter:
+            return neural_model.chat(chat_template)
 
-            bar.text(fsource)
-            bar()
+    return lib.retry_call(_chat, retries=retries, retry_on=retry_on)
 
-            if not os.path.isfile(csource) or save_prompts:
-                cached_prompt = chat_template[-1]["content"]
 
-                with open(fsource, "r") as sfile:
-                    is_comment = False
-                    source_code = []
+def model_stream(neural_model, chat_template):
+    """
+    Yield generated text from the model as it arrives. Backends without
+    streaming support yield the full response at once. Failed requests
+    are retried only until the first text has arrived.
+    """
+    if not hasattr(neural_model, "stream"):
+        yield model_chat(neural_model, chat_template)
+        return
 
-                    for line in sfile.readlines():
-                        is_comment = False
+    limiter = getattr(neural_model, "limiter", None) or lib.RateLimiter()
+    retries = getattr(neural_model, "max_retries", 0)
+    retry_on = getattr(neural_model, "retry_errors", (Exception,))
 
-                        if line.strip().lower().startswith(("c", "!!", "!")) and (
-                            not line.strip().lower().startswith(("complex"))
-                        ):
-                            is_comment = True
+    def _start():
+        iterator = iter(neural_model.stream(chat_template))
+        return iterator, next(iterator, "")
 
-                        if not is_comment:
-                            source_code.append(line)
+    with limiter:
+        iterator, text = lib.retry_call(_start, retries=retries, retry_on=retry_on)
+        yield text
 
-                    if source_code:
-                        chat_template[-1]["content"] += (
-                            "\n" + "<source>\n" + "".join(source_code) + "</source>"
-                        )
+        for text in iterator:
+            yield text
 
-                if os.path.isfile(cdraft):
 
-                    draft_code = []
-                    with open(cdraft) as dfile:
-                        for line in dfile.readlines():
-                            draft_code.append(line)
+def model_chat_batch(neural_model, chat_templates):
+    """
+    Send a batch of chat templates to the model in a single call when
+    the backend supports it, otherwise fall back to one call per template.
 
-                        if draft_code:
-                            chat_template[-1]["content"] += (
-                                "\n\n" + "<draft>\n" + "".join(draft_code) + "</draft>"
-                            )
+    A template that fails has its exception in place of its response. When
+    a batched call fails as a whole, its templates are sent one at a time,
+    so that one bad prompt does not fail the others.
+    """
 
-                if save_prompts:
-                    with open(promptfile, "w") as pdest:
-                        # for instance in chat_template:
-                        #    pdest.write("[[chat]]\n")
-                        #    pdest.write(f'role = "{instance["role"]}"\n')
-                        #    pdest.write(f'content = """\n{instance["content"]}"""\n\n')
-                        json.dump(chat_template, pdest, indent=4)
-                    print(f"Generated prompt file for LLM consumption {promptfile}")
+    def _chat_each():
+        results = []
+        for template in chat_templates:
+            try:
+                results.append(model_chat(neural_model, template))
+            except Exception as error:
+                results.append(error)
+        return results
 
-                if neural_model:
-                    result = neural_model.chat(chat_template)
+    if len(chat_templates) == 1 or not hasattr(neural_model, "chat_batch"):
+        return _chat_each()
 
-                    with open(csource, "w") as cdest, open(finterface, "w") as fdest:
+    limiter = getattr(neural_model, "limiter", None) or lib.RateLimiter()
+    retries = getattr(neural_model, "max_retries", 0)
+    retry_on = getattr(neural_model, "retry_errors", (Exception,))
 
-                        csource = re.search(
-                            r"<csource>(.*?)</csource>", result, re.DOTALL
-                        )
-                        fsource = re.search(
-                            r"<fsource>(.*?)</fsource>", result, re.DOTALL
-                        )
+    def _chat_batch():
+        with limiter:
+            return neural_model.chat_batch(chat_templates)
+
+    try:
+        return lib.retry_call(_chat_batch, retries=retries, retry_on=retry_on)
+    except Exception:
+        return _chat_each()
 
-                        if csource:
-                            cdest.write(csource.group(1))
-                        else:
-                            cdest.write(result)
 
-                        if fsource:
-                            fdest.write(fsource.group(1))
+def count_tokens(neural_model, text):
+    """
+    Count tokens using the backend tokenizer, or estimate them
+    at four characters per token if the backend has none.
+    """
+    if hasattr(neural_model, "count_tokens"):
+        return neural_model.count_tokens(text)
+
+    return len(text) // 4
 
-                chat_template[-1]["content"] = cached_prompt
 
+def create_batches(neural_model, chat_templates, batch_size):
+    """
+    Group chat templates into batches of indices. Templates are sorted by
+    prompt length so that each batch carries as little padding as possible.
+    """
+    if batch_size <= 1:
+        return [[index] for index in range(len(chat_templates))]
+
+    lengths = [
+        count_tokens(neural_model, "".join(message["content"] for message in template))
+        for template in chat_templates
+    ]
+    order = sorted(range(len(chat_templates)), key=lambda index: lengths[index])
+
+    return [
+        order[start : start + batch_size] for start in range(0, len(order), batch_size)
+    ]
+
+
+def generate_responses(
+    neural_model,
+    chat_templates,
+    jobs=1,
+    batch_size=1,
+    cache=None,
+    on_result=None,
+    on_progress=None,
+    on_token=None,
+    on_start=None,
+    on_error=None,
+):
+    """
+    Generate responses for a list of chat templates and return them in order.
+
+    Cached responses are reused, and the remaining templates are grouped into
+    batches with up to jobs batches in flight. on_progress(index) is called as
+    soon as a response is available, and on_result(index, result) is called in
+    the order of chat_templates once all preceding responses are available.
+    When on_token is supplied, responses are streamed one template at a time
+    and on_token(index, text) is called from the worker thread as text arrives.
+
+    on_start(index) is called from the worker thread when a request is sent.
+    When on_error is supplied, a failed request calls on_error(index, error)
+    and leaves its response as None instead of stopping the remaining ones.
+    """
+    responses = [None] * len(chat_templates)
+    keys = [None] * len(chat_templates)
+    available = set()
+    failed = set()
+    next_index = 0
+
+    def _complete(index, result):
+        nonlocal next_index
+
+        responses[index] = result
+        available.add(index)
+
+        if on_progress:
+            on_progress(index)
+
+        while next_index in available:
+            if on_result and next_index not in failed:
+                on_result(next_index, responses[next_index])
+            next_index += 1
+
+    misses = []
+    with lib.span("cache_lookup", templates=len(chat_templates)):
+        for index, template in enumerate(chat_templates):
+            if cache:
+                keys[index] = cache.key(neural_model, template)
+                result = cache.get(keys[index])
+                if result is not None:
+                    _complete(index, result)
+                    continue
+            misses.append(index)
+
+    if cache:
+        print(
+            f"Response cache: {len(chat_templates) - len(misses)} hits, {len(misses)} misses"
+        )
+
+    if not misses:
+        return responses
+
+    batches = [
+        [misses[i] for i in batch]
+        for batch in create_batches(
+            neural_model,
+            [chat_templates[i] for i in misses],
+            1 if on_token else batch_size,
+        )
+    ]
+
+    def _generate(batch):
+        if on_start:
+            for index in batch:
+                on_start(index)
+
+        with lib.span("generate", batch=len(batch)):
+            if not on_token:
+                results = model_chat_batch(
+                    neural_model, [chat_templates[i] for i in batch]
+                )
             else:
-                continue
+                (index,) = batch
+                text = []
+                for token in model_stream(neural_model, chat_templates[index]):
+                    text.append(token)
+                    on_token(index, token)
+                results = ["".join(text)]
+
+        # Estimate usage for backends that do not report it with responses
+        if lib.get_profiler() and not getattr(neural_model, "reports_usage", False):
+            model_id = getattr(neural_model, "model_id", type(neural_model).__name__)
+            for index, result in zip(batch, results):
+                if isinstance(result, BaseException):
+                    continue
+                lib.record_usage(
+                    model_id,
+                    count_tokens(
+                        neural_model,
+                        "".join(
+                            message["content"] for message in chat_templates[index]
+                        ),
+                    ),
+                    count_tokens(neural_model, result),
+                )
+
+        return results
+
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    # An asynchronous backend keeps requests in flight together on its own
+    # event loop, so every batch is handed to it at once and its adaptive
+    # limiter rather than jobs bounds the concurrency
+    workers = max(1, jobs)
+    if hasattr(neural_model, "rate_limiter"):
+        workers = max(
+            workers, min(len(batches), neural_model.rate_limiter.max_concurrency)
+        )
+
+    start_time = time.perf_counter()
+    generated_tokens = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_generate, batch): batch for batch in batches}
+
+        try:
+            for future in as_completed(futures):
+                if on_error and future.exception():
+                    for index in futures[future]:
+                        failed.add(index)
+                        on_error(index, future.exception())
+                        _complete(index, None)
+                    continue
+
+                for index, result in zip(futures[future], future.result()):
+                    if isinstance(result, BaseException):
+                        if not on_error:
+                            raise result
+                        failed.add(index)
+                        on_error(index, result)
+                        _complete(index, None)
+                        continue
+
+                    generated_tokens += count_tokens(neural_model, result)
+                    if cache:
+                        cache.put(keys[index], result)
+                    _complete(index, result)
+
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"Generated {generated_tokens} tokens in {elapsed:.2f}s "
+        + f"({generated_tokens / max(elapsed, 1e-9):.2f} tokens/sec)"
+    )
 
+    return responses
 
-def prompt_inspect(
-    filelist, query_prompt, file_index={}, model=None, save_prompts=False
+
+def build_translate_prompt(chat_template, fsource, cdraft, interfaces=()):
+    """
+    Return a copy of the seed chat template with the source code
+    and draft appended to the last message. The contents of the files in
+    interfaces, generated interfaces of dependencies, are appended within
+    <interfaces> elements.
+
+    Per-file content only ever follows the seed, which stays a byte-stable
+    prefix of every prompt for prompt caching of the API and the prefix
+    KV cache of local models.
+
+    Files are read one line at a time into joined chunks and the message
+    is joined once, so that large sources are not copied on every append.
+    """
+    chat_template = copy.deepcopy(chat_template)
+    content = [chat_template[-1]["content"]]
+
+    with open(fsource, "r") as sfile:
+        source_code = lib.join_lines(
+            line for line in sfile if not lib.is_comment(line.strip())
+        )
+
+    if source_code:
+        content.append("\n" + "<source>\n")
+        content.extend(source_code)
+        content.append("</source>")
+
+    if os.path.isfile(cdraft):
+        with open(cdraft, "r") as dfile:
+            draft_code = lib.join_lines(dfile)
+
+        if draft_code:
+            content.append("\n\n" + "<draft>\n")
+            content.extend(draft_code)
+            content.append("</draft>")
+
+    content.append(interfaces_block(interfaces))
+
+    chat_template[-1]["content"] = "".join(content)
+
+    return chat_template
+
+
+def interfaces_block(interfaces):
+    """Generated interfaces of existing files within <interfaces> elements."""
+    interface_code = []
+    for interface in interfaces:
+        if os.path.isfile(interface):
+            with open(interface, "r") as ifile:
+                interface_code.extend(
+                    [f"<{interface}>\n", ifile.read(), f"</{interface}>\n"]
+                )
+
+    if not interface_code:
+        return ""
+
+    return "\n\n" + "<interfaces>\n" + "".join(interface_code) + "</interfaces>"
+
+
+def fit_interfaces(neural_model, chat_template, fsource, cdraft, interfaces):
+    """
+    Interfaces that fit into the prompt budget of the model along with the
+    prompt of a file, in order. Interfaces that do not fit are left out with
+    a warning, and all are kept for models without a known budget.
+    """
+    budget = lib.token_budget(neural_model)
+    if not budget or not interfaces:
+        return list(interfaces)
+
+    template = build_translate_prompt(chat_template, fsource, cdraft)
+    used = count_tokens(
+        neural_model, "".join(message["content"] for message in template)
+    )
+    fitted = []
+
+    for interface in interfaces:
+        tokens = count_tokens(neural_model, interfaces_block([interface]))
+        if used + tokens > budget[2]:
+            print(
+                f"Warning: leaving out interface {interface} of {fsource}, "
+                + f"the prompt would need {used + tokens} tokens, "
+                + f"over the budget of {budget[2]}"
+            )
+            continue
+
+        fitted.append(interface)
+        used += tokens
+
+    return fitted
+
+
+def split_draft_file(cdraft):
+    """
+    Split a draft file into chunks with lib.split_fortran_file, keyed by
+    construct type and lowercase name. The scribe-prompt instructions and
+    includes at the top of the draft apply to every chunk and are returned
+    as the preamble.
+    """
+    chunks = lib.split_fortran_file(cdraft)
+    preamble = []
+
+    if chunks:
+        lines = chunks[0]["lines"]
+        while lines and (
+            not lines[0].strip()
+            or lines[0].startswith("scribe-prompt:")
+            or lines[0].startswith("#")
+        ):
+            preamble.append(lines.pop(0))
+
+    return preamble, {
+        (chunk["type"], str(chunk["name"]).lower()): chunk["lines"] for chunk in chunks
+    }
+
+
+def build_chunk_prompts(chat_template, fsource, cdraft, interfaces=()):
+    """
+    Return one copy of the seed chat template per construct of a file from
+    lib.split_fortran_file, or None if the file has a single construct.
+    Procedures of a module get the specification part of the module within
+    <context> elements. When the draft file of the source exists, each chunk
+    gets its construct of the draft, along with the instructions and
+    includes at the top of the draft.
+    """
+    chunks = lib.split_fortran_file(fsource)
+
+    if len(chunks) < 2:
+        return None
+
+    modules = {chunk["name"]: chunk for chunk in chunks if chunk["type"] == "module"}
+    interface_code = interfaces_block(interfaces)
+    drafts = split_draft_file(cdraft) if os.path.isfile(cdraft) else None
+    templates = []
+
+    for chunk in chunks:
+        template = copy.deepcopy(chat_template)
+        content = [template[-1]["content"]]
+
+        source_code = [
+            line for line in chunk["lines"] if not lib.is_comment(line.strip())
+        ]
+
+        if source_code:
+            content.append("\n" + "<source>\n")
+            content.extend(source_code)
+            content.append("</source>")
+
+        if drafts is not None:
+            preamble, draft_chunks = drafts
+            draft_code = draft_chunks.get((chunk["type"], str(chunk["name"]).lower()))
+
+            # Constructs that are missing from the draft are converted here
+            if draft_code is None:
+                preamble = list(preamble)
+                draft_code = []
+                for line in source_code:
+                    header, text = lib.draft_statement(line)
+                    if header and header + "\n" not in preamble:
+                        preamble.append(header + "\n")
+                    draft_code.append(text)
+
+            content.append("\n\n" + "<draft>\n")
+            content.extend(preamble)
+            content.extend(draft_code)
+            content.append("</draft>")
+
+        module = modules.get(chunk["module"])
+        if module:
+            content.append("\n\n" + "<context>\n")
+            content.extend(
+                line for line in module["lines"] if not lib.is_comment(line.strip())
+            )
+            content.append("</context>")
+
+        content.append(interface_code)
+        content.append(
+            f"\n\nThe code within <source> is the {chunk['type']} {chunk['name']} "
+            + f"of {fsource}, which is translated one construct at a time. "
+            + "Translate only this construct."
+        )
+        if module:
+            content.append(
+                f" The specification part of module {module['name']} "
+                + "is given within <context> for reference."
+            )
+
+        template[-1]["content"] = "".join(content)
+        templates.append(template)
+
+    return templates
+
+
+def build_file_prompts(chat_template, fsource, cdraft, interfaces=(), chunk=False):
+    """
+    Chat templates that translate a file, one per chunk with chunk=True
+    and a single one otherwise or for files with only one construct.
+    """
+    with lib.span("build_prompt", file=fsource):
+        file_templates = None
+        if chunk:
+            file_templates = build_chunk_prompts(
+                chat_template, fsource, cdraft, interfaces
+            )
+        if not file_templates:
+            file_templates = [
+                build_translate_prompt(chat_template, fsource, cdraft, interfaces)
+            ]
+
+    return file_templates
+
+
+def is_translated(fsource, csource, records=None):
+    """
+    Check if a file has been translated. With the journal records of a
+    resumed run, files with a record are translated only if their last
+    state is done.
+    """
+    if records and fsource in records:
+        return records[fsource]["state"] == "done" and os.path.isfile(csource)
+
+    # A leftover partial stream means the previous run did not finish
+    return os.path.isfile(csource) and not os.path.isfile(csource + ".partial")
+
+
+def stitch_translations(results):
+    """
+    Combine the results of translating the chunks of a file, in order,
+    into a single result with one <csource> and one <fsource> element.
+    """
+    csource_code = []
+    finterface_code = []
+
+    for result in results:
+        cmatch = re.search(r"<csource>(.*?)</csource>", result, re.DOTALL)
+        fmatch = re.search(r"<fsource>(.*?)</fsource>", result, re.DOTALL)
+
+        csource_code.append(cmatch.group(1) if cmatch else result)
+        if fmatch:
+            finterface_code.append(fmatch.group(1))
+
+    return (
+        "<csource>"
+        + "\n".join(csource_code)
+        + "</csource>\n<fsource>"
+        + "\n".join(finterface_code)
+        + "</fsource>"
+    )
+
+
+def write_translation(result, csource, finterface):
+    """
+    Extract <csource> and <fsource> elements from a model
+    result and write them to their destination files. A .partial
+    stream left by an earlier run is removed once both are written.
+    """
+    with lib.span("parse_output"):
+        cmatch = re.search(r"<csource>(.*?)</csource>", result, re.DOTALL)
+        fmatch = re.search(r"<fsource>(.*?)</fsource>", result, re.DOTALL)
+
+    # The interface is written first, since an existing csource marks
+    # the file as translated
+    with lib.span("write_output", file=csource):
+        lib.atomic_write(finterface, fmatch.group(1) if fmatch else "")
+        lib.atomic_write(csource, cmatch.group(1) if cmatch else result)
+
+    if os.path.isfile(csource + ".partial"):
+        os.remove(csource + ".partial")
+
+
+class StreamWriter:
+    """
+    Write a streamed translation to disk while it is generated. The raw
+    stream is appended to a .partial file so that a crash keeps partial
+    work, and the <csource> and <fsource> elements are written to their
+    destination files as soon as each one is complete.
+    """
+
+    def __init__(self, csource, finterface):
+        self.csource = csource
+        self.finterface = finterface
+        self.partial = csource + ".partial"
+        self.chunks = []
+        self.written = set()
+        self.stream = None
+
+    def feed(self, text):
+        """Append streamed text and write completed elements."""
+        if self.stream is None:
+            self.stream = open(self.partial, "w")
+
+        self.chunks.append(text)
+        self.stream.write(text)
+        self.stream.flush()
+
+        if ">" not in text:
+            return
+
+        result = "".join(self.chunks)
+        for tag, destination in (
+            ("csource", self.csource),
+            ("fsource", self.finterface),
+        ):
+            if tag not in self.written:
+                match = re.search(rf"<{tag}>(.*?)</{tag}>", result, re.DOTALL)
+                if match:
+                    lib.atomic_write(destination, match.group(1))
+                    self.written.add(tag)
+
+    def close(self, result):
+        """Write the complete result and remove the partial stream."""
+        try:
+            if self.written != {"csource", "fsource"}:
+                write_translation(result, self.csource, self.finterface)
+        except BaseException:
+            self.abort()
+            raise
+
+        if self.stream is not None:
+            self.stream.close()
+            if os.path.isfile(self.partial):
+                os.remove(self.partial)
+
+    def abort(self):
+        """Close the partial stream after a failure and keep it on disk."""
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+def prompt_translate(
+    mapping,
+    seed_prompt,
+    model=None,
+    save_prompts=False,
+    jobs=1,
+    batch_size=1,
+    cache=None,
+    stream=False,
+    schedule=False,
+    resume=False,
+    chunk=False,
+    journal_path=None,
 ):
     """
-    Perform inspect on a list of files using a query prompt
+    perform translation using prompts and the supplied model. The seed_prompt
+    is the path of a seed prompt file, or its loaded chat template. With jobs > 1
+    up to jobs requests are kept in flight, while outputs are still written
+    in the order of the mapping. With batch_size > 1 prompts of similar length
+    are grouped into a single generation call. Responses are reused from
+    and stored to cache, a lib.ResponseCache, when supplied. With stream=True
+    output sections are written to disk as soon as they are generated.
+
+    With schedule=True files are translated in waves of the use/call
+    dependency graph, and the prompt of each file includes the generated
+    code of the files it depends on.
+
+    With a model, the state of each file is recorded in a lib.JobJournal at
+    journal_path. With resume=True the journal of the previous run is kept
+    and only files that did not finish in it are translated again.
+
+    With chunk=True files with several constructs are split per module,
+    subroutine, and function. The chunks are translated in parallel with
+    the specification part of their module as context, cached one chunk
+    at a time, and stitched back in source order into one output.
+
+    Returns the number of files in each state of the journal, or None
+    without a model.
     """
+
     neural_model = None
 
     if model:
-        print("Performing neural inspection")
+        print("Starting neural conversion process")
+        with lib.span("load_model"):
+            neural_model = load_model(model)
 
-        if os.path.exists(model):
-            neural_model = TFModel(model)
+    if save_prompts:
+        print("Saving custom prompts per file")
 
-        elif model.lower() == "openai":
-            neural_model = OpenAIModel()
+    import toml
+    from alive_progress import alive_bar
 
-        else:
-            raise ValueError(f"{model} not available")
+    with lib.span("load_seed_prompt"):
+        chat_template = (
+            toml.load(seed_prompt)["chat"]
+            if isinstance(seed_prompt, str)
+            else seed_prompt
+        )
 
-    if save_prompts:
-        print("Saving prompts to scribe.json")
+    if hasattr(neural_model, "set_prompt_prefix"):
+        with lib.span("prompt_prefix"):
+            neural_model.set_prompt_prefix(chat_template)
 
-    chat_template = [{"role": "user", "content": ""}]
-
-    chat_template[-1]["content"] += (
-        "I will give you source code from a set of files that\n"
-        + "belong to a scientific computing codebase. I want you\n"
-        + "to understand the source code and answer a query that\n"
-        + "follows. Source code for each will be separated using\n"
-        + "elements <filename> ... </filename>. Additional\n"
-        + "information related to the project structure may also be\n"
-        + "provided within <index> ... </index>. This information will\n"
-        + "contain an index of subroutines, functions, and modules contained\n"
-        + "in each file. Note that you will find subroutines and functions\n"
-        + "repeat along nodes in the directory tree. This maybe due to a directory-based\n"
-        + "inheritance design implemented by the project. If the index element is not\n"
-        + "present, then you may ignore it. The query prompt will be provided at the end\n"
-        + "using elements <query> ... </query>.\n\n"
+    journal = (
+        lib.JobJournal(journal_path or lib.JOURNAL_NAME, resume=resume)
+        if neural_model
+        else None
     )
 
-    filtered_file_index = {}
-    for fsource in filelist:
+    tasks = list(zip(mapping[0], mapping[1], mapping[2], mapping[3], mapping[4]))
+    waves = [tasks]
+    dependencies = {}
+
+    if schedule:
+        with lib.span("dependency_graph"):
+            graph = lib.dependency_graph(mapping[0])
+            file_waves, critical_path = lib.topological_waves(graph)
+
+        # Prompts get the Fortran interfaces of dependencies rather than
+        # their generated code, which can be many times larger
+        finterfaces = dict(zip(mapping[0], mapping[2]))
+        dependencies = {
+            fsource: [finterfaces[dependency] for dependency in sorted(graph[fsource])]
+            for fsource in graph
+        }
+
+        tasks_by_file = {task[0]: task for task in tasks}
+        waves = [[tasks_by_file[fsource] for fsource in wave] for wave in file_waves]
+
+        print(
+            f"Dependency schedule: {len(tasks)} file(s) in {len(waves)} wave(s), "
+            + f"widest wave {max((len(wave) for wave in waves), default=0)} file(s)"
+        )
+        print(
+            f"Critical path: {len(critical_path)} file(s) " + " -> ".join(critical_path)
+        )
 
-        if file_index:
-            filtered_file_index.update(lib.filter_file_indexes(fsource, file_index))
+    with alive_bar(len(tasks), bar="blocks", file=sys.stdout) as bar:
+
+        for iwave, wave in enumerate(waves):
+
+            pending = []
+
+            for fsource, csource, finterface, cdraft, promptfile in wave:
+
+                if save_prompts or not is_translated(
+                    fsource, csource, journal.records if resume else None
+                ):
+                    interfaces = fit_interfaces(
+                        neural_model,
+                        chat_template,
+                        fsource,
+                        cdraft,
+                        dependencies.get(fsource, ()),
+                    )
+                    file_templates = build_file_prompts(
+                        chat_template, fsource, cdraft, interfaces, chunk
+                    )
+
+                    if save_prompts:
+                        with open(promptfile, "w") as pdest:
+                            json.dump(
+                                (
+                                    file_templates[0]
+                                    if len(file_templates) == 1
+                                    else file_templates
+                                ),
+                                pdest,
+                                indent=4,
+                            )
+                        print(f"Generated prompt file for LLM consumption {promptfile}")
 
-        with open(fsource, "r") as sfile:
-            source_code = []
+                    if neural_model:
+                        pending.append((fsource, csource, finterface, file_templates))
+                        journal.record(fsource, "pending")
+                        continue
 
-            for line in sfile.readlines():
-                source_code.append(line)
+                bar.text(fsource)
+                bar()
 
-        if source_code:
-            chat_template[-1]["content"] += (
-                "\n" + f"<{fsource}>\n" + "".join(source_code) + f"</{fsource}>\n"
+            if not pending:
+                continue
+
+            # Chunks of all files are generated together, owners maps each
+            # template back to its file and results are kept until the last
+            # chunk of a file is available
+            templates = []
+            owners = []
+            for ifile, (_, _, _, file_templates) in enumerate(pending):
+                templates.extend(file_templates)
+                owners.extend((ifile, ichunk) for ichunk in range(len(file_templates)))
+
+            results = [[None] * len(task[-1]) for task in pending]
+            remaining = [len(task[-1]) for task in pending]
+            failed = set()
+
+            writers = [
+                (
+                    StreamWriter(csource, finterface)
+                    if stream and len(file_templates) == 1
+                    else None
+                )
+                for _, csource, finterface, file_templates in pending
+            ]
+
+            started = {}
+            finished = {}
+
+            def _start(index):
+                ifile, _ = owners[index]
+                if ifile not in started:
+                    started[ifile] = time.perf_counter()
+                    journal.record(pending[ifile][0], "in-flight")
+
+            def _write(index, result):
+                ifile, ichunk = owners[index]
+                fsource, csource, finterface, file_templates = pending[ifile]
+                results[ifile][ichunk] = result
+
+                if ifile in failed or ichunk < len(file_templates) - 1:
+                    return
+
+                if len(file_templates) > 1:
+                    result = stitch_translations(results[ifile])
+
+                if writers[ifile]:
+                    with lib.span("write_output", file=csource):
+                        writers[ifile].close(result)
+                else:
+                    write_translation(result, csource, finterface)
+
+                journal.record(
+                    fsource,
+                    "done",
+                    latency=finished[ifile] - started.get(ifile, finished[ifile]),
+                    prompt_tokens=sum(
+                        count_tokens(
+                            neural_model,
+                            "".join(message["content"] for message in template),
+                        )
+                        for template in file_templates
+                    ),
+                    generated_tokens=sum(
+                        count_tokens(neural_model, text) for text in results[ifile]
+                    ),
+                    cached=ifile not in started,
+                )
+
+            def _error(index, error):
+                ifile, _ = owners[index]
+                if ifile in failed:
+                    return
+
+                failed.add(ifile)
+                if writers[ifile]:
+                    writers[ifile].abort()
+
+                now = time.perf_counter()
+                journal.record(
+                    pending[ifile][0],
+                    "failed",
+                    latency=now - started.get(ifile, now),
+                    error=f"{type(error).__name__}: {error}",
+                )
+
+            def _progress(index):
+                ifile, _ = owners[index]
+                remaining[ifile] -= 1
+                if remaining[ifile] == 0:
+                    finished[ifile] = time.perf_counter()
+                    bar.text(pending[ifile][0])
+                    bar()
+
+            def _token(index, text):
+                ifile, _ = owners[index]
+                if writers[ifile]:
+                    writers[ifile].feed(text)
+
+            if schedule:
+                print(f"Wave {iwave + 1} of {len(waves)}: {len(pending)} file(s)")
+
+            generate_responses(
+                neural_model,
+                templates,
+                jobs=jobs,
+                batch_size=batch_size,
+                cache=cache,
+                on_result=_write,
+                on_progress=_progress,
+                on_token=_token if stream else None,
+                on_start=_start,
+                on_error=_error,
             )
 
-    if filtered_file_index:
-        chat_template[-1]["content"] += "<index>\n"
-        for construct, file_path in filtered_file_index.items():
-            chat_template[-1]["content"] += f"{construct}: {file_path}\n"
-        chat_template[-1]["content"] += "</index>\n\n"
+    if hasattr(neural_model, "prefix_stats"):
+        neural_model.prefix_stats.report()
+
+    if journal:
+        journal.close()
+        counts = journal.summary()
+        print(
+            f"Journal {journal.journal_path}: {counts['done']} done, "
+            + f"{counts['failed']} failed, "
+            + f"{counts['pending'] + counts['in-flight']} incomplete"
+        )
+        if counts["failed"]:
+            print("Run translate again with --resume to retry failed files")
+        return counts
+
+
+def prompt_inspect(
+    filelist,
+    query_prompt,
+    file_index={},
+    model=None,
+    save_prompts=False,
+    cache=None,
+    stream=False,
+):
+    """
+    Perform inspect on a list of files using a query prompt. Files are packed
+    into the token budget of the model, and split over several prompts whose
+    answers are combined when they do not fit into one. Responses are reused
+    from and stored to cache when supplied. With stream=True the final answer
+    is printed as it is generated.
+    """
+    neural_model = None
+
+    if model:
+        print("Performing neural inspection")
+        with lib.span("load_model"):
+            neural_model = load_model(model)
+
+    if save_prompts:
+        print("Saving prompts to scribe.json")
+
+    templates, plan = lib.build_inspect_prompts(
+        filelist, query_prompt, file_index, neural_model
+    )
 
-    chat_template[-1]["content"] += "\n" + f"<query>\n" + query_prompt + f"\n</query>\n"
+    if plan["budget"]:
+        print(
+            f"Token budget: {plan['budget']} prompt tokens "
+            + f"({plan['context_length']} context, {plan['reserved']} reserved for generation)"
+        )
+        print(
+            f"Prompt tokens: {sum(plan['prompt_tokens'])} in {len(templates)} prompt(s), "
+            + f"{len(plan['summarized'])} file(s) summarized, "
+            + f"{len(plan['dropped'])} left out"
+        )
 
     if save_prompts:
         with open("scribe.json", "w") as pdest:
-            json.dump(chat_template, pdest, indent=4)
+            json.dump(
+                templates[0] if len(templates) == 1 else templates, pdest, indent=4
+            )
 
     if neural_model:
-        result = neural_model.chat(chat_template)
-        print(result)
+
+        streamed = []
+
+        def _print(index, text):
+            streamed.append(text)
+            print(text, end="", flush=True)
+
+        def _end(index):
+            if streamed:
+                print()
+
+        # Combine answers for each part of the files, in rounds of as many
+        # answers as fit into the budget, until a single answer is left
+        while len(templates) > 1:
+            results = generate_responses(
+                neural_model, templates, jobs=len(templates), cache=cache
+            )
+
+            with lib.span("reduce_prompt"):
+                templates = lib.reduce_templates(
+                    results, query_prompt, neural_model, plan["budget"]
+                )
+
+        (result,) = generate_responses(
+            neural_model,
+            templates,
+            cache=cache,
+            on_progress=_end,
+            on_token=_print if stream else None,
+        )
+
+        if not streamed:
+            print(result)
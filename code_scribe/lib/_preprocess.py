@@ -0,0 +1,345 @@
+import re
+import os
+import json
+import hashlib
+import operator
+
+from code_scribe import lib
+
+FORTRAN_INCLUDE = re.compile(r"""^\s*include\s+['"]([^'"]+)['"]""", re.IGNORECASE)
+CPP_DIRECTIVE = re.compile(r"^\s*#\s*(\w*)\s*(.*?)\s*$")
+CPP_INCLUDE = re.compile(r"""^["<]([^">]+)[">]""")
+CPP_DEFINED = re.compile(r"\bdefined\s*(?:\(\s*(\w+)\s*\)|(\w+))")
+CPP_TOKEN = re.compile(
+    r"\s*(0[xX][0-9a-fA-F]+|\d+|\w+|&&|\|\||==|!=|<=|>=|<<|>>|[-+*/%<>!()~^&|])"
+)
+
+
+def _divide(left, right):
+    # C division truncates towards zero, and division by zero is taken as 0
+    if right == 0:
+        return 0
+    quotient = abs(left) // abs(right)
+    return quotient if (left < 0) == (right < 0) else -quotient
+
+
+# Precedence and function of the binary operators of #if expressions, as in C
+CPP_BINARY = {
+    "||": (1, lambda left, right: int(bool(left or right))),
+    "&&": (2, lambda left, right: int(bool(left and right))),
+    "|": (3, operator.or_),
+    "^": (4, operator.xor),
+    "&": (5, operator.and_),
+    "==": (6, lambda left, right: int(left == right)),
+    "!=": (6, lambda left, right: int(left != right)),
+    "<": (7, lambda left, right: int(left < right)),
+    ">": (7, lambda left, right: int(left > right)),
+    "<=": (7, lambda left, right: int(left <= right)),
+    ">=": (7, lambda left, right: int(left >= right)),
+    "<<": (8, lambda left, right: left << min(max(right, 0), 63)),
+    ">>": (8, lambda left, right: left >> min(max(right, 0), 63)),
+    "+": (9, operator.add),
+    "-": (9, operator.sub),
+    "*": (10, operator.mul),
+    "/": (10, _divide),
+    "%": (10, lambda left, right: left - _divide(left, right) * right if right else 0),
+}
+
+CPP_UNARY = {
+    "!": lambda value: int(not value),
+    "~": operator.invert,
+    "-": operator.neg,
+    "+": operator.pos,
+}
+
+
+def _intmax(value):
+    """Wrap a value around to a signed 64 bit integer, the intmax_t of cpp."""
+    return (value + 2**63) % 2**64 - 2**63
+
+
+def preprocess_options(defines=(), include_dirs=(), cpp=False):
+    """
+    Options of expand_fortran_file from NAME[=VALUE] defines and include
+    directories. Giving defines turns on evaluation of conditionals.
+    """
+    parsed = {}
+    for define in defines:
+        name, _, value = define.partition("=")
+        parsed[name] = value or "1"
+
+    return {
+        "defines": parsed,
+        "include_dirs": [os.path.abspath(directory) for directory in include_dirs],
+        "cpp": bool(cpp or parsed),
+    }
+
+
+def file_stats(paths):
+    """Size and modification time of each file, to detect changes cheaply."""
+    stats = {}
+    for path in paths:
+        stat = os.stat(path)
+        stats[path] = [stat.st_size, stat.st_mtime_ns]
+    return stats
+
+
+def files_unchanged(stats):
+    """Check that files still have the sizes and modification times in stats."""
+    try:
+        return file_stats(stats) == stats
+    except FileNotFoundError:
+        return False
+
+
+def has_directives(filepath):
+    """Check if a file has Fortran include lines or preprocessor directives."""
+    with open(filepath, "r") as source:
+        return any(
+            line.lstrip().startswith("#") or FORTRAN_INCLUDE.match(line)
+            for line in source
+        )
+
+
+def evaluate_condition(expression, defines):
+    """
+    Evaluate the expression of an #if or #elif directive with the precedence
+    of C operators and 64 bit integers. Undefined names are 0, as in cpp,
+    and expressions that cannot be parsed are false.
+    """
+    expression = CPP_DEFINED.sub(
+        lambda match: "1" if (match.group(1) or match.group(2)) in defines else "0",
+        expression.split("//")[0].split("/*")[0],
+    )
+
+    tokens = []
+    position = 0
+    while position < len(expression.rstrip()):
+        match = CPP_TOKEN.match(expression, position)
+        if not match:
+            return False
+        token = match.group(1)
+        position = match.end()
+
+        if token[0].isdigit():
+            token = token.rstrip("uUlL")
+            if token[:2].lower() == "0x":
+                tokens.append(int(token, 16))
+            elif token.startswith("0") and len(token) > 1:
+                tokens.append(int(token, 8))
+            else:
+                tokens.append(int(token))
+        elif token[0].isalpha() or token[0] == "_":
+            value = defines.get(token, "0")
+            tokens.append(int(value) if value.lstrip("-").isdigit() else 0)
+        else:
+            tokens.append(token)
+
+    position = 0
+
+    def _primary():
+        nonlocal position
+        token = tokens[position]
+        position += 1
+
+        if isinstance(token, int):
+            return _intmax(token)
+
+        if token in CPP_UNARY:
+            return _intmax(CPP_UNARY[token](_primary()))
+
+        if token == "(":
+            value = _binary(1)
+            if tokens[position] != ")":
+                raise ValueError(f"Expected ) in {expression}")
+            position += 1
+            return value
+
+        raise ValueError(f"Unexpected {token} in {expression}")
+
+    def _binary(precedence):
+        # Precedence climbing, operators of the same precedence are left associative
+        nonlocal position
+        left = _primary()
+
+        while position < len(tokens) and tokens[position] in CPP_BINARY:
+            operator_precedence, function = CPP_BINARY[tokens[position]]
+            if operator_precedence < precedence:
+                break
+            position += 1
+            left = _intmax(function(left, _binary(operator_precedence + 1)))
+
+        return left
+
+    try:
+        value = _binary(1) if tokens else 0
+    except (ValueError, IndexError, RecursionError):
+        return False
+
+    return bool(value) and position == len(tokens)
+
+
+def resolve_include(name, filepath, include_dirs=()):
+    """Path of an included file in the directory of the includer or include_dirs."""
+    for directory in (os.path.dirname(filepath), *include_dirs):
+        candidate = os.path.join(directory, name)
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def preprocess_lines(
+    filepath, defines=None, include_dirs=(), cpp=False, includes=None, _stack=()
+):
+    """
+    Lines of a Fortran file with Fortran include and #include lines
+    replaced by the lines of the included files, which are appended to
+    includes. Preprocessor directives are dropped. With cpp=True #define
+    and #undef update defines, and only the active branches of #if, #ifdef,
+    #ifndef, #elif, and #else blocks are kept. Macros are not expanded
+    within code lines.
+    """
+    defines = {} if defines is None else defines
+    includes = [] if includes is None else includes
+    stack = (*_stack, os.path.realpath(filepath))
+
+    # Each open conditional is [active before it, a branch has been taken]
+    conditions = []
+    active = True
+
+    def _include(name):
+        path = resolve_include(name, filepath, include_dirs)
+        if path is None or os.path.realpath(path) in stack:
+            return None
+
+        includes.append(path)
+        return preprocess_lines(path, defines, include_dirs, cpp, includes, stack)
+
+    with open(filepath, "r") as source:
+        for line in source:
+            if not line.lstrip().startswith("#"):
+                if not active:
+                    continue
+
+                match = FORTRAN_INCLUDE.match(line)
+                included = _include(match.group(1)) if match else None
+                if included is None:
+                    yield line
+                else:
+                    yield from included
+                continue
+
+            directive, argument = CPP_DIRECTIVE.match(line).groups()
+
+            if directive == "include" and active:
+                match = CPP_INCLUDE.match(argument)
+                included = _include(match.group(1)) if match else None
+                if included is not None:
+                    yield from included
+
+            if not cpp:
+                continue
+
+            if directive in ("if", "ifdef", "ifndef"):
+                if directive == "if":
+                    value = active and evaluate_condition(argument, defines)
+                else:
+                    value = active and (
+                        (argument.split()[0] in defines if argument else False)
+                        == (directive == "ifdef")
+                    )
+                conditions.append([active, value])
+                active = value
+
+            elif directive == "elif" and conditions:
+                parent, taken = conditions[-1]
+                active = parent and not taken and evaluate_condition(argument, defines)
+                conditions[-1][1] = taken or active
+
+            elif directive == "else" and conditions:
+                parent, taken = conditions[-1]
+                active = parent and not taken
+                conditions[-1][1] = True
+
+            elif directive == "endif" and conditions:
+                active = conditions.pop()[0]
+
+            elif directive == "define" and active and argument:
+                name, _, value = argument.partition(" ")
+                if "(" not in name:
+                    defines[name] = value.strip() or "1"
+
+            elif directive == "undef" and active and argument:
+                defines.pop(argument.split()[0], None)
+
+
+def expand_fortran_file(
+    filepath, defines=None, include_dirs=(), cpp=False, cache_dir=None
+):
+    """
+    Expand includes and, with cpp=True, preprocessor conditionals of a
+    Fortran file with preprocess_lines. The expansion is cached per hash of
+    the file path and the options, and reused while the file and the files
+    it includes keep their size and modification time. Files without
+    include lines or directives are returned as they are, without a copy.
+
+    Returns:
+        str: Path of the expanded file, or filepath if nothing was expanded.
+        list: Paths of the included files.
+    """
+    if not has_directives(filepath):
+        return filepath, []
+
+    cache_dir = cache_dir or os.path.join(lib.default_cache_dir(), "preprocess")
+    options = [os.path.abspath(filepath), defines or {}, list(include_dirs), cpp]
+    key = hashlib.sha256(json.dumps(options, sort_keys=True).encode()).hexdigest()
+
+    entry_path = os.path.join(cache_dir, key[:2], key + ".json")
+    expanded_path = os.path.join(
+        cache_dir, key[:2], key + os.path.splitext(filepath)[1]
+    )
+
+    try:
+        with open(entry_path, "r") as entry_file:
+            entry = json.load(entry_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        entry = None
+
+    if entry and files_unchanged(entry["files"]):
+        path = expanded_path if entry["expanded"] else filepath
+        return path, entry["includes"]
+
+    import tempfile
+
+    os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+    includes = []
+
+    with lib.span("preprocess", file=filepath):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path), suffix=".tmp")
+        with os.fdopen(fd, "w") as expanded_file:
+            for line in preprocess_lines(
+                filepath, dict(defines or {}), include_dirs, cpp, includes
+            ):
+                expanded_file.write(line)
+
+        # Lines are only dropped or replaced by includes, so the same size
+        # without includes means that the file is unchanged
+        expanded = bool(includes) or os.path.getsize(tmp_path) != os.path.getsize(
+            filepath
+        )
+        if expanded:
+            os.replace(tmp_path, expanded_path)
+        else:
+            os.remove(tmp_path)
+
+    entry = {
+        "files": file_stats([filepath, *includes]),
+        "includes": includes,
+        "expanded": expanded,
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path), suffix=".tmp")
+    with os.fdopen(fd, "w") as entry_file:
+        json.dump(entry, entry_file)
+    os.replace(tmp_path, entry_path)
+
+    return (expanded_path if expanded else filepath), includes
@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import threading
+import contextlib
+
+
+class Profiler:
+    """
+    Collect timed spans for each stage of a command along with token usage
+    and cost reported by model backends. Spans can be exported as a Chrome
+    trace, which opens in chrome://tracing or https://ui.perfetto.dev.
+    """
+
+    def __init__(self, origin=None):
+        self.events = []
+        self.usage = {}
+
+        # Spans are timed from the origin, which worker processes share with
+        # the profiler of the parent so that their spans line up with its own
+        self.origin = time.perf_counter() if origin is None else origin
+
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        """Time the enclosed block as a span of the named stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            event = {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+            with self._lock:
+                self.events.append(event)
+
+    def add_usage(self, model, prompt_tokens=0, completion_tokens=0, cost=None):
+        """Add prompt and completion tokens and their cost for a model."""
+        with self._lock:
+            usage = self.usage.setdefault(
+                model,
+                {
+                    "requests": 0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "cost": None,
+                },
+            )
+            usage["requests"] += 1
+            usage["prompt_tokens"] += prompt_tokens
+            usage["completion_tokens"] += completion_tokens
+            if cost is not None:
+                usage["cost"] = (usage["cost"] or 0.0) + cost
+
+    def merge(self, events, usage):
+        """Add spans and token usage recorded by the profiler of a worker."""
+        with self._lock:
+            self.events.extend(events)
+            for model, counts in usage.items():
+                total = self.usage.setdefault(
+                    model,
+                    {
+                        "requests": 0,
+                        "prompt_tokens": 0,
+                        "completion_tokens": 0,
+                        "cost": None,
+                    },
+                )
+                for key in ("requests", "prompt_tokens", "completion_tokens"):
+                    total[key] += counts[key]
+                if counts["cost"] is not None:
+                    total["cost"] = (total["cost"] or 0.0) + counts["cost"]
+
+    def summary(self):
+        """Number of calls, total, mean, and maximum seconds of each stage."""
+        stages = {}
+        for event in self.events:
+            stage = stages.setdefault(
+                event["name"], {"calls": 0, "total": 0.0, "max": 0.0}
+            )
+            stage["calls"] += 1
+            stage["total"] += event["dur"] / 1e6
+            stage["max"] = max(stage["max"], event["dur"] / 1e6)
+
+        for stage in stages.values():
+            stage["mean"] = stage["total"] / stage["calls"]
+
+        return stages
+
+    def print_summary(self):
+        """Print a table of stages by total time followed by token usage."""
+        stages = sorted(
+            self.summary().items(), key=lambda item: item[1]["total"], reverse=True
+        )
+
+        print(
+            f"{'stage':<24}{'calls':>8}{'total (s)':>12}{'mean (s)':>12}{'max (s)':>12}"
+        )
+        for name, stage in stages:
+            print(
+                f"{name:<24}{stage['calls']:>8}{stage['total']:>12.4f}"
+                + f"{stage['mean']:>12.4f}{stage['max']:>12.4f}"
+            )
+
+        for model, usage in self.usage.items():
+            cost = f", ${usage['cost']:.4f}" if usage["cost"] is not None else ""
+            print(
+                f"{model}: {usage['requests']} requests, "
+                + f"{usage['prompt_tokens']} prompt tokens, "
+                + f"{usage['completion_tokens']} completion tokens{cost}"
+            )
+
+    def write_trace(self, trace_path):
+        """Write spans in the Chrome trace event format with the summary and usage."""
+        with open(trace_path, "w") as trace_file:
+            json.dump(
+                {
+                    "traceEvents": self.events,
+                    "displayTimeUnit": "ms",
+                    "summary": self.summary(),
+                    "usage": self.usage,
+                },
+                trace_file,
+            )
+
+
+_profiler = None
+
+
+def set_profiler(profiler):
+    """
+    Set the active profiler. Any object with span and add_usage
+    methods can be used, and None disables instrumentation.
+    """
+    global _profiler
+    _profiler = profiler
+
+
+def get_profiler():
+    """Return the active profiler, or None."""
+    return _profiler
+
+
+def span(name, **args):
+    """Span of the active profiler, or a no-op context without one."""
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.span(name, **args)
+
+
+def record_usage(model, prompt_tokens=0, completion_tokens=0, cost=None):
+    """Add token usage to the active profiler, if any."""
+    if _profiler is not None:
+        _profiler.add_usage(model, prompt_tokens, completion_tokens, cost)
+
+
+@contextlib.contextmanager
+def profiling(trace_path=None):
+    """
+    Profile the enclosed block when trace_path is set, then print the
+    summary table and write the trace to trace_path.
+    """
+    if not trace_path:
+        yield None
+        return
+
+    profiler = Profiler()
+    set_profiler(profiler)
+
+    try:
+        yield profiler
+    finally:
+        set_profiler(None)
+        profiler.print_summary()
+        profiler.write_trace(trace_path)
+        print(f"Profile written to {trace_path}")
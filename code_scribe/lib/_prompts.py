@@ -0,0 +1,255 @@
+from code_scribe import lib
+
+INSPECT_PREAMBLE = (
+    "I will give you source code from a set of files that\n"
+    + "belong to a scientific computing codebase. I want you\n"
+    + "to understand the source code and answer a query that\n"
+    + "follows. Source code for each will be separated using\n"
+    + "elements <filename> ... </filename>. Additional\n"
+    + "information related to the project structure may also be\n"
+    + "provided within <index> ... </index>. This information will\n"
+    + "contain an index of subroutines, functions, and modules contained\n"
+    + "in each file. Note that you will find subroutines and functions\n"
+    + "repeat along nodes in the directory tree. This maybe due to a directory-based\n"
+    + "inheritance design implemented by the project. If the index element is not\n"
+    + "present, then you may ignore it. The query prompt will be provided at the end\n"
+    + "using elements <query> ... </query>.\n\n"
+)
+
+REDUCE_PREAMBLE = (
+    "I asked the same query about several parts of a scientific computing\n"
+    + "codebase. The answer for each part is given within elements\n"
+    + "<part> ... </part>. Combine them into a single answer to the query\n"
+    + "that follows using elements <query> ... </query>.\n\n"
+)
+
+
+def token_budget(neural_model):
+    """
+    Return the context length of a model, the number of tokens reserved
+    for generation, and the remaining prompt budget. Returns None for
+    models without a known context length.
+    """
+    context_length = getattr(neural_model, "context_length", None)
+
+    if not context_length:
+        return None
+
+    generation = None
+    for attr in ("max_tokens", "max_new_tokens", "max_gen_len"):
+        generation = getattr(neural_model, attr, None)
+        if generation:
+            break
+
+    reserved = min(generation or context_length // 4, context_length // 2)
+
+    return context_length, reserved, context_length - reserved
+
+
+def source_block(fsource):
+    """Full source code of a file within <filename> elements."""
+    with open(fsource, "r") as sfile:
+        source_code = sfile.read()
+
+    if not source_code:
+        return ""
+
+    return "\n" + f"<{fsource}>\n" + source_code + f"</{fsource}>\n"
+
+
+def summary_block(fsource):
+    """Summary of the constructs in a file within <filename> elements."""
+    summary = []
+
+    for construct in lib.extract_fortran_meta(fsource):
+        arguments = [arg for arg in construct["argument_list"] if arg]
+        variables = [var for var in construct["variables_declared"] if var]
+
+        line = f"{construct['type']} {construct['name']}"
+        if arguments:
+            line += f"({', '.join(arguments)})"
+        if variables:
+            line += f" declares {', '.join(variables)}"
+        summary.append(line)
+
+    return (
+        "\n"
+        + f"<{fsource}>\n<summary>\n"
+        + "\n".join(summary)
+        + f"\n</summary>\n</{fsource}>\n"
+    )
+
+
+def index_block(filtered_file_index):
+    """Index of constructs used by a set of files within <index> elements."""
+    if not filtered_file_index:
+        return ""
+
+    lines = []
+    for construct, file_path in filtered_file_index.items():
+        if isinstance(file_path, list):
+            file_path = ", ".join(file_path)
+        lines.append(f"{construct}: {file_path}\n")
+
+    return "<index>\n" + "".join(lines) + "</index>\n\n"
+
+
+def query_block(query_prompt):
+    """Query prompt within <query> elements."""
+    return "\n" + f"<query>\n" + query_prompt + f"\n</query>\n"
+
+
+def inspect_template(blocks, filtered_file_index, query_prompt, part=None):
+    """Assemble an inspect chat template from file blocks, index, and query."""
+    content = [INSPECT_PREAMBLE]
+    content.extend(blocks)
+    content.append(index_block(filtered_file_index))
+
+    if part:
+        content.append(
+            f"\nThese files are part {part[0]} of {part[1]} of the files for this query. "
+            + "Answer using the files in this part only.\n"
+        )
+
+    content.append(query_block(query_prompt))
+
+    return [{"role": "user", "content": "".join(content)}]
+
+
+def reduce_template(responses, query_prompt):
+    """Assemble a chat template that combines answers for each part of a query."""
+    content = [REDUCE_PREAMBLE]
+    content.extend(f"<part>\n{response}\n</part>\n" for response in responses)
+    content.append(query_block(query_prompt))
+
+    return [{"role": "user", "content": "".join(content)}]
+
+
+def reduce_templates(responses, query_prompt, neural_model=None, budget=None):
+    """
+    Chat templates that combine answers for each part of a query, packed in
+    order with as many answers per template as fit into the prompt budget.
+    Every template combines at least two answers, so that repeated rounds
+    of combining end with a single answer.
+    """
+    if not budget or len(responses) < 3:
+        return [reduce_template(responses, query_prompt)]
+
+    def _count(text):
+        return lib.count_tokens(neural_model, text)
+
+    fixed = _count(reduce_template([], query_prompt)[0]["content"])
+
+    groups = [[]]
+    tokens = fixed
+    for response in responses:
+        part = _count(f"<part>\n{response}\n</part>\n")
+        if len(groups[-1]) >= 2 and tokens + part > budget:
+            groups.append([])
+            tokens = fixed
+        groups[-1].append(response)
+        tokens += part
+
+    # A lone answer at the end joins the group before it
+    if len(groups) > 1 and len(groups[-1]) < 2:
+        groups[-2].extend(groups.pop())
+
+    return [reduce_template(group, query_prompt) for group in groups]
+
+
+def build_inspect_prompts(filelist, query_prompt, file_index={}, neural_model=None):
+    """
+    Build inspect chat templates for a list of files within the token budget
+    of the model.
+
+    Files are packed in order into as few prompts as fit the budget. A file
+    that does not fit into a prompt on its own is replaced by a summary from
+    extract_fortran_meta, and left out with a warning if even the summary
+    does not fit. When more than one prompt is needed, each prompt
+    covers a part of the files and the answers are meant to be combined with
+    reduce_template.
+
+    Returns:
+        list: Chat templates, one per part.
+        dict: Plan with the token budget, prompt sizes, and summarized and
+              dropped files.
+    """
+    entries = []
+    with lib.span("read_sources", files=len(filelist)):
+        for fsource in filelist:
+            filtered = (
+                lib.filter_file_indexes(fsource, file_index) if file_index else {}
+            )
+            entries.append((fsource, source_block(fsource), filtered))
+
+    budget = token_budget(neural_model) if neural_model else None
+
+    if budget is None:
+        filtered_file_index = {}
+        for _, _, filtered in entries:
+            filtered_file_index.update(filtered)
+
+        template = inspect_template(
+            [block for _, block, _ in entries], filtered_file_index, query_prompt
+        )
+        return [template], {"budget": None, "summarized": [], "dropped": []}
+
+    context_length, reserved, prompt_budget = budget
+
+    def _count(text):
+        return lib.count_tokens(neural_model, text)
+
+    # Tokens needed for the preamble, query, and part note of every prompt
+    fixed = _count(inspect_template([], {}, query_prompt, part=(1, 1))[0]["content"])
+
+    groups = []
+    group = {"blocks": [], "index": {}, "tokens": fixed}
+    summarized = []
+    dropped = []
+
+    with lib.span("pack_prompts"):
+        for fsource, block, filtered in entries:
+            tokens = _count(block) + _count(index_block(filtered))
+
+            if fixed + tokens > prompt_budget:
+                block = summary_block(fsource)
+                tokens = _count(block) + _count(index_block(filtered))
+
+                if fixed + tokens > prompt_budget:
+                    print(
+                        f"Warning: leaving out {fsource}, a prompt with its summary "
+                        + f"needs {fixed + tokens} tokens, over the budget of "
+                        + f"{prompt_budget}"
+                    )
+                    dropped.append(fsource)
+                    continue
+
+                summarized.append(fsource)
+
+            if group["blocks"] and group["tokens"] + tokens > prompt_budget:
+                groups.append(group)
+                group = {"blocks": [], "index": {}, "tokens": fixed}
+
+            group["blocks"].append(block)
+            group["index"].update(filtered)
+            group["tokens"] += tokens
+
+    groups.append(group)
+
+    templates = []
+    for ipart, group in enumerate(groups):
+        part = (ipart + 1, len(groups)) if len(groups) > 1 else None
+        templates.append(
+            inspect_template(group["blocks"], group["index"], query_prompt, part)
+        )
+
+    plan = {
+        "budget": prompt_budget,
+        "context_length": context_length,
+        "reserved": reserved,
+        "prompt_tokens": [_count(template[0]["content"]) for template in templates],
+        "summarized": summarized,
+        "dropped": dropped,
+    }
+
+    return templates, plan
@@ -0,0 +1,312 @@
+import re
+
+# Patterns are compiled once at import and only applied to lines that
+# pass a cheap substring check, since most lines match none of them
+INFO_SUBROUTINE = re.compile(r"subroutine\s+(\w+)")
+INFO_FUNCTION = re.compile(r"function\s+(\w+)")
+
+USE_STATEMENT = re.compile(r"^\s*use\s+(\w+)", re.IGNORECASE)
+CALL_STATEMENT = re.compile(r"^\s*call\s+(\w+)", re.IGNORECASE)
+
+CONSTRUCT_START = re.compile(r"^\s*(subroutine|function|module)\s+(\w+)", re.IGNORECASE)
+ARGUMENT_LIST = re.compile(r"\((.*?)\)")
+VARIABLE_DECLARATION = re.compile(
+    r"^\s*(integer|real|double\s*precision|character|logical)\s+([\w\s,]*)",
+    re.IGNORECASE,
+)
+
+DRAFT_USE = re.compile(r"\buse\s+(\w+)", re.IGNORECASE)
+
+# Boundaries of program units and procedures for splitting files into chunks
+UNIT_START = re.compile(r"^(module|program)\s+(\w+)\s*(?:!.*)?$", re.IGNORECASE)
+PROCEDURE_START = re.compile(
+    r"^(?:(?:pure|elemental|impure|recursive|module)\s+"
+    + r"|(?:integer|real|logical|character|complex|double\s*precision|type\s*\(\s*\w+\s*\))"
+    + r"(?:\s*\([^)]*\))?\s+)*(subroutine|function)\s+(\w+)",
+    re.IGNORECASE,
+)
+END_STATEMENT = re.compile(
+    r"^end(?:\s*(?:subroutine|function|module|program)(?:\s+\w+)?)?\s*(?:!.*)?$",
+    re.IGNORECASE,
+)
+SPLIT_COMMENT = re.compile(r"^(?:\s*!|[cC*](?:\s|$))")
+CONTAINS_STATEMENT = re.compile(r"^contains\s*(?:!.*)?$", re.IGNORECASE)
+INTERFACE_START = re.compile(r"^(?:abstract\s+)?interface\b", re.IGNORECASE)
+INTERFACE_END = re.compile(r"^end\s*interface\b", re.IGNORECASE)
+
+# Draft substitutions as (guard, pattern, replacement). The guard is a
+# lowercase substring that must be present for the pattern to match, and
+# the substitutions are applied in order to the output of the previous one
+DRAFT_SUBSTITUTIONS = [
+    ("implicit none", re.compile(r"implicit none"), ""),
+    ("integer", re.compile(r"\binteger\b\s*", re.IGNORECASE), "int"),
+    (
+        "real",
+        re.compile(
+            r"\breal\s*(\(\s*kind\s*=\s*\w+\s*\)|\(\s*\w+\s*\)|)?\s*", re.IGNORECASE
+        ),
+        "double",
+    ),
+    (
+        "complex",
+        re.compile(r"\bcomplex\s*\(\s*dp\s*\)\s*", re.IGNORECASE),
+        "complex<double> ",
+    ),
+    (
+        "complex",
+        re.compile(r"\bcomplex\s*\(\s*integer\s*\)\s*", re.IGNORECASE),
+        "complex<int> ",
+    ),
+    (
+        "complex",
+        re.compile(r"\bcomplex\s*\(\s*logical\s*\)\s*", re.IGNORECASE),
+        "complex<bool> ",
+    ),
+    ("::", re.compile(r"(?<!std::)\s*::"), ""),
+    (
+        "complex<",
+        re.compile(r"\bcomplex<([^>]+)>\s*(\w+)\s*\((.*?)\)\s*"),
+        r"FArray<std::complex<\1>> \2(\3)",
+    ),
+    (
+        "dimension",
+        re.compile(
+            r"\b(real|double|int|bool|complex<[^>]+>)\s*,?\s*dimension\s*\((.*?)\)\s*(\w+)\s*;",
+            re.IGNORECASE,
+        ),
+        r"FArray<\1> \3(\2)",
+    ),
+    (
+        ";",
+        re.compile(
+            r"\b(real|double|int|bool|complex<[^>]+>)\s*(\w+)\s*\((.*?)\)\s*;",
+            re.IGNORECASE,
+        ),
+        r"FArray<\1> \2(\3)",
+    ),
+    ("&", re.compile(r"^\s*&"), r"\\"),
+    ("&", re.compile(r"\s*&\s*$"), r" \\"),
+    ("**", re.compile(r"(\w+)\s*\*\*\s*(\d+)"), r"pow(\1,\2)"),
+]
+
+
+def draft_line(line):
+    """Apply the draft substitutions to a single line of Fortran code."""
+    lowered = line.lower()
+
+    for guard, pattern, replacement in DRAFT_SUBSTITUTIONS:
+        if guard in lowered:
+            substituted = pattern.sub(replacement, line)
+            if substituted != line:
+                line = substituted
+                lowered = line.lower()
+
+    return line
+
+
+def draft_statement(line):
+    """
+    Draft conversion of a line that is not a comment. Returns the header
+    include that the line needs, or None, and the converted line.
+    """
+    match = DRAFT_USE.match(line.strip())
+    if match:
+        return (
+            f"#include <{match.group(1)}.hpp>",
+            f"using namespace {match.group(1)};\n",
+        )
+
+    return None, draft_line(line).strip() + "\n"
+
+
+def is_comment(stripped_line):
+    """Check if a stripped line is a comment for the purpose of drafts and prompts."""
+    lowered = stripped_line.lower()
+    return lowered.startswith(("c", "!!", "!")) and not lowered.startswith("complex")
+
+
+def scan_fortran_file(sfile, draft=False, draft_file=None, meta=True):
+    """
+    Scan a Fortran file once and extract everything that the index,
+    inspect, and draft commands need. The file is read one line at a time.
+    When draft_file is supplied, draft lines are written to it as they are
+    converted instead of being kept in "content". With meta=False construct
+    declarations are not collected, which keeps memory proportional to the
+    number of construct names for callers that do not need them.
+
+    Returns:
+        dict: With keys
+            "modules", "subroutines", "functions": declared construct names,
+            "uses", "calls": sets of used module and called subroutine names,
+            "meta": constructs with declared variables and argument lists,
+            "headers", "content": draft header includes and lines if draft=True.
+    """
+    scan = {
+        "modules": [],
+        "subroutines": [],
+        "functions": [],
+        "uses": set(),
+        "calls": set(),
+        "meta": [],
+    }
+
+    if draft or draft_file:
+        draft = True
+        scan["headers"] = {"#include <cmath>", "#include <complex>"}
+        scan["content"] = []
+        emit = draft_file.write if draft_file else scan["content"].append
+
+    current_construct = None
+
+    with open(sfile, "r") as source:
+        for line in source:
+            stripped_line = line.strip()
+            lowered = stripped_line.lower()
+
+            # Declared constructs
+            if lowered.startswith("module "):
+                scan["modules"].append(lowered.split()[1])
+            elif lowered.startswith("subroutine "):
+                match = INFO_SUBROUTINE.match(lowered)
+                if match:
+                    scan["subroutines"].append(match.group(1))
+            elif lowered.startswith("function "):
+                match = INFO_FUNCTION.match(lowered)
+                if match:
+                    scan["functions"].append(match.group(1))
+
+            # Used modules and called subroutines
+            if lowered.startswith("use"):
+                match = USE_STATEMENT.match(stripped_line)
+                if match:
+                    scan["uses"].add(match.group(1).lower())
+            elif lowered.startswith("call"):
+                match = CALL_STATEMENT.match(stripped_line)
+                if match:
+                    scan["calls"].add(match.group(1).lower())
+
+            # Construct boundaries, argument lists, and declarations
+            if meta and lowered.startswith(("subroutine", "function", "module")):
+                match = CONSTRUCT_START.match(stripped_line)
+                if match:
+                    current_construct = {
+                        "name": match.group(2),
+                        "type": match.group(1).lower(),
+                        "variables_declared": [],
+                        "argument_list": [],
+                    }
+                    scan["meta"].append(current_construct)
+
+                    if current_construct["type"] in ["function", "subroutine"]:
+                        args_match = ARGUMENT_LIST.search(stripped_line)
+                        if args_match:
+                            current_construct["argument_list"].extend(
+                                arg.strip() for arg in args_match.group(1).split(",")
+                            )
+
+            if meta and lowered.startswith(
+                ("integer", "real", "double", "character", "logical")
+            ):
+                match = VARIABLE_DECLARATION.match(stripped_line)
+                if match and current_construct:
+                    current_construct["variables_declared"].extend(
+                        var.strip() for var in match.group(2).split(",")
+                    )
+
+            # Line-by-line draft conversion
+            if draft and not is_comment(stripped_line):
+                header, text = draft_statement(line)
+                if header:
+                    scan["headers"].add(header)
+                emit(text)
+
+    return scan
+
+
+def split_fortran_file(sfile):
+    """
+    Split a Fortran file into chunks at construct boundaries. Each module
+    procedure, top level subroutine, function, and program is a chunk, and
+    the specification part of a module together with its end statement is
+    a chunk of its own. Internal procedures and interface blocks stay in the
+    chunk that contains them, and comments between constructs are attached
+    to the construct that follows them.
+
+    Returns:
+        list: Chunks in source order as dicts with keys "name", "type",
+              "module" (name of the enclosing module or None), and "lines".
+    """
+    chunks = []
+    stack = []
+    loose = []
+    interface_depth = 0
+    contains = False
+
+    with open(sfile, "r") as source:
+        for line in source:
+            stripped_line = line.strip()
+
+            # Innermost open chunk, nested constructs are pushed as None
+            chunk = next((item for _, item in reversed(stack) if item), None)
+            in_module = bool(stack) and stack[-1][0] == "module"
+
+            if not stripped_line or SPLIT_COMMENT.match(line):
+                if chunk is None or (in_module and contains):
+                    loose.append(line)
+                else:
+                    chunk["lines"].append(line)
+                continue
+
+            start = UNIT_START.match(stripped_line) or PROCEDURE_START.match(
+                stripped_line
+            )
+
+            if interface_depth or INTERFACE_START.match(stripped_line):
+                if INTERFACE_START.match(stripped_line):
+                    interface_depth += 1
+                elif INTERFACE_END.match(stripped_line):
+                    interface_depth -= 1
+
+            elif start:
+                construct_type = start.group(1).lower()
+
+                if not stack or (in_module and len(stack) == 1):
+                    chunk = {
+                        "name": start.group(2),
+                        "type": construct_type,
+                        "module": stack[0][1]["name"] if stack else None,
+                        "lines": loose + [line],
+                    }
+                    chunks.append(chunk)
+                    stack.append((construct_type, chunk))
+                    loose = []
+                    if construct_type == "module":
+                        contains = False
+                else:
+                    chunk["lines"].append(line)
+                    stack.append((construct_type, None))
+                continue
+
+            elif in_module and CONTAINS_STATEMENT.match(stripped_line):
+                contains = True
+
+            elif stack and END_STATEMENT.match(stripped_line):
+                if in_module:
+                    chunk["lines"].extend(loose)
+                    loose = []
+                chunk["lines"].append(line)
+                stack.pop()
+                continue
+
+            if chunk is None:
+                loose.append(line)
+            else:
+                chunk["lines"].append(line)
+
+    if loose:
+        if chunks:
+            chunks[-1]["lines"].extend(loose)
+        else:
+            chunks.append({"name": None, "type": None, "module": None, "lines": loose})
+
+    return chunks
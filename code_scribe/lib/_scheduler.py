@@ -0,0 +1,100 @@
+import os
+
+from code_scribe import lib
+
+
+def dependency_graph(filelist):
+    """
+    Build the dependency graph of a list of Fortran files from the modules
+    they use and the subroutines they call. Only dependencies on files within
+    the list are kept. When a called subroutine is defined in several files,
+    definitions in the directory of the caller take precedence.
+
+    Returns:
+        dict: File path to the set of file paths it depends on.
+    """
+    scans = {
+        fsource: lib.scan_fortran_file(fsource, meta=False) for fsource in filelist
+    }
+
+    definitions = {}
+    for fsource, scan in scans.items():
+        for construct_type in ("modules", "subroutines", "functions"):
+            for name in scan[construct_type]:
+                definitions.setdefault((construct_type, name), []).append(fsource)
+
+    graph = {}
+    for fsource, scan in scans.items():
+        dependencies = set()
+
+        for construct_type, names in (
+            ("modules", scan["uses"]),
+            ("subroutines", scan["calls"]),
+        ):
+            for name in names:
+                providers = definitions.get((construct_type, name), [])
+                local = [
+                    provider
+                    for provider in providers
+                    if os.path.dirname(provider) == os.path.dirname(fsource)
+                ]
+                dependencies.update(local or providers)
+
+        dependencies.discard(fsource)
+        graph[fsource] = dependencies
+
+    return graph
+
+
+def topological_waves(graph):
+    """
+    Group the files of a dependency graph into waves. Files in a wave only
+    depend on files in earlier waves and can be translated in parallel.
+    Files on a dependency cycle are placed together in a final wave.
+
+    Returns:
+        list: Waves as lists of file paths, in the order of the graph.
+        list: Files on the critical path, the longest chain of dependencies.
+    """
+    level = {}
+    previous = {}
+    remaining = list(graph)
+
+    while remaining:
+        ready = [
+            fsource
+            for fsource in remaining
+            if all(dependency in level for dependency in graph[fsource])
+        ]
+
+        if not ready:
+            print(
+                f"Dependency cycle between {len(remaining)} file(s), "
+                + "translating them in a single wave"
+            )
+            wave = max(level.values(), default=-1) + 1
+            for fsource in remaining:
+                level[fsource] = wave
+            break
+
+        for fsource in ready:
+            level[fsource] = 0
+            for dependency in graph[fsource]:
+                if level[dependency] + 1 > level[fsource]:
+                    level[fsource] = level[dependency] + 1
+                    previous[fsource] = dependency
+
+        remaining = [fsource for fsource in remaining if fsource not in level]
+
+    waves = [[] for _ in range(max(level.values(), default=-1) + 1)]
+    for fsource in graph:
+        waves[level[fsource]].append(fsource)
+
+    critical_path = []
+    if waves:
+        fsource = waves[-1][0]
+        while fsource is not None:
+            critical_path.insert(0, fsource)
+            fsource = previous.get(fsource)
+
+    return waves, critical_path
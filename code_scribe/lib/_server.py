@@ -0,0 +1,185 @@
+import json
+import time
+import queue
+import threading
+
+from code_scribe import lib
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8470
+
+
+class ModelServer:
+    """
+    Keep a neural model resident and serve chat requests from several
+    clients. Requests are queued and a single worker groups requests that
+    arrive within batch_wait seconds into one batched generation call.
+    """
+
+    def __init__(self, neural_model, batch_size=8, batch_wait=0.05):
+        self.neural_model = neural_model
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.queue = queue.Queue()
+
+        self._worker = threading.Thread(target=self._process, daemon=True)
+        self._worker.start()
+
+    def submit(self, chat_template):
+        """Queue a chat template and return a future for its response."""
+        from concurrent.futures import Future
+
+        future = Future()
+        self.queue.put((chat_template, future))
+        return future
+
+    def info(self):
+        """Model signature and token budget for clients."""
+        budget = lib.token_budget(self.neural_model)
+
+        return {
+            "signature": lib.model_signature(self.neural_model),
+            "context_length": budget[0] if budget else None,
+            "reserved": budget[1] if budget else None,
+        }
+
+    def _process(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.batch_wait
+
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                results = lib.model_chat_batch(
+                    self.neural_model, [chat_template for chat_template, _ in batch]
+                )
+                for (_, future), result in zip(batch, results):
+                    if isinstance(result, BaseException):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+
+
+def serve_model(model, host=DEFAULT_HOST, port=DEFAULT_PORT, batch_size=8):
+    """
+    Load a model once and serve it over HTTP until interrupted.
+
+    Endpoints:
+        GET  /info        model signature and token budget
+        POST /chat        {"messages": chat_template} -> {"content": str}
+        POST /chat_batch  {"batch": [chat_template]} -> {"contents": [str]}
+        POST /tokens      {"text": str} -> {"count": int}
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    model_server = ModelServer(lib.load_model(model), batch_size=batch_size)
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/info":
+                self._reply(200, model_server.info())
+            else:
+                self._reply(404, {"error": f"Unknown endpoint {self.path}"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+
+            try:
+                if self.path == "/chat":
+                    result = model_server.submit(request["messages"]).result()
+                    self._reply(200, {"content": result})
+
+                elif self.path == "/chat_batch":
+                    futures = [model_server.submit(item) for item in request["batch"]]
+                    self._reply(
+                        200, {"contents": [future.result() for future in futures]}
+                    )
+
+                elif self.path == "/tokens":
+                    count = lib.count_tokens(model_server.neural_model, request["text"])
+                    self._reply(200, {"count": count})
+
+                else:
+                    self._reply(404, {"error": f"Unknown endpoint {self.path}"})
+
+            except Exception as error:
+                self._reply(500, {"error": str(error)})
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    print(f"Serving {model} on http://{host}:{port}")
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+class ServerModel:
+    """Client for a model served with serve_model."""
+
+    def __init__(self, url, timeout=None):
+        if "://" not in url:
+            url = f"http://{url}"
+
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+        info = self._request("/info")
+        self._signature = info["signature"]
+        self.context_length = info["context_length"]
+        self.max_tokens = info["reserved"]
+
+        # The server queues requests, connection and server errors are retried
+        self.limiter = lib.RateLimiter()
+        self.max_retries = 3
+        self.retry_errors = (OSError,)
+
+    def _request(self, endpoint, payload=None):
+        import urllib.request
+
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        request = urllib.request.Request(
+            self.url + endpoint,
+            data=data,
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def chat(self, chat_template):
+        return self._request("/chat", {"messages": chat_template})["content"]
+
+    def chat_batch(self, chat_templates):
+        return self._request("/chat_batch", {"batch": chat_templates})["contents"]
+
+    def count_tokens(self, text):
+        return self._request("/tokens", {"text": text})["count"]
+
+    def signature(self):
+        return self._signature